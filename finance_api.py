@@ -0,0 +1,201 @@
+# Local JSON API over financeapp.py's helpers, for scripts and the mobile client.
+#
+#   python finance_api.py --port 8765
+#   curl -H "Authorization: Bearer <token>" http://127.0.0.1:8765/api/transactions?limit=50
+#
+# Tokens are created per user under Settings -> API access. Every response carries an ETag built from the user's
+# data version (plus the quote timestamps for price-dependent resources); a client that sends it back in
+# If-None-Match gets an empty 304 without the payload being computed at all.
+import json
+import base64
+import argparse
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pandas as pd
+
+import financeapp as app
+
+API_DEFAULT_PORT = 8765
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_HISTORY_DAYS = (30, 90, 180, 365)
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def frame_records(df):
+    # NaN -> null, timestamps -> ISO strings, categoricals -> their labels
+    return json.loads(df.to_json(orient='records', date_format='iso')) if not df.empty else []
+
+def encode_cursor(tday, row_id):
+    return base64.urlsafe_b64encode(f'{tday}:{row_id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        tday, row_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(':')
+        return int(tday), int(row_id)
+    except Exception:
+        raise ApiError(400, 'Invalid cursor')
+
+def query_value(query, name, default=None):
+    values = query.get(name)
+    return values[-1] if values else default
+
+def query_int(query, name, default, low, high):
+    try:
+        value = int(query_value(query, name, default))
+    except ValueError:
+        raise ApiError(400, f'{name} must be an integer')
+    return min(max(value, low), high)
+
+def query_date(query, name):
+    value = query_value(query, name)
+    if value is None:
+        return None
+    try:
+        return pd.Timestamp(value)
+    except ValueError:
+        raise ApiError(400, f'{name} must be a date (YYYY-MM-DD)')
+
+# --- Resources: (user_id, query) -> JSON-serializable payload ---
+
+def holdings_resource(user_id, query):
+    base_currency = query_value(query, 'base_currency') or app.get_base_currency(user_id)
+    holdings = app.get_holdings(user_id=user_id)
+    if holdings.empty:
+        return {'base_currency': base_currency, 'items': []}
+    holdings = app.value_holdings(holdings, base_currency)
+    columns = ['symbol', 'shares', 'currency', 'avg_price', 'price', 'cost_basis_base', 'market_value', 'unrealized_pnl', 'realized_pnl_base']
+    return {'base_currency': base_currency, 'items': frame_records(holdings[columns].round(4))}
+
+def transactions_resource(user_id, query):
+    # Newest first; next_cursor continues after the last item (keyset pagination, stable under inserts)
+    limit = query_int(query, 'limit', API_PAGE_SIZE, 1, API_MAX_PAGE_SIZE)
+    cursor = query_value(query, 'cursor')
+    ttype = query_value(query, 'type')
+    if ttype is not None and ttype not in app.TTYPE_LABELS:
+        raise ApiError(400, f"type must be one of {', '.join(app.TTYPE_LABELS)}")
+    df = app.query_transactions(start=query_date(query, 'start'), end=query_date(query, 'end'), ttype=ttype,
+                                categories=query.get('category'), limit=limit + 1, user_id=user_id,
+                                cursor=decode_cursor(cursor) if cursor else None)
+    if df.empty:
+        return {'items': [], 'next_cursor': None}
+    page = df.head(limit)
+    next_cursor = encode_cursor(int(page['tday'].iloc[-1]), int(page['id'].iloc[-1])) if len(df) > limit else None
+    items = page[['id', 'tdate', 'ttype', 'category', 'amount', 'note']].assign(tdate=page['tdate'].dt.strftime('%Y-%m-%d'))
+    return {'items': frame_records(items), 'next_cursor': next_cursor}
+
+def goals_resource(user_id, query):
+    goals = app.refresh_goal_allocations(user_id)
+    return {'items': frame_records(goals.drop(columns=['user_id'], errors='ignore'))}
+
+def summary_resource(user_id, query):
+    start, end = query_date(query, 'start'), query_date(query, 'end')
+    income, expenses = app.get_income_expense_totals(start, end, user_id=user_id)
+    by_category = app.query_transactions(start=start, end=end, ttype='expense', group_by='category', user_id=user_id)
+    if not by_category.empty:
+        by_category = by_category[['category', 'amount', 'count']].sort_values('amount', ascending=False)
+    return {
+        'start': start.date().isoformat() if start is not None else None,
+        'end': end.date().isoformat() if end is not None else None,
+        'income': round(float(income), 2),
+        'expenses': round(float(expenses), 2),
+        'net': round(float(income - expenses), 2),
+        'savings_rate': round((income - expenses) / income * 100, 1) if income > 0 else None,
+        'expenses_by_category': frame_records(by_category),
+    }
+
+def portfolio_resource(user_id, query):
+    base_currency = query_value(query, 'base_currency') or app.get_base_currency(user_id)
+    holdings = app.get_holdings(user_id=user_id)
+    payload = {'base_currency': base_currency, 'market_value': 0.0, 'unrealized_pnl': 0.0,
+               'realized_pnl': round(float(app.realized_pnl_total(base_currency, user_id=user_id)), 2), 'history': []}
+    if holdings.empty:
+        return payload
+    valued = app.value_holdings(holdings, base_currency)
+    payload['market_value'] = round(float(valued['market_value'].sum()), 2)
+    payload['unrealized_pnl'] = round(float(valued['unrealized_pnl'].sum()), 2)
+    history_days = query_value(query, 'history_days')
+    if history_days is not None:
+        days = query_int(query, 'history_days', 90, 1, max(API_HISTORY_DAYS))
+        history = app.build_portfolio_history(holdings, days, base_currency)
+        if not history.empty:
+            payload['history'] = frame_records(history.round(2).rename_axis('date').reset_index().assign(date=lambda d: d['date'].dt.strftime('%Y-%m-%d')))
+    return payload
+
+# path -> (resource, depends on live quotes)
+ROUTES = {
+    '/api/holdings': (holdings_resource, True),
+    '/api/transactions': (transactions_resource, False),
+    '/api/goals': (goals_resource, False),
+    '/api/summary': (summary_resource, False),
+    '/api/portfolio': (portfolio_resource, True),
+}
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = 'FinanceAppAPI/1.0'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == '/api/health':
+                return self.send_json(200, {'status': 'ok'})
+            route = ROUTES.get(url.path.rstrip('/'))
+            if route is None:
+                raise ApiError(404, 'Not found')
+            resource, uses_quotes = route
+            user_id = self.authenticate()
+            version = f'{app.get_data_version(user_id)}' + (f'.{app.held_quotes_stamp(user_id)}' if uses_quotes else '')
+            etag = f'W/"{user_id}-{version}"'
+            if etag in [tag.strip() for tag in (self.headers.get('If-None-Match') or '').split(',')]:
+                return self.send_json(304, None, etag)
+            self.send_json(200, resource(user_id, parse_qs(url.query)), etag)
+        except ApiError as e:
+            self.send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': f'Internal error: {e}'})
+
+    def authenticate(self):
+        header = self.headers.get('Authorization') or ''
+        scheme, _, token = header.partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            raise ApiError(401, 'Missing bearer token')
+        user_id = app.api_token_user(token.strip())
+        if user_id is None:
+            raise ApiError(401, 'Invalid token')
+        return user_id
+
+    def send_json(self, status, payload, etag=None):
+        body = b'' if status == 304 else json.dumps(payload).encode()
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'private, no-cache')
+        if status == 401:
+            self.send_header('WWW-Authenticate', 'Bearer')
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def main():
+    parser = argparse.ArgumentParser(description='Local JSON API for the personal finance app.')
+    parser.add_argument('--host', default='127.0.0.1', help='interface to bind (default: localhost only)')
+    parser.add_argument('--port', type=int, default=API_DEFAULT_PORT)
+    args = parser.parse_args()
+    app.ensure_db()
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    print(f'Serving the finance API on http://{args.host}:{args.port}/api/ (database: {app.DB_PATH})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,201 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import yfinance as yf
 import sqlite3
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import plotly.express as px
 import re
 import calendar
 import time
 import hashlib
+import math
 import secrets
+import bisect
+import difflib
+import os
+import sys
+import json
+import heapq
+import threading
+from collections import OrderedDict
+import email.utils
+import queue
+import glob
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import xml.etree.ElementTree as ET
+import reports
 
 # --- Constants & DB ---
-DB_PATH = "finance_app.db"
+DB_PATH = os.environ.get("FINANCE_DB_PATH", "finance_app.db")
+ALPHA_VANTAGE_URL = os.environ.get("FINANCE_ALPHA_VANTAGE_URL", "https://www.alphavantage.co/query")
+
+# Transaction types are stored as small integers (index into TTYPE_LABELS).
+TTYPE_INCOME = 0
+TTYPE_EXPENSE = 1
+TTYPE_LABELS = ['income', 'expense']
+
+# Portfolio analytics
+BENCHMARK_SYMBOL = '^NSEI'
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.065  # annual, roughly the Indian 10Y yield
+# Annualized volatility a profile is usually comfortable with
+RISK_TOLERANCE_VOLATILITY = {'low': 0.12, 'moderate': 0.20, 'high': 0.35}
+
+# Rebalancing optimizer: long-only mean-variance over the holdings plus a candidate universe
+REBALANCE_CANDIDATES = ('NIFTYBEES.NS', 'JUNIORBEES.NS', 'BANKBEES.NS', 'GOLDBEES.NS', 'LIQUIDBEES.NS')
+REBALANCE_LOOKBACK_DAYS = 730
+REBALANCE_MIN_COVERAGE = 0.6  # share of the lookback a symbol needs prices for to be considered
+REBALANCE_RETURN_SHRINKAGE = 0.5  # pull on each symbol's mean return towards the cross-sectional average
+# Mean-variance risk aversion and per-position weight cap for each risk tolerance
+RISK_AVERSION = {'low': 12.0, 'moderate': 5.0, 'high': 2.0}
+REBALANCE_MAX_WEIGHT = {'low': 0.30, 'moderate': 0.40, 'high': 0.60}
+REBALANCE_MIN_TRADE_FRACTION = 0.01  # skip trades smaller than this share of the portfolio
+
+# Shared quote refresh: pages read the quotes table, one scheduler thread per server keeps hot symbols fresh
+QUOTE_TICK_SECONDS = 1.0
+QUOTE_VISIBLE_SECONDS = 90  # a symbol counts as on screen this long after a page last read it
+QUOTE_VISIBLE_REFRESH_SECONDS = 60
+QUOTE_BACKGROUND_REFRESH_SECONDS = 300  # held by an active user but not on screen
+QUOTE_HOT_SECONDS = 900  # symbols nobody has touched for this long are dropped
+QUOTE_BATCH_SIZE = 50  # symbols per provider request
+QUOTE_REQUESTS_PER_MINUTE = 20
+QUOTE_BURST_REQUESTS = 5
+QUOTE_FIRST_WAIT_SECONDS = 5.0  # how long a page waits for a symbol that has never been quoted
+
+# Price alerts: evaluated on every quote refresh of an alerted symbol, at least this often
+PRICE_ALERT_INTERVAL_SECONDS = 300
+# kind -> (label, direction); percent kinds store an absolute threshold derived from the price when they were set
+PRICE_ALERT_KINDS = {
+    'above': ('Price rises above', 'above'),
+    'below': ('Price falls below', 'below'),
+    'pct_up': ('Rises by %', 'above'),
+    'pct_down': ('Falls by %', 'below'),
+}
+
+# Currencies
+DEFAULT_BASE_CURRENCY = 'INR'
+BASE_CURRENCIES = ('INR', 'USD', 'EUR', 'GBP', 'JPY', 'SGD', 'AED')
+CURRENCY_SYMBOLS = {'INR': '₹', 'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥'}
+# Exchanges quoting in minor units: yfinance currency -> (ISO currency, multiplier)
+MINOR_CURRENCY_UNITS = {'GBp': ('GBP', 0.01), 'ZAc': ('ZAR', 0.01), 'ILA': ('ILS', 0.01)}
+# Used when yfinance metadata has no currency for a symbol
+SYMBOL_SUFFIX_CURRENCIES = {'.NS': 'INR', '.BO': 'INR', '.L': 'GBp', '.T': 'JPY', '.HK': 'HKD', '.DE': 'EUR', '.PA': 'EUR', '.AS': 'EUR', '.TO': 'CAD', '.AX': 'AUD', '.SI': 'SGD'}
+INDEX_CURRENCIES = {'^NSEI': 'INR', '^BSESN': 'INR', '^GSPC': 'USD', '^DJI': 'USD', '^IXIC': 'USD'}
+FX_STALE_DAYS = 4  # weekends and holidays have no FX fixings
+
+# Market lookup
+SYMBOL_HISTORY_TTL = 900  # seconds a symbol's 60-day history is reused before refetching
+PRICE_HISTORY_TTL = 3600  # seconds a batched price matrix is reused before refetching
+# Bundled ticker universe for autocomplete; more can be imported from a CSV in Settings
+DEFAULT_TICKERS = [
+    ('RELIANCE.NS', 'Reliance Industries', 'NSE'), ('TCS.NS', 'Tata Consultancy Services', 'NSE'),
+    ('INFY.NS', 'Infosys', 'NSE'), ('HDFCBANK.NS', 'HDFC Bank', 'NSE'), ('ICICIBANK.NS', 'ICICI Bank', 'NSE'),
+    ('HINDUNILVR.NS', 'Hindustan Unilever', 'NSE'), ('ITC.NS', 'ITC', 'NSE'), ('SBIN.NS', 'State Bank of India', 'NSE'),
+    ('BHARTIARTL.NS', 'Bharti Airtel', 'NSE'), ('KOTAKBANK.NS', 'Kotak Mahindra Bank', 'NSE'), ('LT.NS', 'Larsen & Toubro', 'NSE'),
+    ('AXISBANK.NS', 'Axis Bank', 'NSE'), ('ASIANPAINT.NS', 'Asian Paints', 'NSE'), ('MARUTI.NS', 'Maruti Suzuki India', 'NSE'),
+    ('BAJFINANCE.NS', 'Bajaj Finance', 'NSE'), ('WIPRO.NS', 'Wipro', 'NSE'), ('HCLTECH.NS', 'HCL Technologies', 'NSE'),
+    ('SUNPHARMA.NS', 'Sun Pharmaceutical Industries', 'NSE'), ('TITAN.NS', 'Titan Company', 'NSE'),
+    ('ULTRACEMCO.NS', 'UltraTech Cement', 'NSE'), ('TATAMOTORS.NS', 'Tata Motors', 'NSE'), ('TATASTEEL.NS', 'Tata Steel', 'NSE'),
+    ('ADANIENT.NS', 'Adani Enterprises', 'NSE'), ('NTPC.NS', 'NTPC', 'NSE'), ('POWERGRID.NS', 'Power Grid Corporation of India', 'NSE'),
+    ('ONGC.NS', 'Oil and Natural Gas Corporation', 'NSE'), ('NIFTYBEES.NS', 'Nippon India ETF Nifty BeES', 'NSE'),
+    ('GOLDBEES.NS', 'Nippon India ETF Gold BeES', 'NSE'), ('^NSEI', 'NIFTY 50', 'NSE'), ('^BSESN', 'S&P BSE SENSEX', 'BSE'),
+    ('AAPL', 'Apple', 'NASDAQ'), ('MSFT', 'Microsoft', 'NASDAQ'), ('GOOGL', 'Alphabet', 'NASDAQ'), ('AMZN', 'Amazon.com', 'NASDAQ'),
+    ('META', 'Meta Platforms', 'NASDAQ'), ('NVDA', 'NVIDIA', 'NASDAQ'), ('TSLA', 'Tesla', 'NASDAQ'), ('JPM', 'JPMorgan Chase', 'NYSE'),
+    ('V', 'Visa', 'NYSE'), ('SPY', 'SPDR S&P 500 ETF Trust', 'NYSE'), ('QQQ', 'Invesco QQQ Trust', 'NASDAQ'),
+]
+
+# News: RSS/Atom (.xml, .rss, .atom) and JSON (.json, .jsonl) dumps dropped into NEWS_DIR are ingested automatically
+NEWS_DIR = "news_feeds"
+NEWS_FEED_EXTENSIONS = ('.xml', '.rss', '.atom', '.json', '.jsonl')
+NEWS_CACHE_SIZE = 5000  # most recent articles kept in memory
+NEWS_REFRESH_SECONDS = 60
+# Company-name words too generic to identify a company on their own
+NEWS_STOPWORDS = {'the', 'of', 'and', '&', 'inc', 'ltd', 'limited', 'corp', 'corporation', 'company', 'co', 'india', 'group', 'plc', 'com', 'etf', 'trust', 'holdings'}
+
+# Single-writer queue: every DB write goes through one writer thread
+WRITE_QUEUE_MAX = 1000  # pending writes before submitters block (backpressure)
+WRITE_SUBMIT_TIMEOUT = 10.0  # seconds a submitter waits for queue space before giving up
+WRITE_RESULT_TIMEOUT = 60.0  # seconds run_write waits for its job to be committed
+WRITE_BATCH_MAX = 200  # writes grouped into one transaction
+MIGRATION_CHUNK_ROWS = 200000  # legacy rows copied per committed (and checkpointed) migration step
+
+# Report generation
+REPORTS_DIR = "reports"
+REPORT_WORKERS = 2
+REPORT_JOBS_SHOWN = 10
+
+# Savings goal projections
+MONTE_CARLO_PATHS = 10000
+MONTE_CARLO_HORIZON_MONTHS = 120  # how far ahead open-ended goals are simulated
+MONTE_CARLO_SEED = 7  # fixed so the same ledger always shows the same odds
+DAYS_PER_MONTH = 365.25 / 12
+
+# Savings allocation: how net savings are shared between goals (explicit contributions are earmarked first)
+SAVINGS_STRATEGIES = {
+    'waterfall': 'Priority waterfall',
+    'deadline': 'Deadline-weighted',
+    'proportional': 'Proportional to what is left',
+}
+DEFAULT_SAVINGS_STRATEGY = 'waterfall'
+GOAL_PRIORITIES = (1, 2, 3, 4, 5)  # 1 is filled first by the waterfall
+DEFAULT_GOAL_PRIORITY = 3
+OPEN_GOAL_MONTHS = 60  # how far away a goal without a deadline counts for deadline-weighted allocation
+
+# Spending forecasts (Holt's linear exponential smoothing over monthly category totals)
+FORECAST_ALPHA = 0.5  # level smoothing
+FORECAST_BETA = 0.2  # trend smoothing
+FORECAST_MIN_MONTHS = 2  # complete months of history before a category gets forecasts
+FORECAST_OVERSPEND_MARGIN = 0.10  # warn when this month's pace runs this far over the forecast
+
+# Charts: one point per horizontal pixel of a full-width chart is all a browser can show
+CHART_WIDTH_PX = 1200
+MAX_CHART_POINTS = CHART_WIDTH_PX
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # serialized figures kept across reruns, least recently used evicted first
+
+# Ledger archival: closed years are moved out of the hot table, then the database is analyzed and vacuumed
+MAINTENANCE_INTERVAL_DAYS = 7
+MAINTENANCE_CHECK_SECONDS = 3600
+
+# Transaction search results per page
+SEARCH_PAGE_SIZE = 25
+
+# Category budgets
+DEFAULT_BUDGET_ALERT_THRESHOLD = 0.8  # warn once this share of a monthly limit is spent
+
+# Month index (year * 12 + month - 1) of a transactions row's tday, as SQL
+SQL_MONTH_INDEX = "CAST(strftime('%Y', tday * 86400, 'unixepoch') AS INTEGER) * 12 + CAST(strftime('%m', tday * 86400, 'unixepoch') AS INTEGER) - 1"
+
+# Recurring transaction detection: cadence -> (period in days, tolerance in days, minimum occurrences)
+RECURRING_CADENCES = {'weekly': (7.0, 1.5, 4), 'monthly': (30.44, 4.0, 3), 'yearly': (365.25, 20.0, 2)}
+RECURRING_AMOUNT_TOLERANCE = 0.05  # amounts within ~5% of each other share a bucket
+# Auto-categorization: keyword -> category defaults, applied after the user's own rules and past choices
+DEFAULT_CATEGORY_RULES = {
+    'groceries': ['grocery', 'groceries', 'supermarket', 'bigbasket', 'dmart', 'blinkit', 'zepto', 'instamart', 'reliance fresh', 'more retail', 'kirana', 'vegetables'],
+    'dining': ['swiggy', 'zomato', 'restaurant', 'cafe', 'starbucks', 'dominos', 'mcdonalds', 'kfc', 'pizza', 'burger', 'dine', 'eatery'],
+    'transport': ['uber', 'ola', 'rapido', 'metro', 'irctc', 'railway', 'petrol', 'diesel', 'fuel', 'fastag', 'parking', 'taxi', 'bus'],
+    'travel': ['makemytrip', 'goibibo', 'indigo', 'air india', 'vistara', 'airbnb', 'hotel', 'booking com', 'cleartrip', 'flight'],
+    'utilities': ['electricity', 'bescom', 'water bill', 'gas bill', 'broadband', 'airtel', 'jio', 'vodafone', 'bsnl', 'dth', 'recharge', 'wifi'],
+    'rent': ['rent', 'landlord', 'house rent', 'maintenance'],
+    'entertainment': ['netflix', 'spotify', 'prime video', 'hotstar', 'youtube premium', 'bookmyshow', 'pvr', 'inox', 'gaming', 'steam'],
+    'shopping': ['amazon', 'flipkart', 'myntra', 'ajio', 'nykaa', 'meesho', 'decathlon', 'ikea', 'croma'],
+    'health': ['pharmacy', 'apollo', 'medplus', 'hospital', 'clinic', 'doctor', 'diagnostic', 'lab test', 'gym', 'cult fit', 'medicine'],
+    'insurance': ['insurance', 'lic', 'premium policy', 'policybazaar'],
+    'education': ['tuition', 'school fee', 'college fee', 'udemy', 'coursera', 'books', 'course'],
+    'investments': ['sip', 'mutual fund', 'zerodha', 'groww', 'upstox', 'ppf', 'nps', 'fixed deposit'],
+    'salary': ['salary', 'payroll', 'stipend', 'wages'],
+    'interest': ['interest credit', 'savings interest', 'fd interest', 'dividend'],
+}
+UNCATEGORIZED = 'uncategorized'
+
+RECURRING_NOTE_NOISE = {'jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+                        'january', 'february', 'march', 'april', 'june', 'july', 'august', 'september', 'october', 'november', 'december',
+                        'payment', 'bill', 'txn', 'ref', 'inv', 'invoice'}
+
+# Transaction dates are also stored as tday: whole days since 1970-01-01, so range filters hit an integer index.
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
 
 # --- Initialize session state ---
 if "messages" not in st.session_state:
@@ -39,12 +222,228 @@ def safe_rerun():
         except Exception:
             st.stop()
 
+# --- SINGLE-WRITER DB QUEUE ---
+
+class DBWriter:
+    # Owns the only writing connection. Submitted jobs are callables taking a cursor; whatever is queued
+    # when the thread wakes up is committed as one transaction, each job inside its own savepoint so a
+    # failing job only rolls back itself. Jobs marked with exclusive_job() run on their own in autocommit mode.
+    def __init__(self, db_path=DB_PATH, max_queue=WRITE_QUEUE_MAX, batch_max=WRITE_BATCH_MAX):
+        self.db_path = db_path
+        self.batch_max = batch_max
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.metrics_lock = threading.Lock()
+        self.metrics = {
+            'submitted': 0, 'committed': 0, 'failed': 0, 'rejected': 0, 'batches': 0,
+            'max_queue_depth': 0, 'max_batch_size': 0,
+            'last_commit_ms': 0.0, 'max_commit_ms': 0.0, 'total_commit_ms': 0.0,
+            'lock_waits': 0, 'max_lock_wait_ms': 0.0, 'total_lock_wait_ms': 0.0,
+            'max_queue_wait_ms': 0.0, 'total_queue_wait_ms': 0.0,
+        }
+        self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+        self.thread.writer = self  # lets out-of-app tooling (loadtest.py) find the live writer's stats
+        self.thread.start()
+
+    def submit(self, job, timeout=WRITE_SUBMIT_TIMEOUT):
+        future = Future()
+        try:
+            self.queue.put((job, future, time.perf_counter()), timeout=timeout)
+        except queue.Full:
+            with self.metrics_lock:
+                self.metrics['rejected'] += 1
+            raise RuntimeError("The database is busy; please try again in a moment.")
+        with self.metrics_lock:
+            self.metrics['submitted'] += 1
+            self.metrics['max_queue_depth'] = max(self.metrics['max_queue_depth'], self.queue.qsize())
+        return future
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def run(self):
+        conn = None
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                conn = conn or self.connect()
+                self.run_batch(conn, batch)
+            except Exception as e:
+                # Whatever escapes the batch (a failing ROLLBACK, a broken connection) fails its unresolved jobs
+                # instead of killing the thread; the next batch starts on a fresh connection
+                unresolved = [future for _, future, _ in batch if not future.done()]
+                with self.metrics_lock:
+                    self.metrics['failed'] += len(unresolved)
+                for future in unresolved:
+                    future.set_exception(e)
+                try:
+                    if conn is not None:
+                        conn.close()
+                except Exception:
+                    pass
+                conn = None
+
+    def run_batch(self, conn, batch):
+        # Exclusive jobs (VACUUM and friends) cannot run inside a transaction, so they split the batch
+        pending = []
+        for item in batch:
+            if getattr(item[0], 'exclusive', False):
+                if pending:
+                    self.commit_batch(conn, pending)
+                    pending = []
+                self.run_exclusive(conn, item)
+            else:
+                pending.append(item)
+        if pending:
+            self.commit_batch(conn, pending)
+
+    def run_exclusive(self, conn, item):
+        job, future, enqueued = item
+        started = time.perf_counter()
+        try:
+            result, error = job(conn.cursor()), None
+        except Exception as e:
+            result, error = None, e
+        with self.metrics_lock:
+            self.metrics['failed' if error else 'committed'] += 1
+            queue_wait_ms = (started - enqueued) * 1000
+            self.metrics['max_queue_wait_ms'] = max(self.metrics['max_queue_wait_ms'], queue_wait_ms)
+            self.metrics['total_queue_wait_ms'] += queue_wait_ms
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def commit_batch(self, conn, batch):
+        started = time.perf_counter()
+        outcomes = []
+        lock_wait_ms = 0.0
+        c = conn.cursor()
+        try:
+            c.execute('BEGIN IMMEDIATE')
+            # Only other connections (migrations, external tools) can hold the write lock; this is time spent waiting on them
+            lock_wait_ms = (time.perf_counter() - started) * 1000
+            for job, future, _ in batch:
+                c.execute('SAVEPOINT job')
+                try:
+                    outcomes.append((future, job(c), None))
+                    c.execute('RELEASE SAVEPOINT job')
+                except Exception as e:
+                    c.execute('ROLLBACK TO SAVEPOINT job')
+                    c.execute('RELEASE SAVEPOINT job')
+                    outcomes.append((future, None, e))
+            c.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            outcomes = [(future, None, e) for _, future, _ in batch]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        queue_waits_ms = [(started - enqueued) * 1000 for _, _, enqueued in batch]
+        with self.metrics_lock:
+            self.metrics['batches'] += 1
+            self.metrics['max_batch_size'] = max(self.metrics['max_batch_size'], len(batch))
+            self.metrics['last_commit_ms'] = elapsed_ms
+            self.metrics['max_commit_ms'] = max(self.metrics['max_commit_ms'], elapsed_ms)
+            self.metrics['total_commit_ms'] += elapsed_ms
+            if lock_wait_ms >= 1.0:
+                self.metrics['lock_waits'] += 1
+            self.metrics['max_lock_wait_ms'] = max(self.metrics['max_lock_wait_ms'], lock_wait_ms)
+            self.metrics['total_lock_wait_ms'] += lock_wait_ms
+            self.metrics['max_queue_wait_ms'] = max(self.metrics['max_queue_wait_ms'], max(queue_waits_ms))
+            self.metrics['total_queue_wait_ms'] += sum(queue_waits_ms)
+            for _, _, error in outcomes:
+                self.metrics['failed' if error else 'committed'] += 1
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        with self.metrics_lock:
+            stats = dict(self.metrics)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['avg_commit_ms'] = stats['total_commit_ms'] / stats['batches'] if stats['batches'] else 0.0
+        done = stats['committed'] + stats['failed']
+        stats['avg_queue_wait_ms'] = stats['total_queue_wait_ms'] / done if done else 0.0
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_db_writer():
+    return DBWriter(DB_PATH)
+
+def submit_write(job):
+    # Returns a Future resolved once the job's batch is committed
+    return get_db_writer().submit(job)
+
+def run_write(job, timeout=WRITE_RESULT_TIMEOUT):
+    try:
+        return submit_write(job).result(timeout=timeout)
+    except FutureTimeoutError:
+        raise RuntimeError("The database did not confirm the change in time; it may still be applied shortly.")
+
+def exclusive_job(job):
+    # Marks a writer job that must run outside BEGIN ... COMMIT (VACUUM, wal_checkpoint)
+    job.exclusive = True
+    return job
+
 # --- DATABASE HELPERS ---
-# (init_db, hash_password, register_user, login_user, set_config, get_config, add_holding, get_holdings, remove_holding, add_transaction, get_transactions, remove_transaction, save_user_profile, get_user_profile, add_savings_goal, update_savings_goal, get_savings_goals, remove_savings_goal remain unchanged)
+# (init_db, hash_password, register_user, login_user, set_config, get_config, get_holdings, remove_holding, add_transaction, get_transactions, remove_transaction, save_user_profile, get_user_profile, add_savings_goal, update_savings_goal, get_savings_goals, remove_savings_goal remain unchanged)
+
+def migrate_rows(conn, name, source, insert_sql, params=(), progress=None, chunk_rows=MIGRATION_CHUNK_ROWS):
+    # Runs a set-based `INSERT ... SELECT` over `source` in rowid ranges. insert_sql must end with a filter on
+    # "rowid > ? AND rowid <= ?" (bound after params). Each range commits together with its checkpoint, so the write
+    # lock is released between chunks and an interrupted upgrade resumes from the last committed range.
+    conn.commit()
+    row = conn.execute('SELECT last_rowid FROM migration_checkpoints WHERE name = ?', (name,)).fetchone()
+    done = row[0] if row else 0
+    last = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {source}').fetchone()[0]
+    while done < last:
+        upper = conn.execute(f'SELECT rowid FROM {source} WHERE rowid > ? ORDER BY rowid LIMIT 1 OFFSET ?', (done, chunk_rows - 1)).fetchone()
+        upper = upper[0] if upper else last
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(insert_sql, (*params, done, upper))
+        conn.execute('REPLACE INTO migration_checkpoints (name, last_rowid, max_rowid, updated_at) VALUES (?, ?, ?, ?)',
+                     (name, upper, last, datetime.utcnow().isoformat()))
+        conn.execute('COMMIT')
+        done = upper
+        if progress:
+            progress(name, done, last)
+
+def finish_migration(conn, name, table):
+    # Swaps `<table>_new` in for the legacy table and clears the checkpoint in one transaction
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    conn.execute('DELETE FROM migration_checkpoints WHERE name = ?', (name,))
+    conn.execute('COMMIT')
+
+def report_migration_progress(name, done, total):
+    sys.stderr.write(f'[finance-app] migrating {name}: rowid {done:,} of {total:,}\n')
 
-def init_db():
+def init_db(progress=None):
+    # progress(name, rowid_done, rowid_max) is called after each committed chunk of a legacy-table migration
     conn = sqlite3.connect(DB_PATH)
+    conn.create_function('sha256', 1, lambda value: hash_password(value) if value is not None else None, deterministic=True)
+    conn.create_function('normalize_note', 1, normalize_recurring_note, deterministic=True)
     c = conn.cursor()
+    c.execute('PRAGMA journal_mode=WAL')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS migration_checkpoints (
+            name TEXT PRIMARY KEY,
+            last_rowid INTEGER NOT NULL,
+            max_rowid INTEGER NOT NULL,
+            updated_at TEXT
+        )
+    ''')
 
     # --- Migrate users table ---
     c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
@@ -62,7 +461,7 @@ def init_db():
         }
         if 'id' not in columns or 'password_hash' not in columns:
             c.execute('''
-                CREATE TABLE users_new (
+                CREATE TABLE IF NOT EXISTS users_new (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     username TEXT NOT NULL UNIQUE,
                     password_hash TEXT,
@@ -70,27 +469,15 @@ def init_db():
                     created_at TEXT
                 )
             ''')
-            old_columns = list(columns.keys())
-            common_columns = [col for col in old_columns if col in ['username', 'email', 'created_at']]
-            has_password = 'password' in columns
-            select_columns = common_columns[:]
-            if has_password:
-                select_columns.append('password')
-            select_columns_str = ', '.join(select_columns)
-            c.execute(f'SELECT {select_columns_str} FROM users')
-            old_data = c.fetchall()
-            for row in old_data:
-                row_dict = dict(zip(select_columns, row))
-                username = row_dict.get('username')
-                email = row_dict.get('email', None)
-                created_at = row_dict.get('created_at', datetime.utcnow().isoformat())
-                password_hash = hash_password(row_dict['password']) if has_password and row_dict.get('password') else None
-                c.execute('''
-                    INSERT INTO users_new (username, password_hash, email, created_at)
-                    VALUES (?, ?, ?, ?)
-                ''', (username, password_hash, email, created_at))
-            c.execute('DROP TABLE users')
-            c.execute('ALTER TABLE users_new RENAME TO users')
+            # Plain-text passwords are hashed in SQL through the sha256() function registered above
+            password_expr = "CASE WHEN password IS NOT NULL AND password != '' THEN sha256(password) END" if 'password' in columns else 'NULL'
+            migrate_rows(conn, 'users', 'users', f'''
+                INSERT INTO users_new (username, password_hash, email, created_at)
+                SELECT {'username' if 'username' in columns else 'NULL'}, {password_expr},
+                       {'email' if 'email' in columns else 'NULL'}, {'created_at' if 'created_at' in columns else '?'}
+                FROM users WHERE rowid > ? AND rowid <= ?
+            ''', () if 'created_at' in columns else (datetime.utcnow().isoformat(),), progress)
+            finish_migration(conn, 'users', 'users')
     else:
         c.execute('''
             CREATE TABLE users (
@@ -117,7 +504,7 @@ def init_db():
         }
         if 'user_id' not in profile_columns:
             c.execute('''
-                CREATE TABLE user_profile_new (
+                CREATE TABLE IF NOT EXISTS user_profile_new (
                     user_id INTEGER PRIMARY KEY,
                     user_type TEXT,
                     savings_goal REAL,
@@ -125,27 +512,17 @@ def init_db():
                     FOREIGN KEY (user_id) REFERENCES users (id)
                 )
             ''')
-            old_profile_columns = list(profile_columns.keys())
-            common_profile_columns = [col for col in old_profile_columns if col in ['user_type', 'savings_goal', 'risk_tolerance']]
-            select_profile_columns_str = ', '.join(common_profile_columns) if common_profile_columns else 'rowid'
-            c.execute(f'SELECT {select_profile_columns_str} FROM user_profile')
-            old_profile_data = c.fetchall()
-            c.execute('SELECT id FROM users')
-            user_ids = [row[0] for row in c.fetchall()]
-            for i, row in enumerate(old_profile_data):
-                row_dict = dict(zip(common_profile_columns, row)) if common_profile_columns else {}
-                user_id = user_ids[i] if i < len(user_ids) else None
-                if user_id is None:
-                    continue
-                user_type = row_dict.get('user_type', 'general')
-                savings_goal = row_dict.get('savings_goal', 0.0)
-                risk_tolerance = row_dict.get('risk_tolerance', 'moderate')
-                c.execute('''
-                    INSERT INTO user_profile_new (user_id, user_type, savings_goal, risk_tolerance)
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, user_type, savings_goal, risk_tolerance))
-            c.execute('DROP TABLE user_profile')
-            c.execute('ALTER TABLE user_profile_new RENAME TO user_profile')
+            # Legacy profiles have no owner: the n-th profile row belongs to the n-th user, extras are dropped
+            profile_defaults = {'user_type': "'general'", 'savings_goal': '0.0', 'risk_tolerance': "'moderate'"}
+            profile_select = ', '.join(f'{col if col in profile_columns else default} AS {col}' for col, default in profile_defaults.items())
+            migrate_rows(conn, 'user_profile', 'user_profile', f'''
+                INSERT INTO user_profile_new (user_id, user_type, savings_goal, risk_tolerance)
+                SELECT u.id, p.user_type, p.savings_goal, p.risk_tolerance
+                FROM (SELECT rowid AS rid, {profile_select}, ROW_NUMBER() OVER (ORDER BY rowid) AS rn FROM user_profile) p
+                JOIN (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn FROM users) u ON u.rn = p.rn
+                WHERE p.rid > ? AND p.rid <= ?
+            ''', progress=progress)
+            finish_migration(conn, 'user_profile', 'user_profile')
     else:
         c.execute('''
             CREATE TABLE user_profile (
@@ -157,6 +534,10 @@ def init_db():
             )
         ''')
 
+    c.execute("PRAGMA table_info(user_profile)")
+    if 'base_currency' not in {col[1] for col in c.fetchall()}:
+        c.execute(f"ALTER TABLE user_profile ADD COLUMN base_currency TEXT DEFAULT '{DEFAULT_BASE_CURRENCY}'")
+
     # --- Migrate transactions table ---
     c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions'")
     transactions_table_exists = c.fetchone()
@@ -175,7 +556,7 @@ def init_db():
         }
         if 'user_id' not in transaction_columns:
             c.execute('''
-                CREATE TABLE transactions_new (
+                CREATE TABLE IF NOT EXISTS transactions_new (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER,
                     tdate TEXT,
@@ -186,42 +567,215 @@ def init_db():
                     FOREIGN KEY (user_id) REFERENCES users (id)
                 )
             ''')
-            old_transaction_columns = list(transaction_columns.keys())
-            common_transaction_columns = [col for col in old_transaction_columns if col in ['id', 'tdate', 'ttype', 'category', 'amount', 'note']]
-            select_transaction_columns_str = ', '.join(common_transaction_columns) if common_transaction_columns else 'rowid'
-            c.execute(f'SELECT {select_transaction_columns_str} FROM transactions')
-            old_transaction_data = c.fetchall()
+            # Legacy rows have no owner and are assigned to the first user (or dropped if there is none)
             c.execute('SELECT id FROM users LIMIT 1')
             default_user = c.fetchone()
-            default_user_id = default_user[0] if default_user else None
-            for row in old_transaction_data:
-                row_dict = dict(zip(common_transaction_columns, row)) if common_transaction_columns else {}
-                transaction_id = row_dict.get('id', None)
-                tdate = row_dict.get('tdate', datetime.utcnow().isoformat())
-                ttype = row_dict.get('ttype', '')
-                category = row_dict.get('category', '')
-                amount = row_dict.get('amount', 0.0)
-                note = row_dict.get('note', '')
-                if default_user_id:
-                    c.execute('''
-                        INSERT INTO transactions_new (id, user_id, tdate, ttype, category, amount, note)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (transaction_id, default_user_id, tdate, ttype, category, amount, note))
-            c.execute('DROP TABLE transactions')
-            c.execute('ALTER TABLE transactions_new RENAME TO transactions')
+            if default_user:
+                transaction_defaults = {'id': 'NULL', 'tdate': '?', 'ttype': "''", 'category': "''", 'amount': '0.0', 'note': "''"}
+                transaction_select = ', '.join(col if col in transaction_columns else default for col, default in transaction_defaults.items())
+                migrate_rows(conn, 'transactions', 'transactions', f'''
+                    INSERT INTO transactions_new (user_id, id, tdate, ttype, category, amount, note)
+                    SELECT ?, {transaction_select} FROM transactions WHERE rowid > ? AND rowid <= ?
+                ''', (default_user[0],) if 'tdate' in transaction_columns else (default_user[0], datetime.utcnow().isoformat()), progress)
+            finish_migration(conn, 'transactions', 'transactions')
     else:
         c.execute('''
             CREATE TABLE transactions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
                 tdate TEXT,
-                ttype TEXT,
-                category TEXT,
+                tday INTEGER,
+                ttype INTEGER,
+                category_id INTEGER,
                 amount REAL,
                 note TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (id)
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (category_id) REFERENCES categories (id)
+            )
+        ''')
+
+    # --- Create categories table ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT NOT NULL,
+            UNIQUE (user_id, name),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # --- Normalize transaction type and category encoding ---
+    # Older databases store ttype/category as free-form TEXT ('Income', 'income', ...).
+    # Move categories into the per-user categories table and encode ttype as TTYPE_* integers.
+    c.execute("PRAGMA table_info(transactions)")
+    transaction_columns = {col[1] for col in c.fetchall()}
+    if 'category' in transaction_columns and 'category_id' not in transaction_columns:
+        c.execute('''
+            INSERT OR IGNORE INTO categories (user_id, name)
+            SELECT DISTINCT user_id, lower(trim(category)) FROM transactions
+            WHERE user_id IS NOT NULL AND category IS NOT NULL AND trim(category) != ''
+        ''')
+        c.execute('''
+            CREATE TABLE transactions_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                tdate TEXT,
+                ttype INTEGER,
+                category_id INTEGER,
+                amount REAL,
+                note TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (category_id) REFERENCES categories (id)
             )
         ''')
+        c.execute(f'''
+            INSERT INTO transactions_new (id, user_id, tdate, ttype, category_id, amount, note)
+            SELECT t.id, t.user_id, t.tdate,
+                   CASE lower(trim(t.ttype)) WHEN 'income' THEN {TTYPE_INCOME} WHEN 'expense' THEN {TTYPE_EXPENSE} END,
+                   cat.id, t.amount, t.note
+            FROM transactions t
+            LEFT JOIN categories cat ON cat.user_id = t.user_id AND cat.name = lower(trim(t.category))
+        ''')
+        c.execute('DROP TABLE transactions')
+        c.execute('ALTER TABLE transactions_new RENAME TO transactions')
+
+    # --- Add sortable day column and indexes for filtered transaction queries ---
+    c.execute("PRAGMA table_info(transactions)")
+    transaction_columns = {col[1] for col in c.fetchall()}
+    if 'tday' not in transaction_columns:
+        c.execute('ALTER TABLE transactions ADD COLUMN tday INTEGER')
+        c.execute("UPDATE transactions SET tday = CAST(julianday(date(tdate)) - 2440587.5 AS INTEGER)")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_tday ON transactions (user_id, tday)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_type_tday ON transactions (user_id, ttype, tday)')
+
+    # --- Per-category spending forecast state (Holt smoothing over monthly totals) ---
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='category_forecasts'")
+    category_forecasts_table_exists = c.fetchone()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS category_forecasts (
+            user_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            open_month INTEGER NOT NULL,
+            open_total REAL NOT NULL DEFAULT 0.0,
+            level REAL,
+            trend REAL,
+            months INTEGER NOT NULL DEFAULT 0,
+            stale INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category_id)
+        )
+    ''')
+    # --- Recurring transaction groups (detected incrementally past a per-user watermark) ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS recurring_groups (
+            user_id INTEGER NOT NULL,
+            group_key TEXT NOT NULL,
+            ttype INTEGER,
+            category_id INTEGER,
+            label TEXT,
+            amount_bucket INTEGER,
+            occurrences INTEGER NOT NULL,
+            first_tday INTEGER,
+            last_tday INTEGER,
+            gap_count INTEGER NOT NULL DEFAULT 0,
+            gap_mean REAL NOT NULL DEFAULT 0.0,
+            gap_m2 REAL NOT NULL DEFAULT 0.0,
+            amount_mean REAL,
+            cadence TEXT,
+            stale INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, group_key)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recurring_user_cadence ON recurring_groups (user_id, cadence)')
+
+    # --- Category budgets, running month-to-date spend and budget alerts ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS category_budgets (
+            user_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            monthly_limit REAL NOT NULL,
+            alert_threshold REAL NOT NULL DEFAULT 0.8,
+            updated_at TEXT,
+            PRIMARY KEY (user_id, category_id)
+        )
+    ''')
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='category_month_spend'")
+    category_month_spend_table_exists = c.fetchone()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS category_month_spend (
+            user_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            spent REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (user_id, category_id, month)
+        )
+    ''')
+    if not category_month_spend_table_exists:
+        c.execute(f'''
+            INSERT INTO category_month_spend (user_id, category_id, month, spent)
+            SELECT user_id, category_id, {SQL_MONTH_INDEX}, SUM(amount) FROM transactions
+            WHERE ttype = ? AND user_id IS NOT NULL AND category_id IS NOT NULL
+            GROUP BY 1, 2, 3
+        ''', (TTYPE_EXPENSE,))
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS budget_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            level TEXT NOT NULL,
+            spent REAL,
+            monthly_limit REAL,
+            created_at TEXT,
+            seen INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(user_id, category_id, month, level)
+        )
+    ''')
+
+    # --- Categorization rules and learned note -> category associations ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS category_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            keyword TEXT NOT NULL,
+            category TEXT NOT NULL,
+            created_at TEXT,
+            UNIQUE(user_id, keyword)
+        )
+    ''')
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='note_categories'")
+    note_categories_table_exists = c.fetchone()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS note_categories (
+            user_id INTEGER NOT NULL,
+            note_key TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            uses INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, note_key, category_id)
+        )
+    ''')
+    if not note_categories_table_exists:
+        # Learn from everything categorized so far, aggregated inside SQLite rather than row by row in Python
+        c.execute('''
+            INSERT INTO note_categories (user_id, note_key, category_id, uses)
+            SELECT user_id, normalize_note(note) AS note_key, category_id, COUNT(*) FROM transactions
+            WHERE note IS NOT NULL AND note != '' AND category_id IS NOT NULL AND user_id IS NOT NULL
+            GROUP BY 1, 2, 3
+            HAVING note_key != ''
+        ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS recurring_watermarks (
+            user_id INTEGER PRIMARY KEY,
+            last_transaction_id INTEGER NOT NULL
+        )
+    ''')
+    if not category_forecasts_table_exists:
+        # Existing ledgers get fitted lazily, the first time their forecasts are read
+        c.execute('''
+            INSERT INTO category_forecasts (user_id, category_id, open_month, stale)
+            SELECT DISTINCT user_id, category_id, 0, 1 FROM transactions
+            WHERE ttype = ? AND user_id IS NOT NULL AND category_id IS NOT NULL
+        ''', (TTYPE_EXPENSE,))
 
     # --- Migrate holdings table ---
     c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='holdings'")
@@ -240,7 +794,7 @@ def init_db():
         }
         if 'user_id' not in holdings_columns:
             c.execute('''
-                CREATE TABLE holdings_new (
+                CREATE TABLE IF NOT EXISTS holdings_new (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER,
                     symbol TEXT NOT NULL,
@@ -250,28 +804,16 @@ def init_db():
                     FOREIGN KEY (user_id) REFERENCES users (id)
                 )
             ''')
-            old_holdings_columns = list(holdings_columns.keys())
-            common_holdings_columns = [col for col in old_holdings_columns if col in ['id', 'symbol', 'shares', 'avg_price', 'added_at']]
-            select_holdings_columns_str = ', '.join(common_holdings_columns) if common_holdings_columns else 'rowid'
-            c.execute(f'SELECT {select_holdings_columns_str} FROM holdings')
-            old_holdings_data = c.fetchall()
             c.execute('SELECT id FROM users LIMIT 1')
             default_user = c.fetchone()
-            default_user_id = default_user[0] if default_user else None
-            for row in old_holdings_data:
-                row_dict = dict(zip(common_holdings_columns, row)) if common_holdings_columns else {}
-                holding_id = row_dict.get('id', None)
-                symbol = row_dict.get('symbol', '')
-                shares = row_dict.get('shares', 0.0)
-                avg_price = row_dict.get('avg_price', None)
-                added_at = row_dict.get('added_at', datetime.utcnow().isoformat())
-                if default_user_id:
-                    c.execute('''
-                        INSERT INTO holdings_new (id, user_id, symbol, shares, avg_price, added_at)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (holding_id, default_user_id, symbol, shares, avg_price, added_at))
-            c.execute('DROP TABLE holdings')
-            c.execute('ALTER TABLE holdings_new RENAME TO holdings')
+            if default_user:
+                holdings_defaults = {'id': 'NULL', 'symbol': "''", 'shares': '0.0', 'avg_price': 'NULL', 'added_at': '?'}
+                holdings_select = ', '.join(col if col in holdings_columns else default for col, default in holdings_defaults.items())
+                migrate_rows(conn, 'holdings', 'holdings', f'''
+                    INSERT INTO holdings_new (user_id, id, symbol, shares, avg_price, added_at)
+                    SELECT ?, {holdings_select} FROM holdings WHERE rowid > ? AND rowid <= ?
+                ''', (default_user[0],) if 'added_at' in holdings_columns else (default_user[0], datetime.utcnow().isoformat()), progress)
+            finish_migration(conn, 'holdings', 'holdings')
     else:
         c.execute('''
             CREATE TABLE holdings (
@@ -285,6 +827,98 @@ def init_db():
             )
         ''')
 
+    # --- Create trade ledger (trades, open FIFO lots and aggregated positions) ---
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='trades'")
+    trades_table_exists = c.fetchone()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS trades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            symbol TEXT NOT NULL,
+            side TEXT NOT NULL,
+            shares REAL NOT NULL,
+            price REAL,
+            tdate TEXT,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS lots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            symbol TEXT NOT NULL,
+            trade_id INTEGER,
+            shares_open REAL NOT NULL,
+            price REAL,
+            opened_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (trade_id) REFERENCES trades (id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS positions (
+            user_id INTEGER,
+            symbol TEXT NOT NULL,
+            shares REAL NOT NULL DEFAULT 0.0,
+            cost_basis REAL,
+            realized_pnl REAL NOT NULL DEFAULT 0.0,
+            updated_at TEXT,
+            PRIMARY KEY (user_id, symbol),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_trades_user_symbol ON trades (user_id, symbol)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_lots_open ON lots (user_id, symbol, opened_at) WHERE shares_open > 0')
+    if not trades_table_exists:
+        # Each legacy holdings row becomes a buy trade; cost basis stays NULL where avg_price was never entered
+        c.execute('''
+            INSERT INTO trades (user_id, symbol, side, shares, price, tdate, created_at)
+            SELECT user_id, upper(symbol), 'buy', shares, avg_price, added_at, added_at
+            FROM holdings WHERE user_id IS NOT NULL AND shares > 0 ORDER BY id
+        ''')
+        c.execute('''
+            INSERT INTO lots (user_id, symbol, trade_id, shares_open, price, opened_at)
+            SELECT user_id, symbol, id, shares, price, tdate FROM trades ORDER BY id
+        ''')
+        c.execute('''
+            INSERT INTO positions (user_id, symbol, shares, cost_basis, realized_pnl, updated_at)
+            SELECT user_id, symbol, SUM(shares),
+                   CASE WHEN COUNT(price) = COUNT(*) THEN SUM(shares * price) END,
+                   0.0, MAX(created_at)
+            FROM trades GROUP BY user_id, symbol
+        ''')
+
+    # --- Create currency metadata and FX rate cache ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS symbol_currency (
+            symbol TEXT PRIMARY KEY,
+            currency TEXT NOT NULL,
+            updated_at TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            base TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            rate_date TEXT NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (base, currency, rate_date)
+        )
+    ''')
+
+    # --- Create ticker universe for symbol autocomplete ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS tickers (
+            symbol TEXT PRIMARY KEY,
+            name TEXT,
+            exchange TEXT,
+            updated_at TEXT
+        )
+    ''')
+    c.executemany('INSERT OR IGNORE INTO tickers (symbol, name, exchange, updated_at) VALUES (?, ?, ?, ?)',
+                  [(symbol, name, exchange, datetime.utcnow().isoformat()) for symbol, name, exchange in DEFAULT_TICKERS])
+
     # --- Create savings_goals table ---
     c.execute('''
         CREATE TABLE IF NOT EXISTS savings_goals (
@@ -299,6 +933,32 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+    c.execute("PRAGMA table_info(savings_goals)")
+    if 'priority' not in {col[1] for col in c.fetchall()}:
+        c.execute(f'ALTER TABLE savings_goals ADD COLUMN priority INTEGER DEFAULT {DEFAULT_GOAL_PRIORITY}')
+
+    # --- Explicit per-goal contributions (a ledger; earmarked out of net savings before the strategy runs) ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS goal_contributions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            goal_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            cdate TEXT,
+            note TEXT,
+            created_at TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_goal_contributions_user ON goal_contributions (user_id, goal_id)')
+
+    # --- Per-user allocation strategy, plus the data version the stored current_amounts were computed at ---
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS savings_allocation (
+            user_id INTEGER PRIMARY KEY,
+            strategy TEXT NOT NULL DEFAULT '{DEFAULT_SAVINGS_STRATEGY}',
+            allocated_version INTEGER
+        )
+    ''')
 
     # Create config table
     c.execute('''
@@ -308,29 +968,186 @@ def init_db():
         )
     ''')
 
+    # --- Per-user data version: bumped by every write to a user's ledger, goals or profile ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # --- Shared latest quotes, written only by the quote scheduler ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS quotes (
+            symbol TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    ''')
+
+    # --- Price alerts (evaluated by the background alert engine) ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS price_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            value REAL NOT NULL,
+            threshold REAL NOT NULL,
+            reference_price REAL,
+            status TEXT NOT NULL DEFAULT 'active',
+            triggered_price REAL,
+            triggered_at TEXT,
+            seen INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_price_alerts_active ON price_alerts (symbol) WHERE status = 'active'")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_price_alerts_user ON price_alerts (user_id, status)')
+
+    # --- Per-user tokens for the local JSON API (finance_api.py); only hashes are stored ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS api_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token_hash TEXT NOT NULL UNIQUE,
+            user_id INTEGER NOT NULL,
+            label TEXT,
+            created_at TEXT
+        )
+    ''')
+
+    # --- Background report jobs ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            fmt TEXT NOT NULL,
+            data_version INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            path TEXT,
+            error TEXT,
+            created_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_report_jobs_user ON report_jobs (user_id, id)')
+
+    # --- Ledger archive: closed years move out of the hot transactions table, leaving monthly rollups behind ---
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS transactions_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            tdate TEXT,
+            tday INTEGER,
+            ttype INTEGER,
+            category_id INTEGER,
+            amount REAL,
+            note TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_archive_user_tday ON transactions_archive (user_id, tday)')
+    # ttype/category_id use -1 for NULL so they can be part of the key
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS transaction_rollups (
+            user_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            ttype INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            amount REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month, ttype, category_id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS archive_watermarks (
+            user_id INTEGER PRIMARY KEY,
+            archived_before INTEGER NOT NULL
+        )
+    ''')
+
+    # --- Full-text search over notes and category names (FTS5) ---
+    # One row per transaction, hot or archived (rowid = transaction id). The owner column holds a 'u<user_id>' token
+    # so the user filter is part of the MATCH instead of a scan over other users' hits. Skipped where SQLite
+    # lacks FTS5; search_transactions() then falls back to LIKE.
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transaction_search'")
+    transaction_search_exists = c.fetchone()
+    try:
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS transaction_search USING fts5(
+                note, category, owner, tday UNINDEXED, ttype UNINDEXED, amount UNINDEXED,
+                prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        transaction_search_exists = None
+    else:
+        search_row = '''
+            INSERT INTO transaction_search (rowid, note, category, owner, tday, ttype, amount)
+            VALUES (new.id, COALESCE(new.note, ''), COALESCE((SELECT name FROM categories WHERE id = new.category_id), ''),
+                    'u' || new.user_id, new.tday, new.ttype, new.amount);
+        '''
+        c.execute(f'CREATE TRIGGER IF NOT EXISTS transactions_search_insert AFTER INSERT ON transactions BEGIN {search_row} END')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS transactions_search_update AFTER UPDATE OF user_id, tday, ttype, category_id, amount, note ON transactions
+            BEGIN DELETE FROM transaction_search WHERE rowid = old.id; {search_row} END
+        ''')
+        # Archiving copies a row into transactions_archive before deleting it, so its search row is kept
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS transactions_search_delete AFTER DELETE ON transactions
+            WHEN NOT EXISTS (SELECT 1 FROM transactions_archive WHERE id = old.id)
+            BEGIN DELETE FROM transaction_search WHERE rowid = old.id; END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS transactions_archive_search_insert AFTER INSERT ON transactions_archive
+            WHEN NOT EXISTS (SELECT 1 FROM transaction_search WHERE rowid = new.id)
+            BEGIN {search_row} END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS transactions_archive_search_delete AFTER DELETE ON transactions_archive
+            BEGIN DELETE FROM transaction_search WHERE rowid = old.id; END
+        ''')
+        if not transaction_search_exists:
+            c.execute(f'''
+                INSERT INTO transaction_search (rowid, note, category, owner, tday, ttype, amount)
+                SELECT t.id, COALESCE(t.note, ''), COALESCE(cat.name, ''), 'u' || t.user_id, t.tday, t.ttype, t.amount
+                FROM {ALL_TRANSACTIONS_SQL} t LEFT JOIN categories cat ON cat.id = t.category_id
+                WHERE t.user_id IS NOT NULL
+            ''')
+
     conn.commit()
     conn.close()
 
+@st.cache_resource(show_spinner=False)
+def ensure_db():
+    # Schema setup and migrations run once per server process instead of on every rerun
+    init_db(report_migration_progress)
+    return True
+
+def session_user_id(user_id=None):
+    # Explicit ids come from callers outside a Streamlit session (finance_api.py); otherwise the signed-in user, if any
+    if user_id is not None:
+        return user_id
+    return st.session_state.user_id if st.session_state.logged_in else None
+
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 def register_user(username, password, email):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        password_hash = hash_password(password)
+    password_hash = hash_password(password)
+
+    def write(c):
         c.execute('INSERT INTO users (username, password_hash, email, created_at) VALUES (?, ?, ?, ?)',
                   (username, password_hash, email, datetime.utcnow().isoformat()))
-        conn.commit()
         user_id = c.lastrowid
-        c.execute('INSERT INTO user_profile (user_id, user_type, savings_goal, risk_tolerance) VALUES (?, ?, ?, ?)',
-                  (user_id, 'general', 0.0, 'moderate'))
-        conn.commit()
-        return user_id, None
+        c.execute('INSERT INTO user_profile (user_id, user_type, savings_goal, risk_tolerance, base_currency) VALUES (?, ?, ?, ?, ?)',
+                  (user_id, 'general', 0.0, 'moderate', DEFAULT_BASE_CURRENCY))
+        return user_id
+
+    try:
+        return run_write(write), None
     except sqlite3.IntegrityError as e:
         return None, "Username or email already exists."
-    finally:
-        conn.close()
 
 def login_user(username, password):
     conn = sqlite3.connect(DB_PATH)
@@ -343,11 +1160,7 @@ def login_user(username, password):
     return None, "Invalid username or password."
 
 def set_config(key, value):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('REPLACE INTO config (key, value) VALUES (?, ?)', (key, value))
-    conn.commit()
-    conn.close()
+    run_write(lambda c: c.execute('REPLACE INTO config (key, value) VALUES (?, ?)', (key, value)))
 
 def get_config(key):
     conn = sqlite3.connect(DB_PATH)
@@ -357,220 +1170,2565 @@ def get_config(key):
     conn.close()
     return row[0] if row else None
 
-def add_holding(symbol, shares, avg_price=None):
+def bump_data_version(c, user_id):
+    # Called inside writer jobs so the version moves in the same transaction as the data it describes
+    c.execute('''
+        INSERT INTO data_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+    ''', (user_id,))
+
+def get_data_version(user_id=None):
+    user_id = user_id if user_id is not None else st.session_state.user_id
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute('SELECT version FROM data_versions WHERE user_id = ?', (user_id,)).fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+def create_api_token(label):
+    # Returns the plain token once; only its hash is stored
+    if not st.session_state.logged_in:
+        return None
+    token = secrets.token_urlsafe(32)
+    user_id = st.session_state.user_id
+    run_write(lambda c: c.execute('INSERT INTO api_tokens (token_hash, user_id, label, created_at) VALUES (?, ?, ?, ?)',
+                                  (hash_password(token), user_id, label.strip() or 'API token', datetime.utcnow().isoformat())))
+    return token
+
+def get_api_tokens():
+    if not st.session_state.logged_in:
+        return pd.DataFrame()
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query('SELECT id, label, created_at FROM api_tokens WHERE user_id = ? ORDER BY id', conn, params=(st.session_state.user_id,))
+    conn.close()
+    return df
+
+def revoke_api_token(token_id):
     if not st.session_state.logged_in:
         return
+    user_id = st.session_state.user_id
+    run_write(lambda c: c.execute('DELETE FROM api_tokens WHERE id = ? AND user_id = ?', (token_id, user_id)))
+
+def api_token_user(token):
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT INTO holdings (user_id, symbol, shares, avg_price, added_at) VALUES (?, ?, ?, ?, ?)',
-              (st.session_state.user_id, symbol.upper(), shares, avg_price, datetime.utcnow().isoformat()))
-    conn.commit()
+    row = conn.execute('SELECT user_id FROM api_tokens WHERE token_hash = ?', (hash_password(token),)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def record_trade(symbol, side, shares, price=None, tdate=None):
+    if not st.session_state.logged_in:
+        return "Please log in to record trades."
+    user_id = st.session_state.user_id
+    now = datetime.utcnow().isoformat()
+    return run_write(lambda c: apply_trade(c, user_id, symbol.strip().upper(), side, shares, price, tdate or now, now))
+
+def apply_trade(c, user_id, symbol, side, shares, price, tdate, now):
+    # Updates the symbol's position incrementally: buys open a lot, sells consume open lots FIFO.
+    # Returns an error message instead of writing when the trade is invalid.
+    c.execute('SELECT shares, cost_basis, realized_pnl FROM positions WHERE user_id = ? AND symbol = ?', (user_id, symbol))
+    position = c.fetchone()
+    position_shares, cost_basis, realized_pnl = position if position else (0.0, 0.0, 0.0)
+    if side == 'sell' and shares > position_shares + 1e-9:
+        return f"Cannot sell {shares:g} {symbol}: only {position_shares:g} held."
+    if side == 'buy' and price is None:
+        # A lot without a price would leave the symbol's cost basis unknown for good
+        return f"Price unavailable for {symbol}; enter a price."
+
+    c.execute('INSERT INTO trades (user_id, symbol, side, shares, price, tdate, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+              (user_id, symbol, side, shares, price, tdate, now))
+    trade_id = c.lastrowid
+    if side == 'buy':
+        c.execute('INSERT INTO lots (user_id, symbol, trade_id, shares_open, price, opened_at) VALUES (?, ?, ?, ?, ?, ?)',
+                  (user_id, symbol, trade_id, shares, price, tdate))
+        position_shares += shares
+        cost_basis = cost_basis + shares * price if cost_basis is not None and price is not None else None
+    else:
+        remaining = shares
+        c.execute('SELECT id, shares_open, price FROM lots WHERE user_id = ? AND symbol = ? AND shares_open > 0 ORDER BY opened_at, id',
+                  (user_id, symbol))
+        for lot_id, shares_open, lot_price in c.fetchall():
+            taken = min(shares_open, remaining)
+            c.execute('UPDATE lots SET shares_open = ? WHERE id = ?', (shares_open - taken, lot_id))
+            if price is not None and lot_price is not None:
+                realized_pnl += taken * (price - lot_price)
+            remaining -= taken
+            if remaining <= 1e-9:
+                break
+        position_shares = max(position_shares - shares, 0.0)
+        # Cost basis of what is still open (only the symbol's open lots, never the trade history)
+        c.execute('SELECT SUM(shares_open * price), COUNT(*) - COUNT(price) FROM lots WHERE user_id = ? AND symbol = ? AND shares_open > 0',
+                  (user_id, symbol))
+        open_cost, unknown_lots = c.fetchone()
+        cost_basis = None if unknown_lots else (open_cost or 0.0)
+    c.execute('''
+        REPLACE INTO positions (user_id, symbol, shares, cost_basis, realized_pnl, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, symbol, position_shares, cost_basis, realized_pnl, now))
+    bump_data_version(c, user_id)
+    return None
+
+def get_holdings(include_closed=False, user_id=None):
+    user_id = session_user_id(user_id)
+    if user_id is None:
+        return pd.DataFrame()
+    conn = sqlite3.connect(DB_PATH)
+    query = 'SELECT symbol, shares, cost_basis, realized_pnl, updated_at FROM positions WHERE user_id = ?'
+    if not include_closed:
+        query += ' AND shares > 1e-9'
+    df = pd.read_sql_query(query + ' ORDER BY symbol', conn, params=(user_id,))
     conn.close()
+    df['avg_price'] = df['cost_basis'] / df['shares'].where(df['shares'] > 0)
+    return df
+
+def get_trades(limit=50):
+    if not st.session_state.logged_in:
+        return pd.DataFrame()
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query('SELECT id, symbol, side, shares, price, tdate FROM trades WHERE user_id = ? ORDER BY tdate DESC, id DESC LIMIT ?',
+                           conn, params=(st.session_state.user_id, limit))
+    conn.close()
+    return df
+
+def remove_holding(symbol):
+    # Drops the symbol from the ledger entirely (for correcting mistakes, not for recording a sale)
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        for table in ('lots', 'trades', 'positions'):
+            c.execute(f'DELETE FROM {table} WHERE user_id = ? AND symbol = ?', (user_id, symbol))
+        bump_data_version(c, user_id)
+
+    run_write(write)
+
+def encode_ttype(ttype):
+    label = str(ttype).strip().lower()
+    return TTYPE_LABELS.index(label) if label in TTYPE_LABELS else None
+
+def to_tday(value):
+    return pd.Timestamp(value).date().toordinal() - EPOCH_ORDINAL
+
+def normalize_category(category):
+    return str(category).strip().lower()
+
+def get_category_id(c, user_id, category):
+    name = normalize_category(category)
+    c.execute('INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)', (user_id, name))
+    c.execute('SELECT id FROM categories WHERE user_id = ? AND name = ?', (user_id, name))
+    return c.fetchone()[0]
+
+def decode_transactions(df, categories_df):
+    # Turn the integer ttype/category_id columns into categoricals so grouping works on codes, not strings
+    df['ttype'] = pd.Categorical.from_codes(df['ttype'].fillna(-1).astype(int), categories=TTYPE_LABELS)
+    codes = pd.Index(categories_df['id']).get_indexer(df['category_id'].fillna(-1).astype(int))
+    df['category'] = pd.Categorical.from_codes(codes, categories=categories_df['name'].tolist())
+    return df
+
+def add_transaction(tdate, ttype, category, amount, note='', learn=True):
+    # learn=False for auto-categorized entries, so the categorizer only learns from the user's own choices
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        category_id = get_category_id(c, user_id, category)
+        tday, ttype_code = to_tday(tdate), encode_ttype(ttype)
+        c.execute('INSERT INTO transactions (user_id, tdate, tday, ttype, category_id, amount, note) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                  (user_id, tdate, tday, ttype_code, category_id, amount, note))
+        if ttype_code == TTYPE_EXPENSE:
+            update_category_forecast(c, user_id, category_id, tday, amount)
+            record_category_spend(c, user_id, category_id, tday, amount)
+        if learn:
+            learn_note_categories(c, user_id, [(normalize_recurring_note(note), category_id, 1)])
+        bump_data_version(c, user_id)
+
+    run_write(write)
+
+def add_transactions_bulk(transactions_df, refresh_recurring=True):
+    # Imports many transactions in one write job. Expects date, type and amount columns plus optional note and
+    # category; blank categories are filled in by the categorizer. Forecast state is folded in per
+    # (category, month) in date order, and only explicitly categorized rows teach the categorizer.
+    if not st.session_state.logged_in or transactions_df.empty:
+        return 0
+    user_id = st.session_state.user_id
+    df = transactions_df.copy()
+    df['note'] = df['note'].fillna('').astype(str) if 'note' in df.columns else ''
+    given = df['category'].fillna('').astype(str).str.strip() if 'category' in df.columns else pd.Series('', index=df.index)
+    df['explicit'] = given != ''
+    df['category'] = given.where(df['explicit'], categorize_notes(df['note'], user_id).fillna(UNCATEGORIZED)).map(normalize_category)
+    dates = pd.to_datetime(df['date'])
+    df['tdate'] = dates.dt.date.astype(str)
+    df['tday'] = (dates.dt.normalize() - pd.Timestamp('1970-01-01')).dt.days
+    df['month'] = dates.dt.year * 12 + dates.dt.month - 1
+    df['ttype'] = df['type'].map(encode_ttype)
+    df = df.sort_values('tday', kind='stable')
+
+    def write(c):
+        category_ids = {name: get_category_id(c, user_id, name) for name in df['category'].unique()}
+        df['category_id'] = df['category'].map(category_ids)
+        c.executemany('INSERT INTO transactions (user_id, tdate, tday, ttype, category_id, amount, note) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      [(user_id, tdate, int(tday), None if pd.isna(ttype) else int(ttype), int(category_id), float(amount), note)
+                       for tdate, tday, ttype, category_id, amount, note in zip(df['tdate'], df['tday'], df['ttype'], df['category_id'], df['amount'], df['note'])])
+        monthly = (df[df['ttype'] == TTYPE_EXPENSE].groupby(['category_id', 'month'], sort=True)
+                   .agg(tday=('tday', 'min'), amount=('amount', 'sum')))
+        for (category_id, _), row in monthly.iterrows():
+            update_category_forecast(c, user_id, int(category_id), int(row['tday']), float(row['amount']))
+            record_category_spend(c, user_id, int(category_id), int(row['tday']), float(row['amount']))
+        explicit = df[df['explicit']].assign(note_key=lambda d: d['note'].map(normalize_recurring_note))
+        learned = explicit.groupby(['note_key', 'category_id']).size()
+        learn_note_categories(c, user_id, [(note_key, int(category_id), int(uses)) for (note_key, category_id), uses in learned.items()])
+        bump_data_version(c, user_id)
+        return len(df)
+
+    imported = run_write(write)
+    if refresh_recurring:
+        detect_recurring(user_id)
+    return imported
+
+def parse_statement_dates(values):
+    # ISO dates (the usual export format) are read as such; only what fails that falls back to day-first (05/01/2024)
+    values = values.astype(str).str.strip()
+    dates = pd.to_datetime(values, errors='coerce', format='ISO8601')
+    unparsed = dates.isna()
+    if unparsed.any():
+        dates[unparsed] = pd.to_datetime(values[unparsed], errors='coerce', dayfirst=True)
+    return dates
+
+def parse_transactions_csv(csv_file):
+    # Bank/statement CSVs: a date column, either an amount column (negative = expense unless a type column says
+    # otherwise) or separate debit/credit columns, and optional description and category columns.
+    # Returns (transactions, skipped), where skipped counts rows without a readable date or a positive amount.
+    df = pd.read_csv(csv_file)
+    df.columns = [str(col).strip().lower() for col in df.columns]
+
+    def column(*names):
+        return next((name for name in names if name in df.columns), None)
+
+    date_col = column('date', 'tdate', 'transaction date', 'txn date', 'value date', 'posting date')
+    if date_col is None:
+        raise ValueError("The file needs a date column.")
+    note_col = column('note', 'description', 'narration', 'details', 'remarks', 'memo', 'particulars')
+    type_col = column('type', 'ttype', 'transaction type')
+    category_col = column('category')
+    amount_col = column('amount', 'value')
+    debit_col, credit_col = column('debit', 'withdrawal', 'withdrawal amt'), column('credit', 'deposit', 'deposit amt')
+
+    def numbers(series):
+        return pd.to_numeric(series.astype(str).str.replace(r'[^0-9.\-]', '', regex=True), errors='coerce')
+
+    if amount_col is not None:
+        amount = numbers(df[amount_col])
+        if type_col is not None:
+            ttype = df[type_col].astype(str).str.strip().str.lower().map(lambda t: 'income' if t in ('income', 'credit', 'cr') else 'expense')
+        else:
+            ttype = np.where(amount < 0, 'expense', 'income')
+        amount = amount.abs()
+    elif debit_col is not None or credit_col is not None:
+        debit = numbers(df[debit_col]).fillna(0.0) if debit_col else pd.Series(0.0, index=df.index)
+        credit = numbers(df[credit_col]).fillna(0.0) if credit_col else pd.Series(0.0, index=df.index)
+        ttype = np.where(debit > 0, 'expense', 'income')
+        amount = debit.where(debit > 0, credit)
+    else:
+        raise ValueError("The file needs an amount column or debit/credit columns.")
+
+    parsed = pd.DataFrame({
+        'date': parse_statement_dates(df[date_col]),
+        'type': ttype,
+        'amount': amount,
+        'note': df[note_col].fillna('').astype(str).str.strip() if note_col else '',
+        'category': df[category_col].fillna('').astype(str).str.strip() if category_col else '',
+    })
+    valid = parsed['date'].notna() & (parsed['amount'] > 0)
+    return parsed[valid].reset_index(drop=True), int((~valid).sum())
+
+# Aggregation levels accepted by query_transactions(group_by=...): output column -> SQL expression.
+# Aliases must not shadow a real column that differs from the expression: GROUP BY would bind to the column
+# (a 'tdate' alias grouped on the stored TEXT date, time part and all), so days come back as day_index -> tdate.
+TRANSACTION_GROUPS = {
+    'day': ('day_index', 't.tday'),
+    'month': ('month', "strftime('%Y-%m', t.tday * 86400, 'unixepoch')"),
+    'year': ('year', "CAST(strftime('%Y', t.tday * 86400, 'unixepoch') AS INTEGER)"),
+    'type': ('ttype', 't.ttype'),
+    'category': ('category_id', 't.category_id'),
+}
+
+# Row source spanning the hot ledger and archived years, for row queries that reach before the archive boundary
+ALL_TRANSACTIONS_SQL = '''(
+    SELECT id, user_id, tdate, tday, ttype, category_id, amount, note FROM transactions
+    UNION ALL
+    SELECT id, user_id, tdate, tday, ttype, category_id, amount, note FROM transactions_archive
+)'''
+
+# The same aggregation levels over transaction_rollups, whose rows are (month index, type, category) totals
+ROLLUP_GROUPS = {
+    'month': "printf('%04d-%02d', r.month / 12, r.month % 12 + 1)",
+    'year': 'r.month / 12',
+    'type': 'r.ttype',
+    'category': 'r.category_id',
+}
+
+def get_archive_boundary(user_id=None, conn=None):
+    # tday before which the user's transactions have been moved to transactions_archive (0 when nothing is archived)
+    user_id = user_id if user_id is not None else st.session_state.user_id
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(DB_PATH)
+    row = conn.execute('SELECT archived_before FROM archive_watermarks WHERE user_id = ?', (user_id,)).fetchone()
+    if own_conn:
+        conn.close()
+    return row[0] if row else 0
+
+def query_transactions(start=None, end=None, ttype=None, categories=None, min_amount=None, max_amount=None, group_by=None, limit=None,
+                       user_id=None, cursor=None):
+    # Filters are compiled into SQL over the (user_id, ttype, tday) indexes; start/end are inclusive dates.
+    # With group_by (e.g. 'category' or ('month', 'type')) only the aggregated rows are returned.
+    # Ranges that stay within the hot ledger never touch archived years. Aggregates that reach into them are
+    # answered from the monthly rollups where the filters allow, otherwise archived rows are read through.
+    # cursor=(tday, id) lists the rows after that one in the default newest-first order (keyset pagination).
+    user_id = session_user_id(user_id)
+    if user_id is None:
+        return pd.DataFrame()
+    start_tday = to_tday(start) if start is not None else None
+    end_tday = to_tday(end) if end is not None else None
+
+    filters = ['user_id = ?']
+    filter_params = [user_id]
+    if ttype is not None:
+        filters.append('ttype = ?')
+        filter_params.append(encode_ttype(ttype))
+    if categories is not None:
+        names = [normalize_category(cat) for cat in categories]
+        if not names:
+            return pd.DataFrame()
+        filters.append(f"category_id IN (SELECT id FROM categories WHERE user_id = ? AND name IN ({', '.join('?' for _ in names)}))")
+        filter_params.append(user_id)
+        filter_params.extend(names)
+
+    def where_clause(alias, date_column, low, high):
+        where = [f'{alias}.{condition}' for condition in filters]
+        params = list(filter_params)
+        if low is not None:
+            where.append(f'{alias}.{date_column} >= ?')
+            params.append(low)
+        if high is not None:
+            where.append(f'{alias}.{date_column} <= ?')
+            params.append(high)
+        if alias == 't' and min_amount is not None:
+            where.append('t.amount >= ?')
+            params.append(min_amount)
+        if alias == 't' and max_amount is not None:
+            where.append('t.amount <= ?')
+            params.append(max_amount)
+        return ' AND '.join(where), params
+
+    dims = None
+    if group_by is not None:
+        dims = [group_by] if isinstance(group_by, str) else list(group_by)
+        unknown = [dim for dim in dims if dim not in TRANSACTION_GROUPS]
+        if unknown:
+            raise ValueError(f"Unknown aggregation level(s): {', '.join(unknown)}")
+
+    conn = sqlite3.connect(DB_PATH)
+    boundary = get_archive_boundary(user_id, conn)
+    reaches_archive = boundary > 0 and (start_tday is None or start_tday < boundary)
+    # Rollups hold whole months, so they can only stand in for archived rows when the range starts and ends on month edges
+    use_rollups = (reaches_archive and dims is not None and set(dims) <= set(ROLLUP_GROUPS) and min_amount is None and max_amount is None
+                   and (start is None or pd.Timestamp(start).day == 1)
+                   and (end is None or end_tday >= boundary - 1 or (pd.Timestamp(end) + pd.Timedelta(days=1)).day == 1))
+    source = ALL_TRANSACTIONS_SQL if reaches_archive and not use_rollups else 'transactions'
+    where_str, params = where_clause('t', 'tday', start_tday, end_tday)
+    if cursor is not None and dims is None:
+        where_str += ' AND (t.tday < ? OR (t.tday = ? AND t.id < ?))'
+        params.extend([cursor[0], cursor[0], cursor[1]])
+
+    if dims is None:
+        sql = f'SELECT t.id, t.user_id, t.tdate AS tdate_text, t.tday, t.ttype, t.category_id, t.amount, t.note FROM {source} t WHERE {where_str} ORDER BY t.tday DESC, t.id DESC'
+    else:
+        select_dims = ', '.join(f'{TRANSACTION_GROUPS[dim][1]} AS {TRANSACTION_GROUPS[dim][0]}' for dim in dims)
+        group_cols = ', '.join(TRANSACTION_GROUPS[dim][0] for dim in dims)
+        sql = f'SELECT {select_dims}, SUM(t.amount) AS amount, COUNT(*) AS count FROM {source} t WHERE {where_str} GROUP BY {group_cols} ORDER BY {group_cols}'
+    if limit is not None and not use_rollups:
+        sql += ' LIMIT ?'
+        params.append(int(limit))
+    df = pd.read_sql_query(sql, conn, params=params)
+
+    if use_rollups:
+        rollup_where, rollup_params = where_clause('r', 'month', tday_month(start_tday) if start_tday is not None else None,
+                                                   tday_month(end_tday) if end_tday is not None else None)
+        rollup_dims = ', '.join(f'{ROLLUP_GROUPS[dim]} AS {TRANSACTION_GROUPS[dim][0]}' for dim in dims)
+        rollups = pd.read_sql_query(f'SELECT {rollup_dims}, SUM(r.amount) AS amount, SUM(r.count) AS count FROM transaction_rollups r WHERE {rollup_where} GROUP BY {group_cols}',
+                                    conn, params=rollup_params)
+        columns = [TRANSACTION_GROUPS[dim][0] for dim in dims]
+        df = (pd.concat([df, rollups], ignore_index=True)
+              .groupby(columns, as_index=False, dropna=False)[['amount', 'count']].sum()
+              .sort_values(columns, ignore_index=True))
+        if limit is not None:
+            df = df.head(int(limit))
+    categories_df = pd.read_sql_query('SELECT id, name FROM categories WHERE user_id = ? ORDER BY id', conn, params=(user_id,))
+    conn.close()
+
+    if dims is None:
+        df['tdate'] = pd.to_datetime(df['tday'], unit='D')
+        df = df.drop(columns=['tdate_text'])
+        return decode_transactions(df, categories_df)
+    if 'ttype' in df.columns:
+        df['ttype'] = pd.Categorical.from_codes(df['ttype'].fillna(-1).astype(int), categories=TTYPE_LABELS)
+    if 'category_id' in df.columns:
+        codes = pd.Index(categories_df['id']).get_indexer(df['category_id'].fillna(-1).astype(int))
+        df['category'] = pd.Categorical.from_codes(codes, categories=categories_df['name'].tolist())
+    if 'day_index' in df.columns:
+        df = df.rename(columns={'day_index': 'tdate'})
+        df['tdate'] = pd.to_datetime(df['tdate'], unit='D')
+    if 'month' in df.columns:
+        df['month'] = pd.PeriodIndex(df['month'], freq='M')
+    return df
+
+def search_query(text):
+    # Every word of the user's text becomes a quoted prefix term, so FTS5 syntax characters in it are harmless
+    terms = re.findall(r'\w+', text.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_transactions(text, start=None, end=None, ttype=None, page=0, page_size=SEARCH_PAGE_SIZE, user_id=None):
+    # Ranked (bm25, notes weighted above categories) search over hot and archived transactions.
+    # Returns (results, has_more) for the given zero-based page.
+    user_id = session_user_id(user_id)
+    query = search_query(text or '')
+    if user_id is None or not query:
+        return pd.DataFrame(), False
+    where, params = [], []
+    if start is not None:
+        where.append('tday >= ?')
+        params.append(to_tday(start))
+    if end is not None:
+        where.append('tday <= ?')
+        params.append(to_tday(end))
+    if ttype is not None:
+        where.append('ttype = ?')
+        params.append(encode_ttype(ttype))
+    conn = sqlite3.connect(DB_PATH)
+    fts_available = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'transaction_search'").fetchone()
+    if fts_available:
+        sql = f'''
+            SELECT rowid AS id, tday, ttype, category, amount, note, highlight(transaction_search, 0, '**', '**') AS match
+            FROM transaction_search
+            WHERE transaction_search MATCH ? {''.join(f' AND {clause}' for clause in where)}
+            ORDER BY bm25(transaction_search, 2.0, 1.0, 0.0), tday DESC
+            LIMIT ? OFFSET ?
+        '''
+        params = [f'owner:u{user_id} AND {{note category}} : ({query})', *params]
+    else:
+        like_clauses = ' AND '.join("(t.note LIKE ? OR cat.name LIKE ?)" for _ in re.findall(r'\w+', text))
+        sql = f'''
+            SELECT t.id, t.tday, t.ttype, cat.name AS category, t.amount, t.note, t.note AS match
+            FROM {ALL_TRANSACTIONS_SQL} t LEFT JOIN categories cat ON cat.id = t.category_id
+            WHERE t.user_id = ? AND {like_clauses} {''.join(f' AND t.{clause}' for clause in where)}
+            ORDER BY t.tday DESC, t.id DESC
+            LIMIT ? OFFSET ?
+        '''
+        terms = [f'%{term}%' for term in re.findall(r'\w+', text) for _ in range(2)]
+        params = [user_id, *terms, *params]
+    df = pd.read_sql_query(sql, conn, params=[*params, page_size + 1, page * page_size])
+    conn.close()
+    has_more = len(df) > page_size
+    df = df.head(page_size)
+    df['tdate'] = pd.to_datetime(df['tday'], unit='D')
+    df['ttype'] = pd.Categorical.from_codes(df['ttype'].fillna(-1).astype(int), categories=TTYPE_LABELS)
+    return df, has_more
+
+def get_transactions():
+    return query_transactions()
+
+def get_income_expense_totals(start=None, end=None, user_id=None):
+    totals = query_transactions(start=start, end=end, group_by='type', user_id=user_id)
+    if totals.empty:
+        return 0.0, 0.0
+    by_type = dict(zip(totals['ttype'], totals['amount']))
+    return by_type.get('income', 0.0), by_type.get('expense', 0.0)
+
+def remove_transaction(row_id):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        c.execute('SELECT category_id, tday, ttype, amount, note FROM transactions WHERE id = ? AND user_id = ?', (row_id, user_id))
+        row = c.fetchone()
+        if row is not None:
+            c.execute('DELETE FROM transactions WHERE id = ? AND user_id = ?', (row_id, user_id))
+        else:
+            c.execute('SELECT category_id, tday, ttype, amount, note FROM transactions_archive WHERE id = ? AND user_id = ?', (row_id, user_id))
+            row = c.fetchone()
+            if row is None:
+                return
+            c.execute('DELETE FROM transactions_archive WHERE id = ? AND user_id = ?', (row_id, user_id))
+            remove_from_rollup(c, user_id, *row[:4])
+        category_id, tday, ttype_code, amount, note = row
+        if ttype_code == TTYPE_EXPENSE:
+            update_category_forecast(c, user_id, category_id, tday, -amount)
+            record_category_spend(c, user_id, category_id, tday, -amount)
+        c.execute('UPDATE recurring_groups SET stale = 1 WHERE user_id = ? AND group_key = ?',
+                  (user_id, recurring_key(ttype_code, category_id, note, amount)[0]))
+        bump_data_version(c, user_id)
+
+    run_write(write)
+
+def save_user_profile(user_type, savings_goal, risk_tolerance, base_currency=DEFAULT_BASE_CURRENCY):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        c.execute('REPLACE INTO user_profile (user_id, user_type, savings_goal, risk_tolerance, base_currency) VALUES (?, ?, ?, ?, ?)',
+                  (user_id, user_type, savings_goal, risk_tolerance, base_currency))
+        bump_data_version(c, user_id)
+
+    run_write(write)
+
+def get_user_profile(user_id=None):
+    user_id = session_user_id(user_id)
+    if user_id is None:
+        return {'user_type': 'general', 'savings_goal': 0.0, 'risk_tolerance': 'moderate', 'base_currency': DEFAULT_BASE_CURRENCY}
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query('SELECT * FROM user_profile WHERE user_id = ?', conn, params=(user_id,))
+    conn.close()
+    if df.empty:
+        return {'user_type': 'general', 'savings_goal': 0.0, 'risk_tolerance': 'moderate', 'base_currency': DEFAULT_BASE_CURRENCY}
+    profile = df.iloc[0].to_dict()
+    profile['base_currency'] = profile.get('base_currency') or DEFAULT_BASE_CURRENCY
+    return profile
+
+def get_base_currency(user_id=None):
+    return get_user_profile(user_id)['base_currency']
+
+def add_savings_goal(goal_name, target_amount, deadline=None, note='', priority=DEFAULT_GOAL_PRIORITY):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        c.execute('''
+            INSERT INTO savings_goals (user_id, goal_name, target_amount, current_amount, deadline, note, priority, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, goal_name, target_amount, 0.0, deadline, note, priority, datetime.utcnow().isoformat()))
+        bump_data_version(c, user_id)
+
+    run_write(write)
+
+def update_savings_goal(goal_id, goal_name=None, target_amount=None, deadline=None, note=None, priority=None):
+    # current_amount is not editable: it is owned by refresh_goal_allocations
+    if not st.session_state.logged_in:
+        return
+    updates = []
+    params = []
+    if goal_name is not None:
+        updates.append('goal_name = ?')
+        params.append(goal_name)
+    if target_amount is not None:
+        updates.append('target_amount = ?')
+        params.append(target_amount)
+    if deadline is not None:
+        updates.append('deadline = ?')
+        params.append(deadline)
+    if note is not None:
+        updates.append('note = ?')
+        params.append(note)
+    if priority is not None:
+        updates.append('priority = ?')
+        params.append(priority)
+    if updates:
+        user_id = st.session_state.user_id
+        params.append(goal_id)
+        params.append(user_id)
+        update_str = ', '.join(updates)
+
+        def write(c):
+            c.execute(f'UPDATE savings_goals SET {update_str} WHERE id = ? AND user_id = ?', params)
+            if c.rowcount:
+                bump_data_version(c, user_id)
+
+        run_write(write)
+
+def get_savings_goals(user_id=None):
+    user_id = session_user_id(user_id)
+    if user_id is None:
+        return pd.DataFrame()
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query('SELECT * FROM savings_goals WHERE user_id = ? ORDER BY created_at DESC', conn, params=(user_id,))
+    conn.close()
+    return df
+
+def remove_savings_goal(goal_id):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        c.execute('DELETE FROM savings_goals WHERE id = ? AND user_id = ?', (goal_id, user_id))
+        if c.rowcount:
+            c.execute('DELETE FROM goal_contributions WHERE goal_id = ? AND user_id = ?', (goal_id, user_id))
+        bump_data_version(c, user_id)
+
+    run_write(write)
+
+def add_goal_contribution(goal_id, amount, cdate=None, note=''):
+    # Negative amounts record a withdrawal from the goal
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        c.execute('SELECT 1 FROM savings_goals WHERE id = ? AND user_id = ?', (goal_id, user_id))
+        if c.fetchone() is None:
+            return
+        c.execute('INSERT INTO goal_contributions (user_id, goal_id, amount, cdate, note, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                  (user_id, goal_id, amount, cdate or datetime.today().date().isoformat(), note, datetime.utcnow().isoformat()))
+        bump_data_version(c, user_id)
+
+    run_write(write)
+
+def remove_goal_contribution(contribution_id):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        c.execute('DELETE FROM goal_contributions WHERE id = ? AND user_id = ?', (contribution_id, user_id))
+        if c.rowcount:
+            bump_data_version(c, user_id)
+
+    run_write(write)
+
+def get_goal_contributions(user_id=None):
+    user_id = session_user_id(user_id)
+    if user_id is None:
+        return pd.DataFrame()
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query('''
+        SELECT gc.id, gc.goal_id, g.goal_name, gc.amount, gc.cdate, gc.note
+        FROM goal_contributions gc JOIN savings_goals g ON g.id = gc.goal_id
+        WHERE gc.user_id = ? ORDER BY gc.cdate DESC, gc.id DESC
+    ''', conn, params=(user_id,))
+    conn.close()
+    return df
+
+def get_savings_strategy(user_id=None):
+    user_id = session_user_id(user_id)
+    if user_id is None:
+        return DEFAULT_SAVINGS_STRATEGY
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute('SELECT strategy FROM savings_allocation WHERE user_id = ?', (user_id,)).fetchone()
+    conn.close()
+    return row[0] if row and row[0] in SAVINGS_STRATEGIES else DEFAULT_SAVINGS_STRATEGY
+
+def set_savings_strategy(strategy):
+    if not st.session_state.logged_in or strategy not in SAVINGS_STRATEGIES:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        c.execute('''
+            INSERT INTO savings_allocation (user_id, strategy) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET strategy = excluded.strategy
+        ''', (user_id, strategy))
+        bump_data_version(c, user_id)
+
+    run_write(write)
+
+# --- SPENDING FORECASTS ---
+
+FORECAST_STATE_COLUMNS = ('open_month', 'open_total', 'level', 'trend', 'months')
+
+def tday_month(tday):
+    # Month index (year * 12 + month - 1) of a tday, so consecutive months differ by 1
+    day = datetime.fromordinal(int(tday) + EPOCH_ORDINAL)
+    return day.year * 12 + day.month - 1
+
+def holt_update(level, trend, value):
+    if level is None:
+        return value, 0.0
+    new_level = FORECAST_ALPHA * value + (1 - FORECAST_ALPHA) * (level + trend)
+    new_trend = FORECAST_BETA * (new_level - level) + (1 - FORECAST_BETA) * trend
+    return new_level, new_trend
+
+def advance_forecast(state, month):
+    # Closes every month before `month`: the open month's total is folded into the model, then any
+    # months without spending are folded in as zeros
+    state = dict(state)
+    while state['open_month'] < month:
+        state['level'], state['trend'] = holt_update(state['level'], state['trend'], state['open_total'])
+        state['months'] += 1
+        state['open_month'] += 1
+        state['open_total'] = 0.0
+    return state
+
+def save_forecast_state(c, user_id, category_id, state):
+    c.execute('''
+        REPLACE INTO category_forecasts (user_id, category_id, open_month, open_total, level, trend, months, stale)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+    ''', (user_id, category_id, state['open_month'], state['open_total'], state['level'], state['trend'], state['months']))
+
+def update_category_forecast(c, user_id, category_id, tday, amount):
+    # Runs inside the caller's write job. Amounts in the open (latest) month just accumulate, a later month
+    # rolls the model forward first, and a back-dated amount marks the category for a refit from the ledger.
+    month = tday_month(tday)
+    c.execute('SELECT open_month, open_total, level, trend, months, stale FROM category_forecasts WHERE user_id = ? AND category_id = ?',
+              (user_id, category_id))
+    row = c.fetchone()
+    if row is None:
+        save_forecast_state(c, user_id, category_id, {'open_month': month, 'open_total': amount, 'level': None, 'trend': None, 'months': 0})
+        return
+    if row[-1]:
+        return
+    state = dict(zip(FORECAST_STATE_COLUMNS, row))
+    if month < state['open_month']:
+        c.execute('UPDATE category_forecasts SET stale = 1 WHERE user_id = ? AND category_id = ?', (user_id, category_id))
+        return
+    state = advance_forecast(state, month)
+    state['open_total'] += amount
+    save_forecast_state(c, user_id, category_id, state)
+
+def refit_category_forecasts(c, user_id, category_ids):
+    # Replays the ledger's monthly expense totals; only needed after back-dated edits or for pre-existing ledgers
+    placeholders = ', '.join('?' for _ in category_ids)
+    c.execute(f'''
+        SELECT category_id, {SQL_MONTH_INDEX} AS month, SUM(amount)
+        FROM {ALL_TRANSACTIONS_SQL}
+        WHERE user_id = ? AND ttype = ? AND category_id IN ({placeholders})
+        GROUP BY category_id, month ORDER BY category_id, month
+    ''', [user_id, TTYPE_EXPENSE, *category_ids])
+    states = {}
+    for category_id, month, total in c.fetchall():
+        state = states.get(category_id) or {'open_month': month, 'open_total': 0.0, 'level': None, 'trend': None, 'months': 0}
+        state = advance_forecast(state, month)
+        state['open_total'] += total
+        states[category_id] = state
+    for category_id in category_ids:
+        if category_id in states:
+            save_forecast_state(c, user_id, category_id, states[category_id])
+        else:
+            c.execute('DELETE FROM category_forecasts WHERE user_id = ? AND category_id = ?', (user_id, category_id))
+
+def get_category_forecasts():
+    # One row per expense category with this month's spend so far, the forecast for this month and next,
+    # and whether the month-to-date pace is heading over the forecast
+    if not st.session_state.logged_in:
+        return pd.DataFrame()
+    user_id = st.session_state.user_id
+    conn = sqlite3.connect(DB_PATH)
+    stale = [row[0] for row in conn.execute('SELECT category_id FROM category_forecasts WHERE user_id = ? AND stale = 1', (user_id,))]
+    conn.close()
+    if stale:
+        run_write(lambda c: refit_category_forecasts(c, user_id, stale))
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute('''
+        SELECT f.category_id, cat.name, f.open_month, f.open_total, f.level, f.trend, f.months
+        FROM category_forecasts f JOIN categories cat ON cat.id = f.category_id
+        WHERE f.user_id = ?
+    ''', (user_id,)).fetchall()
+    conn.close()
+
+    today = datetime.today()
+    current = today.year * 12 + today.month - 1
+    month_fraction = today.day / calendar.monthrange(today.year, today.month)[1]
+    pace_reliable = today.day >= 7  # a few days of spending says little about the whole month
+    records = []
+    for category_id, name, *state_values in rows:
+        state = advance_forecast(dict(zip(FORECAST_STATE_COLUMNS, state_values)), current)
+        if state['months'] < FORECAST_MIN_MONTHS:
+            continue
+        forecast = max(state['level'] + state['trend'], 0.0)
+        month_to_date = state['open_total'] if state['open_month'] == current else 0.0
+        projected = month_to_date / month_fraction
+        records.append({
+            'category': name,
+            'months': state['months'],
+            'month_to_date': month_to_date,
+            'forecast': forecast,
+            'projected': projected,
+            'next_month': max(state['level'] + 2 * state['trend'], 0.0),
+            'overspend': month_to_date > forecast or (pace_reliable and projected > forecast * (1 + FORECAST_OVERSPEND_MARGIN)),
+        })
+    if not records:
+        return pd.DataFrame()
+    return pd.DataFrame(records).sort_values('forecast', ascending=False).reset_index(drop=True)
+
+def overspend_warnings(forecasts_df):
+    if forecasts_df.empty:
+        return []
+    warnings = []
+    for row in forecasts_df[forecasts_df['overspend']].itertuples():
+        if row.month_to_date > row.forecast:
+            warnings.append(f"You've already spent ₹{row.month_to_date:,.0f} on **{row.category.title()}** this month, above the ₹{row.forecast:,.0f} forecast.")
+        else:
+            warnings.append(f"**{row.category.title()}** is on pace for ₹{row.projected:,.0f} this month, versus a forecast of ₹{row.forecast:,.0f}.")
+    return warnings
+
+# --- CATEGORY BUDGETS ---
+
+def current_month_index():
+    today = datetime.today()
+    return today.year * 12 + today.month - 1
+
+def record_category_spend(c, user_id, category_id, tday, amount):
+    # Keeps the running (category, month) spend in step with the ledger inside the caller's write job
+    month = tday_month(tday)
+    c.execute('''
+        INSERT INTO category_month_spend (user_id, category_id, month, spent) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, category_id, month) DO UPDATE SET spent = spent + excluded.spent
+    ''', (user_id, category_id, month, amount))
+    if month == current_month_index():
+        evaluate_budget_alert(c, user_id, category_id, month)
+
+def evaluate_budget_alert(c, user_id, category_id, month):
+    # Two primary-key lookups, so checking a budget costs the same however large the ledger is.
+    # Each level fires once per category and month.
+    c.execute('''
+        SELECT b.monthly_limit, b.alert_threshold, COALESCE(s.spent, 0.0)
+        FROM category_budgets b
+        LEFT JOIN category_month_spend s ON s.user_id = b.user_id AND s.category_id = b.category_id AND s.month = ?
+        WHERE b.user_id = ? AND b.category_id = ?
+    ''', (month, user_id, category_id))
+    row = c.fetchone()
+    if row is None:
+        return None
+    monthly_limit, threshold, spent = row
+    level = 'exceeded' if spent > monthly_limit else 'warning' if spent >= monthly_limit * threshold else None
+    if level:
+        c.execute('''
+            INSERT OR IGNORE INTO budget_alerts (user_id, category_id, month, level, spent, monthly_limit, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, category_id, month, level, spent, monthly_limit, datetime.utcnow().isoformat()))
+    return level
+
+def set_category_budget(category, monthly_limit, alert_threshold=DEFAULT_BUDGET_ALERT_THRESHOLD):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        category_id = get_category_id(c, user_id, category)
+        c.execute('REPLACE INTO category_budgets (user_id, category_id, monthly_limit, alert_threshold, updated_at) VALUES (?, ?, ?, ?, ?)',
+                  (user_id, category_id, monthly_limit, alert_threshold, datetime.utcnow().isoformat()))
+        # A new or lowered limit may already be crossed this month; a raised one re-arms its alerts
+        c.execute('DELETE FROM budget_alerts WHERE user_id = ? AND category_id = ? AND month = ?', (user_id, category_id, current_month_index()))
+        evaluate_budget_alert(c, user_id, category_id, current_month_index())
+
+    run_write(write)
+
+def remove_category_budget(category_id):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+
+    def write(c):
+        c.execute('DELETE FROM category_budgets WHERE user_id = ? AND category_id = ?', (user_id, category_id))
+        c.execute('DELETE FROM budget_alerts WHERE user_id = ? AND category_id = ?', (user_id, category_id))
+
+    run_write(write)
+
+def get_budget_status(month=None):
+    # Reads the running spend table only; the ledger is never scanned
+    if not st.session_state.logged_in:
+        return pd.DataFrame()
+    month = month if month is not None else current_month_index()
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query('''
+        SELECT b.category_id, cat.name AS category, b.monthly_limit, b.alert_threshold, COALESCE(s.spent, 0.0) AS spent
+        FROM category_budgets b
+        JOIN categories cat ON cat.id = b.category_id
+        LEFT JOIN category_month_spend s ON s.user_id = b.user_id AND s.category_id = b.category_id AND s.month = ?
+        WHERE b.user_id = ?
+        ORDER BY cat.name
+    ''', conn, params=(month, st.session_state.user_id))
+    conn.close()
+    df['used'] = df['spent'] / df['monthly_limit']
+    df['remaining'] = df['monthly_limit'] - df['spent']
+    df['status'] = np.select([df['used'] > 1, df['used'] >= df['alert_threshold']], ['exceeded', 'warning'], default='ok')
+    return df
+
+def get_budget_alerts(unseen_only=True):
+    if not st.session_state.logged_in:
+        return pd.DataFrame()
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query(f'''
+        SELECT a.id, cat.name AS category, a.level, a.spent, a.monthly_limit, a.created_at
+        FROM budget_alerts a JOIN categories cat ON cat.id = a.category_id
+        WHERE a.user_id = ? AND a.month = ? {'AND a.seen = 0' if unseen_only else ''}
+        ORDER BY a.id DESC
+    ''', conn, params=(st.session_state.user_id, current_month_index()))
+    conn.close()
+    return df
+
+def dismiss_budget_alerts():
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+    run_write(lambda c: c.execute('UPDATE budget_alerts SET seen = 1 WHERE user_id = ? AND seen = 0', (user_id,)))
+
+def budget_alert_text(alert):
+    if alert.level == 'exceeded':
+        return f"**{alert.category.title()}** is over budget: ₹{alert.spent:,.0f} spent of ₹{alert.monthly_limit:,.0f}."
+    return f"**{alert.category.title()}** has reached {alert.spent / alert.monthly_limit:.0%} of its ₹{alert.monthly_limit:,.0f} budget."
+
+# --- RECURRING TRANSACTIONS ---
+
+RECURRING_STATE_COLUMNS = ('ttype', 'category_id', 'label', 'amount_bucket', 'occurrences', 'first_tday', 'last_tday',
+                           'gap_count', 'gap_mean', 'gap_m2', 'amount_mean', 'cadence')
+
+def normalize_recurring_note(note):
+    # "Netflix #4411 Oct" and "NETFLIX nov" -> "netflix"
+    words = re.findall(r'[a-z]+', str(note or '').lower())
+    return ' '.join(word for word in words if word not in RECURRING_NOTE_NOISE)
+
+def amount_bucket(amount):
+    return int(round(math.log(max(abs(amount), 0.01)) / math.log1p(RECURRING_AMOUNT_TOLERANCE)))
+
+def recurring_key(ttype, category_id, note, amount):
+    # Transactions with the same type, category, normalized note and amount bucket hash to one group
+    label = normalize_recurring_note(note)
+    bucket = amount_bucket(amount)
+    key = hashlib.blake2b(f'{ttype}|{category_id}|{label}|{bucket}'.encode(), digest_size=8).hexdigest()
+    return key, label, bucket
+
+def merge_gap_stats(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    # Chan et al. pairwise combination of (count, mean, sum of squared deviations)
+    n = n_a + n_b
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta * delta * n_a * n_b / n
+
+def classify_cadence(state):
+    if state['gap_count'] == 0:
+        return None
+    std = math.sqrt(state['gap_m2'] / (state['gap_count'] - 1)) if state['gap_count'] > 1 else 0.0
+    for cadence, (period, tolerance, min_occurrences) in RECURRING_CADENCES.items():
+        if state['occurrences'] >= min_occurrences and abs(state['gap_mean'] - period) <= tolerance and std <= tolerance:
+            return cadence
+    return None
+
+def merge_recurring_batch(state, tdays, amounts):
+    # Folds transactions dated on or after state['last_tday'] into a group's statistics without revisiting old rows.
+    # Several transactions on the same day count as occurrences but add no (zero-day) gap.
+    tdays = sorted(tdays)
+    sequence = ([state['last_tday']] if state['occurrences'] else []) + tdays
+    gaps = [later - earlier for earlier, later in zip(sequence, sequence[1:]) if later > earlier]
+    n_b = len(gaps)
+    mean_b = sum(gaps) / n_b if n_b else 0.0
+    m2_b = sum((gap - mean_b) ** 2 for gap in gaps)
+    state = dict(state)
+    state['gap_count'], state['gap_mean'], state['gap_m2'] = merge_gap_stats(state['gap_count'], state['gap_mean'], state['gap_m2'], n_b, mean_b, m2_b)
+    total = state['occurrences'] + len(tdays)
+    state['amount_mean'] = ((state['amount_mean'] or 0.0) * state['occurrences'] + sum(amounts)) / total
+    state['occurrences'] = total
+    state['first_tday'] = state['first_tday'] if state['first_tday'] is not None else tdays[0]
+    state['last_tday'] = tdays[-1]
+    state['cadence'] = classify_cadence(state)
+    return state
+
+def empty_recurring_state(ttype, category_id, label, bucket):
+    return {'ttype': ttype, 'category_id': category_id, 'label': label, 'amount_bucket': bucket, 'occurrences': 0,
+            'first_tday': None, 'last_tday': None, 'gap_count': 0, 'gap_mean': 0.0, 'gap_m2': 0.0, 'amount_mean': None, 'cadence': None}
+
+def rebuild_recurring_group(conn, user_id, key, state):
+    # Full recount of one group, for deletions and back-dated entries. The amount bucket bounds the scan to
+    # the group's category and amount range; the hash check then drops rows that only share the range.
+    step = math.log1p(RECURRING_AMOUNT_TOLERANCE)
+    low, high = math.exp((state['amount_bucket'] - 0.5) * step) * 0.999, math.exp((state['amount_bucket'] + 0.5) * step) * 1.001
+    rows = conn.execute(f'''
+        SELECT tday, amount, note FROM {ALL_TRANSACTIONS_SQL}
+        WHERE user_id = ? AND ttype IS ? AND category_id IS ? AND amount BETWEEN ? AND ?
+        ORDER BY tday
+    ''', (user_id, state['ttype'], state['category_id'], low, high)).fetchall()
+    matching = [(tday, amount) for tday, amount, note in rows if recurring_key(state['ttype'], state['category_id'], note, amount)[0] == key]
+    if not matching:
+        return None
+    fresh = empty_recurring_state(state['ttype'], state['category_id'], state['label'], state['amount_bucket'])
+    return merge_recurring_batch(fresh, [tday for tday, _ in matching], [amount for _, amount in matching])
+
+def detect_recurring(user_id):
+    # Examines only transactions added since the last run (plus groups invalidated by deletions), so the cost
+    # is linear in new rows. Returns the number of groups updated.
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute('SELECT last_transaction_id FROM recurring_watermarks WHERE user_id = ?', (user_id,)).fetchone()
+    watermark = row[0] if row else 0
+    # Read through the archive too, in case maintenance moved rows that were never examined
+    new_rows = conn.execute(f'SELECT id, tday, ttype, category_id, amount, note FROM {ALL_TRANSACTIONS_SQL} WHERE user_id = ? AND id > ? ORDER BY id',
+                            (user_id, watermark)).fetchall()
+    stale_keys = {row[0] for row in conn.execute('SELECT group_key FROM recurring_groups WHERE user_id = ? AND stale = 1', (user_id,))}
+    if not new_rows and not stale_keys:
+        conn.close()
+        return 0
+
+    batches = {}
+    for _, tday, ttype, category_id, amount, note in new_rows:
+        key, label, bucket = recurring_key(ttype, category_id, note, amount)
+        batch = batches.get(key)
+        if batch is None:
+            batch = batches[key] = {'state': empty_recurring_state(ttype, category_id, label, bucket), 'tdays': [], 'amounts': []}
+        batch['tdays'].append(tday)
+        batch['amounts'].append(amount)
+
+    keys = list(set(batches) | stale_keys)
+    existing = {}
+    for i in range(0, len(keys), 500):
+        part = keys[i:i + 500]
+        query = f"SELECT group_key, {', '.join(RECURRING_STATE_COLUMNS)} FROM recurring_groups WHERE user_id = ? AND group_key IN ({', '.join('?' for _ in part)})"
+        for row in conn.execute(query, [user_id, *part]):
+            existing[row[0]] = dict(zip(RECURRING_STATE_COLUMNS, row[1:]))
+
+    updates = {}
+    for key in keys:
+        state, batch = existing.get(key), batches.get(key)
+        if state is not None and (key in stale_keys or (batch and min(batch['tdays']) < state['last_tday'])):
+            updates[key] = rebuild_recurring_group(conn, user_id, key, state)
+        elif batch is not None:
+            updates[key] = merge_recurring_batch(state or batch['state'], batch['tdays'], batch['amounts'])
+    conn.close()
+    last_id = new_rows[-1][0] if new_rows else watermark
+
+    def write(c):
+        current = c.execute('SELECT last_transaction_id FROM recurring_watermarks WHERE user_id = ?', (user_id,)).fetchone()
+        if (current[0] if current else 0) != watermark:
+            return 0  # another session already processed these rows
+        # Groups invalidated by a delete while we were computing keep their stale flag for the next run
+        newly_stale = {row[0] for row in c.execute('SELECT group_key FROM recurring_groups WHERE user_id = ? AND stale = 1', (user_id,))} - stale_keys
+        placeholders = ', '.join('?' for _ in RECURRING_STATE_COLUMNS)
+        c.executemany(f"REPLACE INTO recurring_groups (user_id, group_key, {', '.join(RECURRING_STATE_COLUMNS)}, stale) VALUES (?, ?, {placeholders}, 0)",
+                      [(user_id, key, *(state[col] for col in RECURRING_STATE_COLUMNS)) for key, state in updates.items()
+                       if state is not None and key not in newly_stale])
+        c.executemany('DELETE FROM recurring_groups WHERE user_id = ? AND group_key = ?',
+                      [(user_id, key) for key, state in updates.items() if state is None and key not in newly_stale])
+        c.execute('REPLACE INTO recurring_watermarks (user_id, last_transaction_id) VALUES (?, ?)', (user_id, last_id))
+        return len(updates)
+
+    return run_write(write)
+
+def get_recurring_items(ttype='expense'):
+    # Detected recurring transactions with their cadence, typical amount and monthly-equivalent cost
+    if not st.session_state.logged_in:
+        return pd.DataFrame()
+    user_id = st.session_state.user_id
+    detect_recurring(user_id)
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query('''
+        SELECT r.label, cat.name AS category, r.cadence, r.amount_mean, r.occurrences, r.first_tday, r.last_tday, r.gap_mean
+        FROM recurring_groups r LEFT JOIN categories cat ON cat.id = r.category_id
+        WHERE r.user_id = ? AND r.cadence IS NOT NULL AND r.ttype = ?
+        ORDER BY r.amount_mean * 30.44 / r.gap_mean DESC
+    ''', conn, params=(user_id, encode_ttype(ttype)))
+    conn.close()
+    if df.empty:
+        return df
+    today = to_tday(datetime.today())
+    tolerance = df['cadence'].map({cadence: spec[1] for cadence, spec in RECURRING_CADENCES.items()})
+    df['monthly_cost'] = df['amount_mean'] * 30.44 / df['gap_mean']
+    df['last_date'] = pd.to_datetime(df['last_tday'], unit='D')
+    df['next_date'] = pd.to_datetime((df['last_tday'] + df['gap_mean']).round(), unit='D')
+    # A missed cycle (plus slack) means the subscription has probably been cancelled
+    df['active'] = today <= df['last_tday'] + df['gap_mean'] + 2 * tolerance
+    df['label'] = df['label'].where(df['label'] != '', df['category'])
+    return df
+
+# --- AUTO-CATEGORIZATION ---
+
+def learn_note_categories(c, user_id, associations):
+    # associations: (note_key, category_id, uses) triples from explicitly categorized transactions
+    c.executemany('''
+        INSERT INTO note_categories (user_id, note_key, category_id, uses) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, note_key, category_id) DO UPDATE SET uses = uses + excluded.uses
+    ''', [(user_id, note_key, category_id, uses) for note_key, category_id, uses in associations if note_key])
+
+@st.cache_resource(show_spinner=False, max_entries=256)
+def build_category_matcher(rules):
+    # rules: tuple of (keyword, category) pairs. All keywords become one alternation, longest first so
+    # "prime video" wins over "prime"; lookarounds stand in for word boundaries around multi-word keywords.
+    keywords = {}
+    for keyword, category in rules:
+        keyword = ' '.join(re.findall(r'[a-z0-9]+', keyword.lower()))
+        if keyword:
+            keywords.setdefault(keyword, category)
+    if not keywords:
+        return None, {}
+    alternation = '|'.join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True))
+    return re.compile(f'(?<![a-z0-9])({alternation})(?![a-z0-9])'), keywords
+
+def get_category_rules(user_id=None):
+    user_id = user_id if user_id is not None else st.session_state.user_id
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query('SELECT id, keyword, category, created_at FROM category_rules WHERE user_id = ? ORDER BY id', conn, params=(user_id,))
+    conn.close()
+    return df
+
+def add_category_rule(keyword, category):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+    run_write(lambda c: c.execute('REPLACE INTO category_rules (user_id, keyword, category, created_at) VALUES (?, ?, ?, ?)',
+                                  (user_id, keyword.strip().lower(), normalize_category(category), datetime.utcnow().isoformat())))
+
+def remove_category_rule(rule_id):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+    run_write(lambda c: c.execute('DELETE FROM category_rules WHERE id = ? AND user_id = ?', (rule_id, user_id)))
+
+def categorize_notes(notes, user_id=None):
+    # Vectorized over a Series of notes; returns categories aligned with it (None where nothing matched).
+    # Precedence: the user's keyword rules, then the category the user chose most often for the same
+    # normalized note, then the default keyword rules. Work is done once per distinct note.
+    user_id = user_id if user_id is not None else st.session_state.user_id
+    notes = pd.Series(notes, dtype=object).fillna('').astype(str)
+    distinct = pd.Series(notes.unique())
+    if distinct.empty:
+        return pd.Series(None, index=notes.index, dtype=object)
+    text = distinct.str.lower().str.replace(r'[^a-z0-9]+', ' ', regex=True).str.strip()
+
+    conn = sqlite3.connect(DB_PATH)
+    user_rules = conn.execute('SELECT keyword, category FROM category_rules WHERE user_id = ? ORDER BY id', (user_id,)).fetchall()
+    learned = dict(conn.execute('''
+        SELECT n.note_key, cat.name FROM note_categories n JOIN categories cat ON cat.id = n.category_id
+        WHERE n.user_id = ? AND n.uses = (SELECT MAX(uses) FROM note_categories m WHERE m.user_id = n.user_id AND m.note_key = n.note_key)
+    ''', (user_id,)).fetchall())
+    conn.close()
+
+    result = pd.Series(None, index=distinct.index, dtype=object)
+    user_regex, user_keywords = build_category_matcher(tuple(user_rules))
+    if user_regex is not None:
+        result = text.str.extract(user_regex, expand=False).map(user_keywords)
+    if learned:
+        missing = result.isna()
+        result[missing] = distinct[missing].map(normalize_recurring_note).map(learned)
+    default_regex, default_keywords = build_category_matcher(tuple((keyword, category) for category, keywords in DEFAULT_CATEGORY_RULES.items() for keyword in keywords))
+    missing = result.isna()
+    if missing.any():
+        result[missing] = text[missing].str.extract(default_regex, expand=False).map(default_keywords)
+    return notes.map(pd.Series(result.values, index=distinct.values))
+
+def suggest_category(note):
+    if not st.session_state.logged_in or not str(note or '').strip():
+        return None
+    category = categorize_notes([note]).iloc[0]
+    return category if isinstance(category, str) else None
+
+# --- PRICE FETCHING ---
+
+def fetch_latest_prices(symbols):
+    # One batched download for many symbols -> {symbol: latest close}, None where nothing came back
+    symbols = sorted(set(symbols))
+    if not symbols:
+        return {}
+    try:
+        data = yf.download(symbols, period='5d', progress=False)
+    except Exception:
+        return dict.fromkeys(symbols)
+    if data is None or data.empty or 'Close' not in data:
+        return dict.fromkeys(symbols)
+    close = data['Close']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(symbols[0])
+    last = close.reindex(columns=symbols).ffill().iloc[-1]
+    return {symbol: float(last[symbol]) if pd.notna(last[symbol]) else None for symbol in symbols}
+
+class QuoteScheduler:
+    # Server-wide quote refresher. Sessions only register interest (touch) and read the shared quotes table; this
+    # thread decides what is due, most urgent first: symbols a page is waiting on, then symbols on screen, then
+    # symbols that are merely held or watched by listeners such as the price-alert engine. Due symbols are fetched
+    # in batches of QUOTE_BATCH_SIZE, each one provider request, drawn from a token bucket of QUOTE_REQUESTS_PER_MINUTE.
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+        self.wake = threading.Event()
+        self.interest = {}  # symbol -> {'seen': ts, 'visible': ts}
+        self.waiting = set()
+        self.listeners = []
+        self.tokens = float(QUOTE_BURST_REQUESTS)
+        self.tokens_at = time.monotonic()
+        self.stats = {'requests': 0, 'symbols_fetched': 0, 'rate_limited': 0, 'last_cycle_at': None, 'last_error': None}
+        conn = sqlite3.connect(DB_PATH)
+        self.attempted = dict(conn.execute('SELECT symbol, fetched_at FROM quotes').fetchall())
+        conn.close()
+        self.thread = threading.Thread(target=self.run, name='quote-scheduler', daemon=True)
+        self.thread.start()
+
+    def add_listener(self, listener):
+        # listener.hot_symbols() -> symbols to keep fresh every listener.refresh_interval seconds;
+        # listener.on_quotes(prices) is called after every batch
+        with self.lock:
+            self.listeners.append(listener)
+
+    def touch(self, symbols, visible=True):
+        now = time.time()
+        with self.lock:
+            for symbol in symbols:
+                entry = self.interest.setdefault(symbol, {'seen': now, 'visible': 0.0})
+                entry['seen'] = now
+                if visible:
+                    entry['visible'] = now
+
+    def wait_for(self, symbols, timeout):
+        # Blocks a page until the scheduler has tried each never-quoted symbol once (or the timeout passes)
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.waiting.update(symbol for symbol in symbols if symbol not in self.attempted)
+            self.wake.set()
+            while any(symbol not in self.attempted for symbol in symbols):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.updated.wait(remaining)
+
+    def due_symbols(self, now):
+        with self.lock:
+            listeners = list(self.listeners)
+        watched = {}
+        for listener in listeners:
+            for symbol in listener.hot_symbols():
+                watched[symbol] = min(watched.get(symbol, listener.refresh_interval), listener.refresh_interval)
+        with self.lock:
+            for symbol in [symbol for symbol, entry in self.interest.items() if now - entry['seen'] > QUOTE_HOT_SECONDS]:
+                del self.interest[symbol]
+            candidates = {}
+            for symbol, entry in self.interest.items():
+                if now - entry['visible'] <= QUOTE_VISIBLE_SECONDS:
+                    candidates[symbol] = (1, QUOTE_VISIBLE_REFRESH_SECONDS)
+                else:
+                    candidates[symbol] = (2, QUOTE_BACKGROUND_REFRESH_SECONDS)
+            for symbol, interval in watched.items():
+                priority, current = candidates.get(symbol, (2, interval))
+                candidates[symbol] = (priority, min(current, interval))
+            for symbol in self.waiting:
+                candidates[symbol] = (0, 0)
+            due = [(priority, self.attempted.get(symbol, 0.0), symbol) for symbol, (priority, interval) in candidates.items()
+                   if now - self.attempted.get(symbol, 0.0) >= interval]
+        return [symbol for _, _, symbol in sorted(due)]
+
+    def take_token(self):
+        elapsed = time.monotonic() - self.tokens_at
+        self.tokens_at += elapsed
+        self.tokens = min(float(QUOTE_BURST_REQUESTS), self.tokens + elapsed * QUOTE_REQUESTS_PER_MINUTE / 60.0)
+        if self.tokens < 1.0:
+            self.stats['rate_limited'] += 1
+            return False
+        self.tokens -= 1.0
+        return True
+
+    def refresh(self, symbols):
+        prices = fetch_latest_prices(symbols)
+        now = time.time()
+        fresh = [(symbol, price, now) for symbol, price in prices.items() if price is not None]
+        if fresh:
+            self.writer.submit(lambda c: c.executemany('REPLACE INTO quotes (symbol, price, fetched_at) VALUES (?, ?, ?)', fresh)).result()
+        with self.lock:
+            for symbol in symbols:
+                self.attempted[symbol] = now
+                self.waiting.discard(symbol)
+            self.updated.notify_all()
+            listeners = list(self.listeners)
+        self.stats['requests'] += 1
+        self.stats['symbols_fetched'] += len(fresh)
+        for listener in listeners:
+            listener.on_quotes({symbol: price for symbol, price, _ in fresh})
+
+    def run_cycle(self):
+        due = self.due_symbols(time.time())
+        while due and self.take_token():
+            batch, due = due[:QUOTE_BATCH_SIZE], due[QUOTE_BATCH_SIZE:]
+            self.refresh(batch)
+        self.stats['last_cycle_at'] = datetime.utcnow().isoformat()
+
+    def run(self):
+        while True:
+            try:
+                self.run_cycle()
+                self.stats['last_error'] = None
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+            self.wake.wait(QUOTE_TICK_SECONDS)
+            self.wake.clear()
+
+    def hot_count(self):
+        with self.lock:
+            return len(self.interest)
+
+@st.cache_resource(show_spinner=False)
+def get_quote_scheduler():
+    return QuoteScheduler(get_db_writer())
+
+def read_quotes(symbols):
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute(f"SELECT symbol, price FROM quotes WHERE symbol IN ({', '.join('?' for _ in symbols)})", list(symbols)).fetchall()
+    conn.close()
+    return dict(rows)
+
+def get_quotes(symbols, visible=True, wait=QUOTE_FIRST_WAIT_SECONDS):
+    # Page-side price access: registers the symbols as hot and reads the shared quotes table. Providers are only
+    # ever called by the scheduler; a symbol nobody has quoted yet is waited on for at most `wait` seconds.
+    symbols = sorted({str(symbol).strip().upper() for symbol in symbols if symbol and str(symbol).strip()})
+    if not symbols:
+        return {}
+    scheduler = get_quote_scheduler()
+    scheduler.touch(symbols, visible)
+    quotes = read_quotes(symbols)
+    missing = [symbol for symbol in symbols if symbol not in quotes]
+    if missing and wait:
+        scheduler.wait_for(missing, wait)
+        quotes.update(read_quotes(missing))
+    return {symbol: quotes.get(symbol) for symbol in symbols}
+
+def get_quote(symbol, visible=True):
+    return get_quotes([symbol], visible).get(str(symbol).strip().upper())
+
+def touch_held_symbols(user_id):
+    # Keeps a signed-in user's holdings warm even while they are on pages that don't show prices
+    conn = sqlite3.connect(DB_PATH)
+    symbols = [row[0] for row in conn.execute('SELECT symbol FROM positions WHERE user_id = ? AND shares > 0', (user_id,))]
+    conn.close()
+    get_quote_scheduler().touch(symbols, visible=False)
+
+def held_quotes_stamp(user_id=None):
+    # Latest quote refresh among the user's open positions, so anything valued at live prices can tell when they moved
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute('''
+        SELECT MAX(q.fetched_at) FROM positions p JOIN quotes q ON q.symbol = p.symbol
+        WHERE p.user_id = ? AND p.shares > 1e-9
+    ''', (session_user_id(user_id),)).fetchone()
+    conn.close()
+    return int(row[0] or 0)
+
+def value_holdings(holdings_df, base_currency=None):
+    # Prices each distinct symbol once (in its own currency) and adds market value and P&L columns in the base currency.
+    # Cost basis and realized P&L are converted at today's rate.
+    holdings_df = add_fx_columns(holdings_df, base_currency)
+    prices = get_quotes(holdings_df['symbol'])
+    # Unquoted symbols keep a NaN price, so their market value and P&L stay unknown (and out of sums) instead of 0
+    holdings_df['price'] = holdings_df['symbol'].map(prices).astype(float)
+    holdings_df['market_value'] = holdings_df['shares'] * holdings_df['price'] * holdings_df['fx_rate']
+    holdings_df['cost_basis_base'] = holdings_df['cost_basis'] * holdings_df['fx_rate']
+    holdings_df['unrealized_pnl'] = holdings_df['market_value'] - holdings_df['cost_basis_base']
+    return holdings_df
+
+def realized_pnl_total(base_currency=None, user_id=None):
+    positions = get_holdings(include_closed=True, user_id=user_id)
+    if positions.empty:
+        return 0.0
+    return add_fx_columns(positions, base_currency)['realized_pnl_base'].sum()
+
+# --- PRICE ALERTS ---
+
+class PriceAlertEngine:
+    # One per server process, fed by the quote scheduler: it asks for the distinct symbols of all active alerts to
+    # be kept fresh and checks every refreshed batch against a per-symbol sorted threshold index. With thresholds
+    # ascending, the alerts a price triggers are a prefix ('above') or suffix ('below') found by bisection.
+    # Triggered alerts are written to price_alerts, which is all sessions ever read.
+    refresh_interval = PRICE_ALERT_INTERVAL_SECONDS
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.index = {}
+        self.dirty = True
+        self.stats = {'checks': 0, 'symbols': 0, 'alerts': 0, 'triggered': 0, 'last_check_at': None}
+
+    def invalidate(self):
+        # Called after alerts are added, removed or triggered; the index is rebuilt on next use
+        with self.lock:
+            self.dirty = True
+
+    def rebuild_index(self):
+        # Clear the flag before reading: an invalidate() that lands during the query then forces another rebuild
+        with self.lock:
+            self.dirty = False
+        conn = sqlite3.connect(DB_PATH)
+        rows = conn.execute("SELECT id, symbol, kind, threshold FROM price_alerts WHERE status = 'active' ORDER BY symbol, threshold").fetchall()
+        conn.close()
+        index = {}
+        for alert_id, symbol, kind, threshold in rows:
+            side = index.setdefault(symbol, {'above': ([], []), 'below': ([], [])})[PRICE_ALERT_KINDS[kind][1]]
+            side[0].append(threshold)
+            side[1].append(alert_id)
+        with self.lock:
+            self.index = index
+        self.stats.update(symbols=len(index), alerts=len(rows))
+
+    def hot_symbols(self):
+        with self.lock:
+            dirty = self.dirty
+        if dirty:
+            self.rebuild_index()
+        with self.lock:
+            return list(self.index)
+
+    def matches(self, symbol, price):
+        with self.lock:
+            entry = self.index.get(symbol)
+        if entry is None:
+            return []
+        above_thresholds, above_ids = entry['above']
+        below_thresholds, below_ids = entry['below']
+        return above_ids[:bisect.bisect_right(above_thresholds, price)] + below_ids[bisect.bisect_left(below_thresholds, price):]
+
+    def on_quotes(self, prices):
+        now = datetime.utcnow().isoformat()
+        triggered = [(price, now, alert_id) for symbol, price in prices.items() for alert_id in self.matches(symbol, price)]
+        if triggered:
+            self.writer.submit(lambda c: c.executemany(
+                "UPDATE price_alerts SET status = 'triggered', triggered_price = ?, triggered_at = ? WHERE id = ? AND status = 'active'", triggered)).result()
+            self.invalidate()
+        self.stats.update(checks=self.stats['checks'] + 1, triggered=self.stats['triggered'] + len(triggered), last_check_at=now)
+        return len(triggered)
+
+@st.cache_resource(show_spinner=False)
+def get_price_alert_engine():
+    engine = PriceAlertEngine(get_db_writer())
+    get_quote_scheduler().add_listener(engine)
+    return engine
+
+def add_price_alert(symbol, kind, value):
+    # value is a price for 'above'/'below' and a percentage, measured from the current price, for the pct kinds
+    if not st.session_state.logged_in:
+        return "Please log in to set alerts."
+    symbol = symbol.strip().upper()
+    if not symbol or kind not in PRICE_ALERT_KINDS or value <= 0:
+        return "Enter a symbol, an alert type and a positive value."
+    reference_price = None
+    threshold = value
+    if kind in ('pct_up', 'pct_down'):
+        reference_price = get_quote(symbol)
+        if reference_price is None:
+            return f"Couldn't get a current price for {symbol}."
+        threshold = reference_price * (1 + value / 100 if kind == 'pct_up' else 1 - value / 100)
+    user_id = st.session_state.user_id
+    run_write(lambda c: c.execute('''
+        INSERT INTO price_alerts (user_id, symbol, kind, value, threshold, reference_price, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, symbol, kind, value, threshold, reference_price, datetime.utcnow().isoformat())))
+    get_price_alert_engine().invalidate()
+    return None
+
+def remove_price_alert(alert_id):
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+    run_write(lambda c: c.execute('DELETE FROM price_alerts WHERE id = ? AND user_id = ?', (alert_id, user_id)))
+    get_price_alert_engine().invalidate()
+
+def get_price_alerts(status=None, unseen_only=False):
+    if not st.session_state.logged_in:
+        return pd.DataFrame()
+    where = ['user_id = ?']
+    params = [st.session_state.user_id]
+    if status is not None:
+        where.append('status = ?')
+        params.append(status)
+    if unseen_only:
+        where.append('seen = 0')
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query(f'''
+        SELECT id, symbol, kind, value, threshold, reference_price, status, triggered_price, triggered_at, created_at
+        FROM price_alerts WHERE {' AND '.join(where)} ORDER BY id DESC
+    ''', conn, params=params)
+    conn.close()
+    return df
+
+def dismiss_price_alerts():
+    if not st.session_state.logged_in:
+        return
+    user_id = st.session_state.user_id
+    run_write(lambda c: c.execute("UPDATE price_alerts SET seen = 1 WHERE user_id = ? AND status = 'triggered' AND seen = 0", (user_id,)))
+
+def price_alert_text(alert):
+    moved = f"{alert.value:g}% from {alert.reference_price:,.2f}" if alert.reference_price else None
+    if alert.status == 'triggered':
+        condition = {'above': f'rose above {alert.threshold:,.2f}', 'below': f'fell below {alert.threshold:,.2f}',
+                     'pct_up': f'rose {moved}', 'pct_down': f'fell {moved}'}[alert.kind]
+        return f"**{alert.symbol}** {condition} (last {alert.triggered_price:,.2f})."
+    condition = {'above': f'rises above {alert.threshold:,.2f}', 'below': f'falls below {alert.threshold:,.2f}',
+                 'pct_up': f'rises {moved}', 'pct_down': f'falls {moved}'}[alert.kind]
+    return f"**{alert.symbol}**: alert when it {condition}."
+
+# --- CURRENCIES & FX ---
+
+def format_money(amount, currency=DEFAULT_BASE_CURRENCY):
+    symbol = CURRENCY_SYMBOLS.get(currency, f'{currency} ')
+    return f"{symbol}{amount:,.2f}"
+
+def currency_units(currency):
+    return MINOR_CURRENCY_UNITS.get(currency, (currency, 1.0))
+
+def detect_currency(symbol):
+    try:
+        fast_info = yf.Ticker(symbol).fast_info
+        if fast_info and 'currency' in fast_info and fast_info['currency']:
+            return fast_info['currency']
+    except Exception:
+        pass
+    if symbol in INDEX_CURRENCIES:
+        return INDEX_CURRENCIES[symbol]
+    for suffix, currency in SYMBOL_SUFFIX_CURRENCIES.items():
+        if symbol.endswith(suffix):
+            return currency
+    return 'USD'
+
+def get_symbol_currencies(symbols):
+    # Quote currency per symbol, detected once from yfinance metadata and cached in symbol_currency
+    symbols = sorted(set(symbols))
+    if not symbols:
+        return {}
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute(f"SELECT symbol, currency FROM symbol_currency WHERE symbol IN ({', '.join('?' for _ in symbols)})", symbols)
+    currencies = dict(c.fetchall())
+    conn.close()
+    missing = [symbol for symbol in symbols if symbol not in currencies]
+    if missing:
+        now = datetime.utcnow().isoformat()
+        detected = {symbol: detect_currency(symbol) for symbol in missing}
+        rows = [(symbol, currency, now) for symbol, currency in detected.items()]
+        # Cache fill only: no need to wait for the commit
+        submit_write(lambda c: c.executemany('REPLACE INTO symbol_currency (symbol, currency, updated_at) VALUES (?, ?, ?)', rows))
+        currencies.update(detected)
+    return currencies
+
+def get_fx_matrix(currencies, base_currency, start, end):
+    # Daily date x currency matrix of base-currency units per unit of each currency.
+    # Served from fx_rates; missing or stale pairs are fetched together in one batched download.
+    dates = pd.date_range(start, end, freq='D')
+    columns = sorted(set(currencies) | {base_currency})
+    fx = pd.DataFrame(1.0, index=dates, columns=columns)
+    foreign = [currency for currency in columns if currency != base_currency]
+    if not foreign:
+        return fx
+    conn = sqlite3.connect(DB_PATH)
+    cached = pd.read_sql_query(
+        f"SELECT rate_date, currency, rate FROM fx_rates WHERE base = ? AND currency IN ({', '.join('?' for _ in foreign)}) AND rate_date BETWEEN ? AND ?",
+        conn, params=[base_currency, *foreign, (start - timedelta(days=FX_STALE_DAYS)).isoformat(), end.isoformat()])
+    conn.close()
+    newest = cached.groupby('currency')['rate_date'].max()
+    oldest = cached.groupby('currency')['rate_date'].min()
+    stale = [currency for currency in foreign
+             if currency not in newest.index
+             or newest[currency] < (end - timedelta(days=FX_STALE_DAYS)).isoformat()
+             or oldest[currency] > (start + timedelta(days=FX_STALE_DAYS)).isoformat()]
+    if stale:
+        pairs = {f'{currency}{base_currency}=X': currency for currency in stale}
+        fetched = download_close_matrix(list(pairs), start - timedelta(days=FX_STALE_DAYS), end + timedelta(days=1))
+        if not fetched.empty:
+            fetched = fetched.rename(columns=pairs)
+            fetched.index = fetched.index.strftime('%Y-%m-%d')
+            new_rates = fetched.rename_axis('rate_date').reset_index().melt(id_vars='rate_date', var_name='currency', value_name='rate').dropna()
+            rows = [(base_currency, currency, rate_date, float(rate)) for rate_date, currency, rate in new_rates.itertuples(index=False)]
+            submit_write(lambda c: c.executemany('REPLACE INTO fx_rates (base, currency, rate_date, rate) VALUES (?, ?, ?, ?)', rows))
+            # An empty read comes back as object columns, which would leak into the concatenated rates
+            cached = new_rates if cached.empty else pd.concat([cached, new_rates]).drop_duplicates(['rate_date', 'currency'], keep='last')
+    if not cached.empty:
+        rates = cached.pivot(index='rate_date', columns='currency', values='rate').astype(float)
+        rates.index = pd.to_datetime(rates.index)
+        rates = rates.reindex(rates.index.union(dates)).sort_index().ffill().bfill().reindex(dates)
+        fx.update(rates)
+    missing = [currency for currency in foreign if cached.empty or currency not in cached['currency'].values]
+    fx[missing] = np.nan
+    return fx
+
+def get_fx_rates(currencies, base_currency):
+    today = datetime.utcnow().date()
+    return get_fx_matrix(currencies, base_currency, today - timedelta(days=FX_STALE_DAYS), today).iloc[-1].to_dict()
+
+def add_fx_columns(holdings_df, base_currency=None):
+    # Adds each symbol's quote currency and the multiplier that converts its prices into the base currency
+    base_currency = base_currency or get_base_currency()
+    holdings_df = holdings_df.copy()
+    holdings_df['currency'] = holdings_df['symbol'].map(get_symbol_currencies(holdings_df['symbol']))
+    units = holdings_df['currency'].map(currency_units)
+    iso_currencies = units.str[0]
+    rates = get_fx_rates(set(iso_currencies), base_currency)
+    holdings_df['fx_rate'] = iso_currencies.map(rates).astype(float) * units.str[1].astype(float)
+    if 'realized_pnl' in holdings_df:
+        holdings_df['realized_pnl_base'] = holdings_df['realized_pnl'] * holdings_df['fx_rate']
+    return holdings_df
+
+def convert_price_matrix(prices, base_currency):
+    # Converts a date x symbol price matrix into the base currency with one element-wise multiply
+    if prices.empty:
+        return prices
+    currencies = get_symbol_currencies(prices.columns)
+    units = [currency_units(currencies[symbol]) for symbol in prices.columns]
+    iso_currencies = [iso for iso, _ in units]
+    multipliers = np.array([multiplier for _, multiplier in units])
+    fx = get_fx_matrix(iso_currencies, base_currency, prices.index.min().date(), prices.index.max().date())
+    factors = fx.reindex(prices.index.normalize())[iso_currencies].to_numpy() * multipliers
+    return pd.DataFrame(prices.to_numpy() * factors, index=prices.index, columns=prices.columns)
+
+def fetch_alpha_vantage_quote(symbol, api_key=None):
+    api_key = api_key or get_config('alpha_vantage_key')
+    if not api_key:
+        return None
+    url = ALPHA_VANTAGE_URL
+    params = {
+        'function': 'GLOBAL_QUOTE',
+        'symbol': symbol,
+        'apikey': api_key
+    }
+    try:
+        r = requests.get(url, params=params, timeout=10)
+        data = r.json()
+        quote = data.get('Global Quote', {})
+        price = quote.get('05. price')
+        return float(price) if price else None
+    except Exception:
+        return None
+
+@st.cache_data(ttl=SYMBOL_HISTORY_TTL, show_spinner=False)
+def get_symbol_history(symbol, period='60d'):
+    # Cached Date/Close history; the latest close doubles as the lookup price so repeat lookups stay offline
+    try:
+        hist = yf.download(symbol, period=period, progress=False)
+    except Exception:
+        return pd.DataFrame()
+    if hist is None or hist.empty:
+        return pd.DataFrame()
+    # Simplify column names if MultiIndex exists
+    if isinstance(hist.columns, pd.MultiIndex):
+        hist.columns = [col[0] if isinstance(col, tuple) else col for col in hist.columns]
+    hist = hist.reset_index()
+    if 'Date' not in hist.columns or 'Close' not in hist.columns:
+        return pd.DataFrame()
+    return hist[['Date', 'Close']].dropna()
+
+# --- TICKER UNIVERSE & AUTOCOMPLETE ---
+
+def import_ticker_universe(csv_file):
+    # CSV with a symbol column and optional name/exchange columns
+    df = pd.read_csv(csv_file)
+    df.columns = [str(col).strip().lower() for col in df.columns]
+    if 'symbol' not in df.columns:
+        raise ValueError("The ticker list needs a 'symbol' column.")
+    df['symbol'] = df['symbol'].astype(str).str.strip().str.upper()
+    df = df[df['symbol'] != ''].drop_duplicates('symbol')
+    names = df['name'] if 'name' in df.columns else pd.Series(None, index=df.index)
+    exchanges = df['exchange'] if 'exchange' in df.columns else pd.Series(None, index=df.index)
+    now = datetime.utcnow().isoformat()
+    rows = [(symbol, None if pd.isna(name) else str(name), None if pd.isna(exchange) else str(exchange), now)
+            for symbol, name, exchange in zip(df['symbol'], names, exchanges)]
+    run_write(lambda c: c.executemany('REPLACE INTO tickers (symbol, name, exchange, updated_at) VALUES (?, ?, ?, ?)', rows))
+    return len(rows)
+
+def get_ticker_universe_version():
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*), MAX(updated_at) FROM tickers')
+    version = c.fetchone()
+    conn.close()
+    return version
+
+@st.cache_resource(show_spinner=False)
+def build_ticker_index(universe_version):
+    # Sorted (term, rank, symbol) keys for bisect prefix search; rank 0 = symbol terms, 1 = company-name terms
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('SELECT symbol, name FROM tickers')
+    rows = c.fetchall()
+    conn.close()
+    keys = []
+    symbols_by_term = {}
+    for symbol, name in rows:
+        symbol_terms = {symbol.lower(), symbol.lower().lstrip('^').split('.')[0]}
+        name_terms = set()
+        if name:
+            name_lower = name.lower()
+            name_terms = {name_lower, *re.findall(r'[a-z0-9&]+', name_lower)} - symbol_terms
+        for rank, terms in ((0, symbol_terms), (1, name_terms)):
+            for term in terms:
+                keys.append((term, rank, symbol))
+                symbols_by_term.setdefault(term, []).append(symbol)
+    keys.sort()
+    return {'keys': keys, 'names': {symbol: name or '' for symbol, name in rows},
+            'terms': sorted(symbols_by_term), 'symbols_by_term': symbols_by_term}
+
+def search_tickers(query, limit=8, max_candidates=500):
+    q = query.strip().lower()
+    if not q:
+        return []
+    index = build_ticker_index(get_ticker_universe_version())
+    keys = index['keys']
+    scores = {}
+    i = bisect.bisect_left(keys, (q,))
+    # Exact matches rank before prefixes, symbol terms before company-name terms, shorter terms first
+    while i < len(keys) and keys[i][0].startswith(q) and len(scores) < max_candidates:
+        term, rank, symbol = keys[i]
+        score = (term != q, rank, len(term))
+        if symbol not in scores or score < scores[symbol]:
+            scores[symbol] = score
+        i += 1
+    if len(scores) < limit:
+        # Typo tolerance only when prefix search comes up short
+        for term in difflib.get_close_matches(q, index['terms'], n=limit, cutoff=0.75):
+            for symbol in index['symbols_by_term'][term]:
+                scores.setdefault(symbol, (True, 2, len(term)))
+    ranked = sorted(scores, key=lambda symbol: (scores[symbol], symbol))[:limit]
+    return [(symbol, index['names'].get(symbol, '')) for symbol in ranked]
+
+# --- HISTORICAL PORTFOLIO VALUE ---
+
+def download_close_matrix(symbols, start, end):
+    # One batched download for all symbols -> date x symbol matrix of closing prices
+    symbols = sorted(set(symbols))
+    if not symbols:
+        return pd.DataFrame()
+    try:
+        data = yf.download(symbols, start=start.isoformat(), end=end.isoformat(), progress=False)
+    except Exception:
+        return pd.DataFrame()
+    if data is None or data.empty or 'Close' not in data:
+        return pd.DataFrame()
+    close = data['Close']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(symbols[0])
+    close.index = pd.to_datetime(close.index)
+    return close.reindex(columns=symbols).astype(float)
+
+@st.cache_data(ttl=PRICE_HISTORY_TTL, show_spinner=False)
+def get_price_matrix(symbols, days):
+    end = datetime.utcnow().date()
+    start = end - timedelta(days=days)
+    return download_close_matrix(list(symbols), start, end)
+
+def holdings_shares(holdings_df):
+    return holdings_df.groupby('symbol')['shares'].sum()
+
+def get_holdings_price_matrix(holdings_df, days, base_currency=None):
+    # The benchmark rides along in the same batched download so charts and analytics share one fetch
+    symbols = set(holdings_df['symbol']) | {BENCHMARK_SYMBOL}
+    prices = get_price_matrix(tuple(sorted(symbols)), days)
+    return convert_price_matrix(prices, base_currency or get_base_currency())
+
+def build_portfolio_history(holdings_df, days=90, base_currency=None):
+    if holdings_df.empty:
+        return pd.DataFrame()
+    shares = holdings_shares(holdings_df)
+    prices = get_holdings_price_matrix(holdings_df, days, base_currency)
+    if prices.empty:
+        return pd.DataFrame()
+    prices = prices[shares.index].ffill().fillna(0)
+    if not prices.to_numpy().any():
+        return pd.DataFrame()
+    value = prices.to_numpy() @ shares.to_numpy(dtype=float)
+    return pd.DataFrame({'portfolio_value': value}, index=prices.index)
+
+# --- PORTFOLIO RISK ANALYTICS ---
+
+def compute_risk_metrics(prices, shares, benchmark_symbol=BENCHMARK_SYMBOL, window=21, risk_free_rate=RISK_FREE_RATE):
+    # Stack every symbol, the portfolio and the benchmark into one matrix and compute all metrics column-wise
+    prices = prices.sort_index().ffill()
+    symbols = [sym for sym in shares.index if sym in prices.columns]
+    if not symbols or benchmark_symbol not in prices.columns or len(prices) < 3:
+        return None
+    holding_prices = prices[symbols].to_numpy(dtype=float)
+    # The portfolio starts on the first day every (ever-)priced holding has a price: counting a symbol as 0 until its
+    # market first trades in the window would book its whole value as a one-day return. NaN rows propagate through @.
+    priced = ~np.isnan(holding_prices).all(axis=0)
+    portfolio = holding_prices[:, priced] @ shares[symbols].to_numpy(dtype=float)[priced]
+    portfolio[portfolio <= 0] = np.nan
+    labels = symbols + ['Portfolio', benchmark_symbol]
+    matrix = np.column_stack([holding_prices, portfolio, prices[benchmark_symbol].to_numpy(dtype=float)])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = matrix[1:] / matrix[:-1] - 1.0
+    returns[~np.isfinite(returns)] = np.nan
+    dates = prices.index[1:]
+    valid = ~np.isnan(returns)
+    filled = np.where(valid, returns, 0.0)
+    n_obs = valid.sum(axis=0)
+
+    wealth = np.cumprod(1.0 + filled, axis=0)
+    drawdown = wealth / np.maximum.accumulate(wealth, axis=0) - 1.0
+
+    rf_daily = risk_free_rate / TRADING_DAYS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = filled.sum(axis=0) / n_obs
+        demeaned = np.where(valid, returns - mean, 0.0)
+        std = np.sqrt((demeaned ** 2).sum(axis=0) / (n_obs - 1))
+        downside = np.where(valid, np.minimum(returns - rf_daily, 0.0), 0.0)
+        downside_dev = np.sqrt((downside ** 2).sum(axis=0) / n_obs)
+
+        # Covariance of every column against the benchmark over dates where both are observed
+        pair_valid = valid & valid[:, -1:]
+        pair_n = pair_valid.sum(axis=0)
+        bench = np.where(pair_valid, returns[:, -1:], 0.0)
+        cols = np.where(pair_valid, returns, 0.0)
+        bench_dm = np.where(pair_valid, bench - bench.sum(axis=0) / pair_n, 0.0)
+        cols_dm = np.where(pair_valid, cols - cols.sum(axis=0) / pair_n, 0.0)
+        cov = (cols_dm * bench_dm).sum(axis=0) / (pair_n - 1)
+        var_bench = (bench_dm ** 2).sum(axis=0) / (pair_n - 1)
+        var_cols = (cols_dm ** 2).sum(axis=0) / (pair_n - 1)
+        beta = cov / var_bench
+        correlation = cov / np.sqrt(var_cols * var_bench)
+
+        sharpe = (mean - rf_daily) / std * np.sqrt(TRADING_DAYS)
+        sortino = (mean - rf_daily) / downside_dev * np.sqrt(TRADING_DAYS)
+
+    rolling_vol = pd.DataFrame(index=dates, columns=labels, dtype=float)
+    if len(returns) >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(returns, window, axis=0)
+        rolling_vol.iloc[window - 1:] = np.nanstd(windows, axis=-1, ddof=1) * np.sqrt(TRADING_DAYS)
+
+    summary = pd.DataFrame({
+        'Total Return (%)': (wealth[-1] - 1.0) * 100,
+        'Annual Volatility (%)': std * np.sqrt(TRADING_DAYS) * 100,
+        'Max Drawdown (%)': drawdown.min(axis=0) * 100,
+        'Beta': beta,
+        'Correlation': correlation,
+        'Sharpe': sharpe,
+        'Sortino': sortino,
+    }, index=labels)
+    return {
+        'summary': summary,
+        'daily_returns': pd.DataFrame(returns, index=dates, columns=labels),
+        'cumulative_returns': pd.DataFrame(wealth - 1.0, index=dates, columns=labels),
+        'drawdown': pd.DataFrame(drawdown, index=dates, columns=labels),
+        'rolling_volatility': rolling_vol,
+    }
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_portfolio_risk(holdings_key, days, window, base_currency=DEFAULT_BASE_CURRENCY):
+    # holdings_key is a sorted tuple of (symbol, shares) so the cache is per holdings set and window
+    shares = pd.Series(dict(holdings_key), dtype=float)
+    symbols = tuple(sorted(set(shares.index) | {BENCHMARK_SYMBOL}))
+    prices = convert_price_matrix(get_price_matrix(symbols, days), base_currency)
+    if prices.empty:
+        return None
+    return compute_risk_metrics(prices, shares, window=window)
+
+def holdings_cache_key(holdings_df):
+    return tuple(sorted(holdings_shares(holdings_df).items()))
+
+# --- PORTFOLIO REBALANCING ---
+
+def ledoit_wolf_covariance(returns):
+    # Ledoit-Wolf shrinkage of the sample covariance towards a scaled identity. returns is a T x N array
+    # without gaps; the shrinkage intensity is estimated from the data. Returns (covariance, intensity).
+    n_obs, n_assets = returns.shape
+    centered = returns - returns.mean(axis=0)
+    sample = centered.T @ centered / n_obs
+    target_scale = np.trace(sample) / n_assets
+    target = target_scale * np.eye(n_assets)
+    dispersion = ((sample - target) ** 2).sum() / n_assets
+    if dispersion <= 0:
+        return sample, 0.0
+    # Average squared distance of the single-observation outer products from the sample covariance
+    norms = (centered ** 2).sum(axis=1)
+    quad = np.einsum('ti,ij,tj->t', centered, sample, centered)
+    noise = (norms ** 2 - 2 * quad + (sample ** 2).sum()).sum() / (n_obs ** 2 * n_assets)
+    intensity = min(noise, dispersion) / dispersion
+    return intensity * target + (1 - intensity) * sample, intensity
+
+class SymbolCloseCache:
+    # Daily closes per (symbol, lookback) shared by every session, so estimates over different symbol sets reuse
+    # each symbol's history. Symbols missing or older than PRICE_HISTORY_TTL are fetched in one batched download;
+    # symbols the download returned nothing for are retried next time rather than cached empty.
+    def __init__(self, ttl=PRICE_HISTORY_TTL):
+        self.ttl = ttl
+        self.series = {}  # (symbol, days) -> (fetched_at, Series of closes)
+        self.lock = threading.Lock()
+
+    def closes(self, symbols, days):
+        now = time.time()
+        with self.lock:
+            for key in [key for key, (fetched_at, _) in self.series.items() if now - fetched_at >= self.ttl]:
+                del self.series[key]
+            found = {symbol: self.series[(symbol, days)][1] for symbol in symbols if (symbol, days) in self.series}
+        missing = [symbol for symbol in symbols if symbol not in found]
+        if missing:
+            end = datetime.utcnow().date()
+            fetched = download_close_matrix(missing, end - timedelta(days=days), end)
+            with self.lock:
+                for symbol in missing:
+                    column = fetched[symbol].dropna() if symbol in fetched.columns else None
+                    if column is not None and not column.empty:
+                        self.series[(symbol, days)] = (now, column)
+                        found[symbol] = column
+        if not found:
+            return pd.DataFrame()
+        return pd.DataFrame(found).sort_index().reindex(columns=[symbol for symbol in symbols if symbol in found])
+
+@st.cache_resource(show_spinner=False)
+def get_symbol_close_cache():
+    return SymbolCloseCache()
+
+@st.cache_data(ttl=PRICE_HISTORY_TTL, show_spinner=False)
+def get_covariance_estimate(symbols, days=REBALANCE_LOOKBACK_DAYS, base_currency=DEFAULT_BASE_CURRENCY):
+    # Assembled from per-symbol closes (SymbolCloseCache), so users whose symbol sets merely overlap still share
+    # each symbol's download; the assembled estimate itself is memoized per symbol set.
+    # Annualized; symbols without enough history are dropped and listed under 'skipped'.
+    prices = convert_price_matrix(get_symbol_close_cache().closes(sorted(symbols), days), base_currency)
+    if prices.empty:
+        return None
+    prices = prices.sort_index()
+    coverage = prices.notna().mean()
+    usable = [sym for sym in sorted(symbols) if sym in prices.columns and coverage[sym] >= REBALANCE_MIN_COVERAGE]
+    if len(usable) < 2:
+        return None
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.log(prices[usable].ffill().to_numpy(dtype=float))
+        returns = np.diff(returns, axis=0)
+    returns = returns[np.isfinite(returns).all(axis=1)]
+    if len(returns) < 20:
+        return None
+    cov, intensity = ledoit_wolf_covariance(returns)
+    mean = returns.mean(axis=0)
+    mean = (1 - REBALANCE_RETURN_SHRINKAGE) * mean + REBALANCE_RETURN_SHRINKAGE * mean.mean()
+    return {
+        'symbols': usable,
+        'skipped': [sym for sym in sorted(symbols) if sym not in usable],
+        'expected_returns': mean * TRADING_DAYS,
+        'covariance': cov * TRADING_DAYS,
+        'shrinkage': intensity,
+        'observations': len(returns),
+        'last_prices': prices[usable].ffill().iloc[-1].to_numpy(dtype=float),
+    }
+
+def project_capped_simplex(v, cap):
+    # Euclidean projection onto {w : sum(w) = 1, 0 <= w <= cap}, by bisection on the shift
+    cap = max(cap, 1.0 / len(v))
+    low, high = v.min() - cap, v.max()
+    for _ in range(100):
+        shift = (low + high) / 2
+        if np.clip(v - shift, 0.0, cap).sum() > 1.0:
+            low = shift
+        else:
+            high = shift
+    return np.clip(v - (low + high) / 2, 0.0, cap)
+
+def optimize_weights(expected_returns, covariance, risk_aversion, max_weight, start=None, max_iter=2000, tol=1e-10):
+    # Projected gradient ascent on mu'w - (risk_aversion / 2) w'Σw over the capped simplex. The objective is
+    # concave, so with step 1/L (L the gradient's Lipschitz constant) this converges to the global optimum.
+    n_assets = len(expected_returns)
+    weights = project_capped_simplex(start if start is not None else np.full(n_assets, 1.0 / n_assets), max_weight)
+    step = 1.0 / max(risk_aversion * np.linalg.eigvalsh(covariance)[-1], 1e-12)
+    for _ in range(max_iter):
+        gradient = expected_returns - risk_aversion * covariance @ weights
+        updated = project_capped_simplex(weights + step * gradient, max_weight)
+        if np.abs(updated - weights).max() < tol:
+            return updated
+        weights = updated
+    return weights
+
+def rebalance_portfolio(shares, candidates=REBALANCE_CANDIDATES, base_currency=DEFAULT_BASE_CURRENCY):
+    # shares: Series of current shares by symbol. Solves for every risk profile; returns None without enough history.
+    estimate = get_covariance_estimate(tuple(sorted(set(shares.index) | set(candidates))), REBALANCE_LOOKBACK_DAYS, base_currency)
+    if estimate is None:
+        return None
+    symbols = estimate['symbols']
+    prices = estimate['last_prices']
+    current_shares = shares.reindex(symbols).fillna(0.0).to_numpy(dtype=float)
+    total_value = float(current_shares @ prices)
+    if total_value <= 0:
+        return None
+    current_weights = current_shares * prices / total_value
+    mu, cov = estimate['expected_returns'], estimate['covariance']
+
+    profiles = {}
+    for profile, risk_aversion in RISK_AVERSION.items():
+        weights = optimize_weights(mu, cov, risk_aversion, REBALANCE_MAX_WEIGHT[profile], start=current_weights)
+        profiles[profile] = {
+            'weights': weights,
+            'expected_return': float(weights @ mu),
+            'volatility': float(np.sqrt(weights @ cov @ weights)),
+        }
+    return {
+        'symbols': symbols,
+        'skipped': estimate['skipped'],
+        'prices': prices,
+        'current_shares': current_shares,
+        'current_weights': current_weights,
+        'current_return': float(current_weights @ mu),
+        'current_volatility': float(np.sqrt(current_weights @ cov @ current_weights)),
+        'total_value': total_value,
+        'shrinkage': estimate['shrinkage'],
+        'profiles': profiles,
+    }
+
+def rebalance_trades(plan, profile):
+    # Whole-share trades that move the portfolio to the profile's target weights at the last close
+    target = plan['profiles'][profile]['weights']
+    delta_shares = np.trunc(target * plan['total_value'] / plan['prices'] - plan['current_shares'])
+    trades = pd.DataFrame({
+        'symbol': plan['symbols'],
+        'current_weight': plan['current_weights'] * 100,
+        'target_weight': target * 100,
+        'price': plan['prices'],
+        'shares': delta_shares,
+        'value': delta_shares * plan['prices'],
+    })
+    trades['action'] = np.where(trades['shares'] > 0, 'Buy', 'Sell')
+    trades = trades[trades['value'].abs() >= REBALANCE_MIN_TRADE_FRACTION * plan['total_value']]
+    return trades.sort_values('value', key=lambda v: -v.abs()).reset_index(drop=True)
+
+# --- SAVINGS ALLOCATION ---
+
+def allocate_savings(pool, needs, strategy, ranks, months_left):
+    # Shares a savings pool between goals without giving any goal more than it still needs. pool may be an
+    # array (e.g. one value per simulated path); the result then has a leading goal axis in front of its shape.
+    #   waterfall: goals are filled one after another in rank order
+    #   proportional: every goal is filled to the same fraction of what it still needs
+    #   deadline: water-filling with weights need / months left, so large gaps close to their deadline come first
+    pool = np.clip(np.asarray(pool, dtype=float), 0.0, None)
+    needs = np.clip(np.asarray(needs, dtype=float), 0.0, None)
+    expand = (slice(None),) + (None,) * pool.ndim
+    if strategy == 'waterfall':
+        ordered = np.argsort(ranks, kind='stable')
+        ahead = np.empty_like(needs)
+        ahead[ordered] = np.cumsum(needs[ordered]) - needs[ordered]
+        return np.clip(pool[None] - ahead[expand], 0.0, needs[expand])
+    if strategy == 'proportional':
+        total = needs.sum()
+        return needs[expand] * np.asarray(np.minimum(pool / total, 1.0) if total > 0 else np.zeros_like(pool))[None]
+    months = np.nan_to_num(np.asarray(months_left, dtype=float), nan=OPEN_GOAL_MONTHS)
+    weights = (needs / np.maximum(months, 1.0))[expand]
+    allocated = np.zeros((len(needs),) + pool.shape)
+    left = pool.copy()
+    # Every round either fills at least one more goal or hands out the whole pool, so one round per goal is enough
+    for _ in range(len(needs)):
+        open_weights = np.where(needs[expand] - allocated > 1e-9, weights, 0.0)
+        total = open_weights.sum(axis=0)
+        share = np.divide(left, total, out=np.zeros_like(left), where=total > 0)
+        given = np.minimum(open_weights * share[None], needs[expand] - allocated)
+        allocated += given
+        left = left - given.sum(axis=0)
+    return allocated
 
-def get_holdings():
-    if not st.session_state.logged_in:
-        return pd.DataFrame()
+def funding_thresholds(needs, strategy, ranks, months_left, iterations=40):
+    # Smallest pool that fully funds each goal. Every strategy gives each goal more as the pool grows,
+    # so one vectorized bisection finds them all.
+    needs = np.clip(np.asarray(needs, dtype=float), 0.0, None)
+    low = np.zeros(len(needs))
+    high = np.full(len(needs), needs.sum())
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        funded = np.diagonal(allocate_savings(mid, needs, strategy, ranks, months_left)) >= needs - 0.005
+        high = np.where(funded, mid, high)
+        low = np.where(funded, low, mid)
+    return high
+
+def goal_months_left(goals):
+    deadlines = pd.to_datetime(goals['deadline'], errors='coerce')
+    return ((deadlines - pd.Timestamp(datetime.today()).normalize()).dt.days / DAYS_PER_MONTH).clip(lower=0).to_numpy(dtype=float)
+
+def goal_ranks(goals):
+    # Waterfall order: priority (1 first), then the nearest deadline, then the oldest goal
+    order = pd.DataFrame({
+        'priority': goals['priority'].fillna(DEFAULT_GOAL_PRIORITY),
+        'deadline': pd.to_datetime(goals['deadline'], errors='coerce'),
+        'created_at': goals['created_at'],
+        'id': goals['id'],
+    }).sort_values(['priority', 'deadline', 'created_at', 'id'], na_position='last')
+    return pd.Series(np.arange(len(order)), index=order.index).reindex(goals.index).to_numpy()
+
+def goal_contribution_totals(user_id):
     conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query('SELECT * FROM holdings WHERE user_id = ?', conn, params=(st.session_state.user_id,))
+    rows = conn.execute('SELECT goal_id, SUM(amount) FROM goal_contributions WHERE user_id = ? GROUP BY goal_id', (user_id,)).fetchall()
     conn.close()
-    return df
+    return dict(rows)
 
-def remove_holding(row_id):
-    if not st.session_state.logged_in:
-        return
+def compute_goal_allocations(goals, strategy, user_id):
+    # Explicit contributions are earmarked out of net savings first; what is left is shared by the strategy
+    totals = goal_contribution_totals(user_id)
+    contributed = goals['id'].map(totals).fillna(0.0).to_numpy(dtype=float)
+    income, expenses = get_income_expense_totals(user_id=user_id)
+    pool = income - expenses - contributed.sum()
+    needs = goals['target_amount'].to_numpy(dtype=float) - contributed
+    return contributed + allocate_savings(pool, needs, strategy, goal_ranks(goals), goal_months_left(goals))
+
+def refresh_goal_allocations(user_id=None):
+    # Recomputes every goal's current_amount only when the user's data version has moved since the last run.
+    # The result is stored in one writer job that records the version it was computed at without bumping it:
+    # current_amount is derived from data the version already covers. Returns the goals with fresh amounts.
+    user_id = session_user_id(user_id)
+    goals = get_savings_goals(user_id)
+    if goals.empty:
+        return goals
+    version = get_data_version(user_id)
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('DELETE FROM holdings WHERE id = ? AND user_id = ?', (row_id, st.session_state.user_id))
-    conn.commit()
+    row = conn.execute('SELECT strategy, allocated_version FROM savings_allocation WHERE user_id = ?', (user_id,)).fetchone()
     conn.close()
+    if row is not None and row[1] == version:
+        return goals
+    strategy = row[0] if row is not None and row[0] in SAVINGS_STRATEGIES else DEFAULT_SAVINGS_STRATEGY
+    amounts = compute_goal_allocations(goals, strategy, user_id).round(2)
+    changed = [(float(amount), int(goal_id), user_id)
+               for goal_id, amount, stored in zip(goals['id'], amounts, goals['current_amount'].fillna(0.0))
+               if abs(amount - stored) >= 0.005]
+
+    def write(c):
+        c.executemany('UPDATE savings_goals SET current_amount = ? WHERE id = ? AND user_id = ?', changed)
+        # A write that lands between reading the version and this job leaves the stored version behind, so the next view recomputes
+        c.execute('''
+            INSERT INTO savings_allocation (user_id, strategy, allocated_version) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET allocated_version = excluded.allocated_version
+        ''', (user_id, strategy, version))
+
+    run_write(write)
+    goals['current_amount'] = amounts
+    return goals
+
+# --- SAVINGS GOAL PROJECTIONS ---
+
+def monthly_net_savings():
+    # Income minus expenses per calendar month, with empty months as 0. The running month is left out
+    # once there are at least three complete months, since a partial month understates savings.
+    by_month = query_transactions(group_by=('month', 'type'))
+    if by_month.empty:
+        return pd.Series(dtype=float)
+    table = by_month.pivot_table(index='month', columns='ttype', values='amount', aggfunc='sum', observed=False).fillna(0.0)
+    net = table.get('income', 0.0) - table.get('expense', 0.0)
+    current = pd.Period(datetime.today(), freq='M')
+    net = net.reindex(pd.period_range(net.index.min(), max(net.index.max(), current), freq='M'), fill_value=0.0)
+    complete = net[net.index < current]
+    return complete if len(complete) >= 3 else net
+
+def simulate_goal_attainment(monthly_net, start_amounts, targets, months_left, strategy, ranks, paths=MONTE_CARLO_PATHS, horizon=MONTE_CARLO_HORIZON_MONTHS, seed=MONTE_CARLO_SEED):
+    # Monthly savings are drawn from a normal fitted to the user's history and shared between goals by the
+    # user's allocation strategy (the same allocate_savings the savings page uses), on top of what each goal
+    # already holds. months_left is NaN for goals without a deadline. Returns per-goal arrays: probability of
+    # reaching the target by the deadline, the 10th/50th/90th percentile amount at the deadline, and the median
+    # months to target.
+    start_amounts = np.asarray(start_amounts, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    months_left = np.asarray(months_left, dtype=float)
+    values = np.asarray(monthly_net, dtype=float)
+    mu = values.mean() if len(values) else 0.0
+    sigma = values.std(ddof=1) if len(values) > 1 else abs(mu) * 0.25
+    deadline_months = np.nan_to_num(months_left, nan=0.0).astype(int)
+    horizon = max(horizon, int(deadline_months.max(initial=0)))
+
+    rng = np.random.default_rng(seed)
+    # saved[p, m] = total new savings on path p after m + 1 months, to be shared between the goals
+    saved = rng.normal(mu, sigma, size=(paths, horizon)).cumsum(axis=1)
+    needed = np.clip(targets - start_amounts, 0.0, None)
+
+    # Goal g's share of the pool its own deadline sees: allocate every goal's pool, keep the diagonal
+    pools = saved[:, np.maximum(deadline_months - 1, 0)].T
+    received = np.diagonal(allocate_savings(pools, needed, strategy, ranks, months_left)).T
+    at_deadline = np.where(deadline_months[:, None] > 0, start_amounts[:, None] + received, start_amounts[:, None])
+    probability = (at_deadline >= targets[:, None] - 0.005).mean(axis=1)
+    p10, p50, p90 = np.percentile(at_deadline, [10, 50, 90], axis=1)
+
+    # A goal is first reached once the running maximum of a path crosses the pool that fully funds it,
+    # so the hitting month is just the count of months spent below that line
+    thresholds = funding_thresholds(needed, strategy, ranks, months_left)
+    months_below = (np.maximum.accumulate(saved, axis=1)[None, :, :] < thresholds[:, None, None]).sum(axis=2)
+    first_month = np.where(months_below < horizon, months_below + 1, np.inf)
+    first_month[needed <= 0] = 0
+    median_months = np.median(first_month, axis=1)
+
+    has_deadline = ~np.isnan(months_left)
+    return {
+        'probability': np.where(has_deadline, probability, np.nan),
+        'p10': np.where(has_deadline, p10, np.nan),
+        'p50': np.where(has_deadline, p50, np.nan),
+        'p90': np.where(has_deadline, p90, np.nan),
+        'median_months': median_months,
+        'monthly_mean': mu,
+        'monthly_std': sigma,
+        'months_of_history': len(values),
+    }
+
+@st.cache_data(ttl=86400, show_spinner=False, max_entries=100)
+def get_goal_projections(user_id, data_version):
+    # Keyed on the data version, so projections are recomputed only after the ledger, goals or strategy change
+    # (and once a day, as deadlines draw closer). Expects refresh_goal_allocations to have run for this version.
+    goals = get_savings_goals(user_id)
+    monthly_net = monthly_net_savings()
+    if goals.empty or monthly_net.empty:
+        return None
+    result = simulate_goal_attainment(monthly_net.to_numpy(), goals['current_amount'].fillna(0.0).to_numpy(), goals['target_amount'].to_numpy(),
+                                      goal_months_left(goals), get_savings_strategy(user_id), goal_ranks(goals))
+    projections = pd.DataFrame({
+        'id': goals['id'],
+        'probability': result['probability'],
+        'p10': result['p10'],
+        'p50': result['p50'],
+        'p90': result['p90'],
+        'median_months': result['median_months'],
+    })
+    fit = {key: result[key] for key in ('monthly_mean', 'monthly_std', 'months_of_history')}
+    return projections, fit
+
+# --- BACKGROUND REPORTS ---
+
+class ReportRunner:
+    # Builds statements in worker processes (spawned, so children don't inherit the server's threads).
+    # Artifacts are named by (user, period, data version): a file that exists is always current and is served as-is.
+    def __init__(self, writer, db_path=DB_PATH, reports_dir=REPORTS_DIR, max_workers=REPORT_WORKERS):
+        self.writer = writer
+        self.db_path = db_path
+        self.reports_dir = reports_dir
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+        self.pending = {}
+        self.lock = threading.Lock()
+        os.makedirs(reports_dir, exist_ok=True)
+        # Jobs that were running when the server last stopped will never finish
+        self.writer.submit(lambda c: c.execute(
+            "UPDATE report_jobs SET status = 'failed', error = 'Interrupted by a server restart' WHERE status = 'pending'"))
+
+    def artifact_path(self, user_id, period, fmt, version):
+        return os.path.join(self.reports_dir, f'{user_id}_{period}_v{version}.{fmt}')
+
+    def is_pending(self, user_id, period, fmt, version):
+        with self.lock:
+            return (user_id, period, fmt, version) in self.pending
+
+    def submit(self, user_id, period, title, start_tday, end_tday, fmt, version, portfolio_records):
+        key = (user_id, period, fmt, version)
+        path = self.artifact_path(user_id, period, fmt, version)
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            now = datetime.utcnow().isoformat()
+            job_id = self.writer.submit(lambda c: c.execute('''
+                INSERT INTO report_jobs (user_id, period, fmt, data_version, status, path, created_at)
+                VALUES (?, ?, ?, ?, 'pending', ?, ?)
+            ''', (user_id, period, fmt, version, path, now)).lastrowid).result()
+            future = self.executor.submit(reports.build_report, self.db_path, user_id, title, start_tday, end_tday, fmt, path, portfolio_records)
+            self.pending[key] = future
+        future.add_done_callback(lambda f: self.finished(key, job_id, f))
+        return future
+
+    def finished(self, key, job_id, future):
+        error = future.exception()
+        status = 'failed' if error else 'ready'
+        self.writer.submit(lambda c: c.execute('UPDATE report_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                                               (status, str(error) if error else None, datetime.utcnow().isoformat(), job_id)))
+        if not error:
+            self.prune(*key)
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def prune(self, user_id, period, fmt, version):
+        # Older versions of the same report can never be served again
+        current = self.artifact_path(user_id, period, fmt, version)
+        for path in glob.glob(os.path.join(self.reports_dir, f'{user_id}_{period}_v*.{fmt}')):
+            if path != current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
 
-def add_transaction(tdate, ttype, category, amount, note=''):
+@st.cache_resource(show_spinner=False)
+def get_report_runner():
+    return ReportRunner(get_db_writer(), DB_PATH)
+
+def report_periods(kind, count=12):
+    # (label, title, start, end) for the last `count` months or years, most recent first
+    today = datetime.today()
+    periods = []
+    for i in range(count):
+        if kind == 'month':
+            year, month = divmod(today.year * 12 + today.month - 1 - i, 12)
+            month += 1
+            start = datetime(year, month, 1)
+            end = datetime(year, month, calendar.monthrange(year, month)[1])
+            periods.append((start.strftime('%Y-%m'), f"Monthly statement: {start.strftime('%B %Y')}", start, end))
+        else:
+            year = today.year - i
+            periods.append((str(year), f'Year-end summary: {year}', datetime(year, 1, 1), datetime(year, 12, 31)))
+    return periods
+
+def portfolio_snapshot_records(base_currency=None):
+    # Priced here rather than in the worker so the report uses the same quotes and FX rates the app shows
+    holdings = get_holdings()
+    if holdings.empty:
+        return []
+    base_currency = base_currency or get_base_currency()
+    holdings = value_holdings(holdings, base_currency)
+    snapshot = holdings[['symbol', 'shares', 'currency', 'price', 'market_value', 'unrealized_pnl']].rename(columns={
+        'symbol': 'Symbol', 'shares': 'Shares', 'currency': 'Currency', 'price': 'Price',
+        'market_value': f'Market Value ({base_currency})', 'unrealized_pnl': f'Unrealized P&L ({base_currency})',
+    }).round(2)
+    snapshot['As Of'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')
+    return snapshot.to_dict('records')
+
+def request_report(period, fmt):
+    # period is one of report_periods(); returns ('ready', path) for a cached artifact, otherwise ('pending', None)
     if not st.session_state.logged_in:
-        return
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT INTO transactions (user_id, tdate, ttype, category, amount, note) VALUES (?, ?, ?, ?, ?, ?)',
-              (st.session_state.user_id, tdate, ttype, category, amount, note))
-    conn.commit()
-    conn.close()
+        return 'failed', None
+    label, title, start, end = period
+    user_id = st.session_state.user_id
+    version = get_data_version(user_id)
+    runner = get_report_runner()
+    path = runner.artifact_path(user_id, label, fmt, version)
+    if os.path.exists(path):
+        return 'ready', path
+    if not runner.is_pending(user_id, label, fmt, version):
+        runner.submit(user_id, label, title, to_tday(start), to_tday(end), fmt, version, portfolio_snapshot_records())
+    return 'pending', None
 
-def get_transactions():
+def get_report_jobs(limit=REPORT_JOBS_SHOWN):
     if not st.session_state.logged_in:
         return pd.DataFrame()
     conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query('SELECT * FROM transactions WHERE user_id = ? ORDER BY tdate DESC', conn, params=(st.session_state.user_id,))
+    df = pd.read_sql_query('SELECT id, period, fmt, data_version, status, path, error, created_at, finished_at FROM report_jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+                           conn, params=(st.session_state.user_id, limit))
     conn.close()
     return df
 
-def remove_transaction(row_id):
-    if not st.session_state.logged_in:
-        return
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('DELETE FROM transactions WHERE id = ? AND user_id = ?', (row_id, st.session_state.user_id))
-    conn.commit()
-    conn.close()
+# --- LEDGER ARCHIVE & MAINTENANCE ---
 
-def save_user_profile(user_type, savings_goal, risk_tolerance):
-    if not st.session_state.logged_in:
-        return
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('REPLACE INTO user_profile (user_id, user_type, savings_goal, risk_tolerance) VALUES (?, ?, ?, ?)',
-              (st.session_state.user_id, user_type, savings_goal, risk_tolerance))
-    conn.commit()
-    conn.close()
+def archive_user_transactions(c, user_id, before_tday):
+    # Writer job: folds the user's rows dated before `before_tday` into the monthly rollups and moves them to
+    # transactions_archive. Totals don't change, so the data version is left alone. Returns the rows moved.
+    where = 'user_id = ? AND tday < ?'
+    c.execute(f'''
+        INSERT INTO transaction_rollups (user_id, month, ttype, category_id, amount, count)
+        SELECT user_id, {SQL_MONTH_INDEX} AS month, COALESCE(ttype, -1) AS rttype, COALESCE(category_id, -1) AS rcategory, SUM(amount), COUNT(*)
+        FROM transactions WHERE {where}
+        GROUP BY month, rttype, rcategory
+        ON CONFLICT(user_id, month, ttype, category_id) DO UPDATE SET amount = amount + excluded.amount, count = count + excluded.count
+    ''', (user_id, before_tday))
+    moved = c.execute(f'''
+        INSERT OR REPLACE INTO transactions_archive (id, user_id, tdate, tday, ttype, category_id, amount, note)
+        SELECT id, user_id, tdate, tday, ttype, category_id, amount, note FROM transactions WHERE {where}
+    ''', (user_id, before_tday)).rowcount
+    c.execute(f'DELETE FROM transactions WHERE {where}', (user_id, before_tday))
+    c.execute('''
+        INSERT INTO archive_watermarks (user_id, archived_before) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET archived_before = MAX(archived_before, excluded.archived_before)
+    ''', (user_id, before_tday))
+    return moved
 
-def get_user_profile():
-    if not st.session_state.logged_in:
-        return {'user_type': 'general', 'savings_goal': 0.0, 'risk_tolerance': 'moderate'}
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query('SELECT * FROM user_profile WHERE user_id = ?', conn, params=(st.session_state.user_id,))
-    conn.close()
-    if df.empty:
-        return {'user_type': 'general', 'savings_goal': 0.0, 'risk_tolerance': 'moderate'}
-    return df.iloc[0].to_dict()
+def remove_from_rollup(c, user_id, category_id, tday, ttype_code, amount):
+    # Keeps the rollups in step when an archived row is deleted
+    key = (user_id, tday_month(tday), ttype_code if ttype_code is not None else -1, category_id if category_id is not None else -1)
+    c.execute('UPDATE transaction_rollups SET amount = amount - ?, count = count - 1 WHERE user_id = ? AND month = ? AND ttype = ? AND category_id = ?',
+              (amount or 0.0, *key))
+    c.execute('DELETE FROM transaction_rollups WHERE user_id = ? AND month = ? AND ttype = ? AND category_id = ? AND count <= 0', key)
 
-def add_savings_goal(goal_name, target_amount, deadline=None, note=''):
-    if not st.session_state.logged_in:
-        return
+def archive_closed_years(writer=None):
+    # Archives every user's rows from before 1 January of the current year, one writer job per user
+    writer = writer or get_db_writer()
+    boundary = to_tday(datetime(datetime.today().year, 1, 1))
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO savings_goals (user_id, goal_name, target_amount, current_amount, deadline, note, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (st.session_state.user_id, goal_name, target_amount, 0.0, deadline, note, datetime.utcnow().isoformat()))
-    conn.commit()
+    user_ids = [row[0] for row in conn.execute('SELECT DISTINCT user_id FROM transactions WHERE tday < ?', (boundary,))]
     conn.close()
+    futures = [writer.submit(lambda c, user_id=user_id: archive_user_transactions(c, user_id, boundary)) for user_id in user_ids]
+    return sum(future.result() for future in futures)
 
-def update_savings_goal(goal_id, goal_name=None, target_amount=None, current_amount=None, deadline=None, note=None):
+def archive_own_closed_years():
+    # Settings button: only the signed-in user's ledger; ANALYZE/VACUUM stay with the maintenance scheduler
     if not st.session_state.logged_in:
-        return
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    updates = []
-    params = []
-    if goal_name is not None:
-        updates.append('goal_name = ?')
-        params.append(goal_name)
-    if target_amount is not None:
-        updates.append('target_amount = ?')
-        params.append(target_amount)
-    if current_amount is not None:
-        updates.append('current_amount = ?')
-        params.append(current_amount)
-    if deadline is not None:
-        updates.append('deadline = ?')
-        params.append(deadline)
-    if note is not None:
-        updates.append('note = ?')
-        params.append(note)
-    if updates:
-        params.append(goal_id)
-        params.append(st.session_state.user_id)
-        update_str = ', '.join(updates)
-        c.execute(f'UPDATE savings_goals SET {update_str} WHERE id = ? AND user_id = ?', params)
-        conn.commit()
-    conn.close()
+        return 0
+    user_id = st.session_state.user_id
+    boundary = to_tday(datetime(datetime.today().year, 1, 1))
+    return run_write(lambda c: archive_user_transactions(c, user_id, boundary))
 
-def get_savings_goals():
-    if not st.session_state.logged_in:
-        return pd.DataFrame()
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query('SELECT * FROM savings_goals WHERE user_id = ? ORDER BY created_at DESC', conn, params=(st.session_state.user_id,))
-    conn.close()
-    return df
+def run_maintenance(writer=None):
+    writer = writer or get_db_writer()
+    moved = archive_closed_years(writer)
+    writer.submit(lambda c: c.execute('ANALYZE')).result()
+    writer.submit(exclusive_job(lambda c: c.execute('VACUUM'))).result()
+    writer.submit(lambda c: c.execute('REPLACE INTO config (key, value) VALUES (?, ?)',
+                                      ('last_maintenance', datetime.utcnow().isoformat()))).result()
+    return moved
 
-def remove_savings_goal(goal_id):
-    if not st.session_state.logged_in:
-        return
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('DELETE FROM savings_goals WHERE id = ? AND user_id = ?', (goal_id, st.session_state.user_id))
-    conn.commit()
-    conn.close()
+def maintenance_due():
+    last = get_config('last_maintenance')
+    return last is None or datetime.utcnow() - datetime.fromisoformat(last) >= timedelta(days=MAINTENANCE_INTERVAL_DAYS)
 
-# --- PRICE FETCHING ---
+@st.cache_resource(show_spinner=False)
+def start_maintenance_scheduler():
+    # One daemon thread per server process. The first check waits a full period so startup never queues a VACUUM.
+    writer = get_db_writer()
 
-def fetch_price_yfinance(symbol):
-    try:
-        t = yf.Ticker(symbol)
-        if hasattr(t, 'fast_info') and t.fast_info and 'last_price' in t.fast_info:
-            return float(t.fast_info['last_price'])
-        todays = t.history(period='1d')
-        if not todays.empty:
-            price = todays['Close'].iloc[-1]
-        else:
-            info = {}
+    def loop():
+        while True:
+            time.sleep(MAINTENANCE_CHECK_SECONDS)
             try:
-                info = t.get_info() or {}
-            except Exception:
-                info = {}
-            price = info.get('regularMarketPrice') or info.get('previousClose')
-        return float(price) if price is not None else None
-    except Exception:
-        return None
+                if maintenance_due():
+                    run_maintenance(writer)
+            except Exception as e:
+                writer.submit(lambda c, message=str(e): c.execute('REPLACE INTO config (key, value) VALUES (?, ?)',
+                                                                   ('last_maintenance_error', message)))
 
-def fetch_alpha_vantage_quote(symbol, api_key=None):
-    api_key = api_key or get_config('alpha_vantage_key')
-    if not api_key:
-        return None
-    url = 'https://www.alphavantage.co/query'
-    params = {
-        'function': 'GLOBAL_QUOTE',
-        'symbol': symbol,
-        'apikey': api_key
-    }
-    try:
-        r = requests.get(url, params=params, timeout=10)
-        data = r.json()
-        quote = data.get('Global Quote', {})
-        price = quote.get('05. price')
-        return float(price) if price else None
-    except Exception:
-        return None
+    thread = threading.Thread(target=loop, name='db-maintenance', daemon=True)
+    thread.start()
+    return thread
 
-# --- HISTORICAL PORTFOLIO VALUE ---
+# --- FIGURE CACHE ---
 
-def build_portfolio_history(holdings_df, days=90):
-    end = datetime.utcnow().date()
-    start = end - timedelta(days=days)
-    if holdings_df.empty:
-        return pd.DataFrame()
-    df_list = []
-    for _, row in holdings_df.iterrows():
-        symbol = row['symbol']
-        shares = row['shares']
-        try:
-            hist = yf.download(symbol, start=start.isoformat(), end=end.isoformat(), progress=False)
-            if hist.empty:
-                continue
-            hist = hist[['Close']].rename(columns={'Close': symbol})
-            hist[symbol] = hist[symbol] * shares
-            df_list.append(hist[symbol])
-        except Exception:
-            continue
-    if not df_list:
-        return pd.DataFrame()
-    combined = pd.concat(df_list, axis=1).fillna(method='ffill').fillna(0)
-    combined['portfolio_value'] = combined.sum(axis=1)
-    combined.index = pd.to_datetime(combined.index)
-    return combined[['portfolio_value']]
+class FigureCache:
+    # Process-wide LRU of serialized Plotly figures keyed by (user, chart, params, version), where version moves
+    # whenever the chart's inputs can have changed (data version, quote time, price-history bucket). Memory is
+    # bounded by the total size of the stored JSON; the least recently used entries are evicted first.
+    def __init__(self, max_bytes=FIGURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        size += 256  # rough per-entry overhead, so even empty placeholders count against the bound
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.stats['evictions'] += 1
+
+    def hit_rate(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return self.stats['hits'] / lookups if lookups else None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache():
+    return FigureCache()
+
+def figure_cache_key(chart, params=(), version=None, shared=False):
+    # shared charts (market data only) are cached once for every user
+    return (None if shared else session_user_id(), chart, params, version)
+
+def price_history_version():
+    # Changes whenever get_price_matrix may have refetched, so price-history charts are rebuilt with it
+    return int(time.time() // PRICE_HISTORY_TTL)
+
+def cached_figure(key, build):
+    # build() -> Plotly figure, only called on a miss. Returns the figure as a dict, which st.plotly_chart accepts.
+    cache = get_figure_cache()
+    figure_json = cache.get(key)
+    if figure_json is None:
+        figure_json = build().to_json()
+        cache.put(key, figure_json, len(figure_json))
+    return json.loads(figure_json)
+
+# --- CHART DOWNSAMPLING ---
+
+def lttb_indices(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and, from each bucket in between, the point
+    # forming the largest triangle with the previously kept point and the next bucket's average. Peaks and troughs
+    # survive because they make the largest triangles. O(n); the Python loop runs once per output point.
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    return selected
+
+def downsample_frame(df, x, y_columns, max_points=MAX_CHART_POINTS):
+    # Keeps the union of each series' LTTB points, so every line keeps its own extremes
+    if len(df) <= max_points:
+        return df
+    x_values = df[x]
+    x_numeric = x_values.astype('int64').to_numpy() if pd.api.types.is_datetime64_any_dtype(x_values) else x_values.to_numpy(dtype=float)
+    per_series = max(max_points // len(y_columns), 3)
+    keep = np.empty(0, dtype=int)
+    for column in y_columns:
+        valid = np.flatnonzero(df[column].notna().to_numpy())
+        if len(valid):
+            keep = np.union1d(keep, valid[lttb_indices(x_numeric[valid], df[column].to_numpy(dtype=float)[valid], per_series)])
+    return df.iloc[keep]
+
+def line_figure(df, x, y, title, area, max_points, layout):
+    y_columns = [y] if isinstance(y, str) else list(y)
+    plotted = downsample_frame(df, x, y_columns, max_points)
+    fig = (px.area if area else px.line)(plotted, x=x, y=y, title=title)
+    if layout:
+        fig.update_layout(**layout)
+    return fig
+
+def plot_line(df, x, y, title, key, area=False, max_points=MAX_CHART_POINTS, cache_key=None, **layout):
+    # Line (or area) chart with at most max_points per series sent to the browser. Longer series get a range
+    # slider that re-slices the full-resolution data, so narrowing the window brings back every point.
+    # With a cache_key (see figure_cache_key), df may be a callable: on a figure-cache hit the frame is never built.
+    # Returns the plotted figure as a dict, or None when there was nothing to plot.
+    chart = st.empty()
+    cache = get_figure_cache() if cache_key is not None else None
+    frame = None
+
+    def load():
+        nonlocal frame
+        if frame is None:
+            frame = df() if callable(df) else df
+        return frame
+
+    def build(data):
+        figure_json = line_figure(data, x, y, title, area, max_points, layout).to_json()
+        return {'figure': figure_json, 'x_range': None}, len(figure_json)
+
+    # The full-range entry also remembers the x range, so the zoom slider can be drawn without the data
+    entry = cache.get(cache_key) if cache is not None else None
+    if entry is None:
+        data = load()
+        if data.empty:
+            entry, size = {'figure': None, 'x_range': None}, 0
+        else:
+            entry, size = build(data)
+            if len(data) > max_points:
+                low, high = data[x].min(), data[x].max()
+                if isinstance(low, pd.Timestamp):
+                    low, high = low.to_pydatetime(), high.to_pydatetime()
+                entry['x_range'] = (low, high)
+        if cache is not None:
+            cache.put(cache_key, entry, size)
+    if entry['figure'] is None:
+        return None
+    if entry['x_range'] is not None:
+        low, high = entry['x_range']
+        window = st.slider('Zoom', min_value=low, max_value=high, value=(low, high), key=f'{key}_zoom')
+        if tuple(window) != (low, high):
+            zoom_key = cache_key + (tuple(window),) if cache is not None else None
+            zoomed = cache.get(zoom_key) if cache is not None else None
+            if zoomed is None:
+                data = load()
+                zoomed, size = build(data[(data[x] >= window[0]) & (data[x] <= window[1])])
+                if cache is not None:
+                    cache.put(zoom_key, zoomed, size)
+            entry = zoomed
+    figure = json.loads(entry['figure'])
+    chart.plotly_chart(figure, use_container_width=True)
+    return figure
 
 # --- FEATURE 2: AI-GENERATED BUDGET SUMMARIES ---
 
-def generate_budget_summary(transactions_df):
-    if transactions_df.empty:
+def generate_budget_summary(total_income, total_expenses, by_month):
+    # Totals and by_month (query_transactions(group_by=('month', 'type'))) read archived years through the rollups,
+    # so the snapshot covers the whole ledger and agrees with the dashboard whatever the Budget page lists
+    if by_month.empty:
         return "You have no transactions logged yet. Start by adding some income and expenses to see your budget summary!"
 
-    transactions_df = transactions_df.copy()
-    transactions_df['tdate'] = pd.to_datetime(transactions_df['tdate'])
-    transactions_df['month'] = transactions_df['tdate'].dt.to_period('M')
-    
     summary = "### Your Budget Snapshot\n\n"
     
-    total_income = transactions_df[transactions_df['ttype'].str.lower() == 'income']['amount'].sum()
-    total_expenses = transactions_df[transactions_df['ttype'].str.lower() == 'expense']['amount'].sum()
     net_balance = total_income - total_expenses
     
     summary += f"**Total Income:** ₹{total_income:,.2f}\n"
@@ -579,10 +3737,8 @@ def generate_budget_summary(transactions_df):
     
     summary += "\n---\n\n"
     
-    monthly_summary = transactions_df.groupby('month').agg(
-        income=('amount', lambda x: x[transactions_df.loc[x.index, 'ttype'].str.lower() == 'income'].sum()),
-        expenses=('amount', lambda x: x[transactions_df.loc[x.index, 'ttype'].str.lower() == 'expense'].sum())
-    )
+    monthly_totals = by_month.pivot_table(index='month', columns='ttype', values='amount', aggfunc='sum', observed=False).fillna(0.0)
+    monthly_summary = pd.DataFrame({'income': monthly_totals.get('income', 0.0), 'expenses': monthly_totals.get('expense', 0.0)}, index=monthly_totals.index)
     monthly_summary['net'] = monthly_summary['income'] - monthly_summary['expenses']
     
     summary += "### Monthly Performance\n\n"
@@ -595,16 +3751,15 @@ def generate_budget_summary(transactions_df):
 # --- FEATURE 3: SPENDING INSIGHTS AND SUGGESTIONS ---
 
 def get_spending_insights(transactions_df):
-    if transactions_df.empty or transactions_df[transactions_df['ttype'].str.lower() == 'expense'].empty:
+    if transactions_df.empty or transactions_df[transactions_df['ttype'] == 'expense'].empty:
         return "Not enough data to provide spending insights. Please log some expenses."
 
-    expense_df = transactions_df[transactions_df['ttype'].str.lower() == 'expense'].copy()
-    expense_df['category'] = expense_df['category'].str.lower()
+    expense_df = transactions_df[transactions_df['ttype'] == 'expense']
     
     insights = "### Your Spending Insights & Tips\n\n"
     
     total_expenses = expense_df['amount'].sum()
-    category_spending = expense_df.groupby('category')['amount'].sum().sort_values(ascending=False)
+    category_spending = expense_df.groupby('category', observed=True)['amount'].sum().sort_values(ascending=False)
     
     top_category = category_spending.index[0]
     top_spending = category_spending.iloc[0]
@@ -616,6 +3771,12 @@ def get_spending_insights(transactions_df):
         insights += "⚠️ **Urgent Suggestion:** Your spending in this single category is very high. It might be a good idea to create a specific budget for this area to get it under control.\n\n"
     elif percentage > 20:
         insights += "💡 **Smart Tip:** Consider a spending audit for this category. Maybe there are subscription services you don't use or cheaper alternatives you could switch to.\n\n"
+
+    recurring = get_recurring_items()
+    active = recurring[recurring['active']] if not recurring.empty else recurring
+    if not active.empty:
+        listed = ', '.join(f"{row.label.title()} ({row.cadence}, ₹{row.amount_mean:,.0f})" for row in active.head(5).itertuples())
+        insights += f"🔁 **Recurring Charges:** You have {len(active)} active recurring expense(s) costing about **₹{active['monthly_cost'].sum():,.2f} a month**: {listed}. Cancel any you no longer use.\n\n"
     
     return insights
 
@@ -628,15 +3789,22 @@ def get_finance_response(user_message):
     # Fetch user data for context
     user_profile = get_user_profile()
     holdings = get_holdings()
-    transactions = get_transactions()
-    savings_goals = get_savings_goals()
+    savings_goals = refresh_goal_allocations()
 
     # Calculate key metrics
+    base_currency = user_profile['base_currency']
     total_value = 0
+    roi_text = "Add a purchase price to your holdings to compute ROI."
     if not holdings.empty:
-        total_value = sum(fetch_price_yfinance(r['symbol']) * r['shares'] for _, r in holdings.iterrows() if fetch_price_yfinance(r['symbol']))
-    total_income = transactions[transactions['ttype'].str.lower() == 'income']['amount'].sum() if not transactions.empty else 0
-    total_expenses = transactions[transactions['ttype'].str.lower() == 'expense']['amount'].sum() if not transactions.empty else 0
+        holdings = value_holdings(holdings, base_currency)
+        total_value = holdings['market_value'].sum()
+        priced = holdings[holdings['cost_basis_base'].notna() & (holdings['price'] > 0)]
+        total_cost = priced['cost_basis_base'].sum()
+        if total_cost > 0:
+            realized = realized_pnl_total(base_currency)
+            roi = (priced['market_value'].sum() - total_cost + realized) / total_cost * 100
+            roi_text = f"Your actual ROI is {roi:.2f}% ({format_money(priced['unrealized_pnl'].sum(), base_currency)} unrealized and {format_money(realized, base_currency)} realized on a cost basis of {format_money(total_cost, base_currency)})."
+    total_income, total_expenses = get_income_expense_totals()
     net_balance = total_income - total_expenses
     total_savings_target = savings_goals['target_amount'].sum() if not savings_goals.empty else 0
     total_saved = savings_goals['current_amount'].sum() if not savings_goals.empty else 0
@@ -649,7 +3817,7 @@ def get_finance_response(user_message):
         },
         {
             "patterns": [r"\b(invest|investment|stocks|portfolio)\b", r"where.*invest"],
-            "response": lambda: f"Your portfolio is worth ₹{total_value:,.2f}. With a {user_profile['risk_tolerance']} risk tolerance, {'stick to low-risk options like fixed deposits or blue-chip stocks' if user_profile['risk_tolerance'] == 'low' else 'consider a mix of stocks and mutual funds' if user_profile['risk_tolerance'] == 'moderate' else 'explore growth stocks or ETFs, but diversify to manage risk'}. {'Start small with mutual funds to learn.' if user_profile['user_type'] == 'student' else 'Diversify across sectors to reduce risk.'}"
+            "response": lambda: f"Your portfolio is worth {format_money(total_value, base_currency)}. With a {user_profile['risk_tolerance']} risk tolerance, {'stick to low-risk options like fixed deposits or blue-chip stocks' if user_profile['risk_tolerance'] == 'low' else 'consider a mix of stocks and mutual funds' if user_profile['risk_tolerance'] == 'moderate' else 'explore growth stocks or ETFs, but diversify to manage risk'}. {'Start small with mutual funds to learn.' if user_profile['user_type'] == 'student' else 'Diversify across sectors to reduce risk.'}"
         },
         {
             "patterns": [r"\b(savings|saving|goals|emergency fund)\b", r"how.*save"],
@@ -657,15 +3825,15 @@ def get_finance_response(user_message):
         },
         {
             "patterns": [r"\b(financial statement|balance sheet|income statement|cash flow)\b"],
-            "response": lambda: f"A financial statement summarizes your money. The balance sheet shows what you own (assets like ₹{total_value:,.2f} in investments) and owe. The income statement tracks income (₹{total_income:,.2f}) and expenses (₹{total_expenses:,.2f}). The cash flow statement shows money moving in and out. {'Think of it as tracking your pocket money and spending.' if user_profile['user_type'] == 'student' else 'Review these monthly to understand your financial health.'}"
+            "response": lambda: f"A financial statement summarizes your money. The balance sheet shows what you own (assets like {format_money(total_value, base_currency)} in investments) and owe. The income statement tracks income (₹{total_income:,.2f}) and expenses (₹{total_expenses:,.2f}). The cash flow statement shows money moving in and out. {'Think of it as tracking your pocket money and spending.' if user_profile['user_type'] == 'student' else 'Review these monthly to understand your financial health.'}"
         },
         {
             "patterns": [r"\b(risk|risk tolerance|diversification)\b"],
-            "response": lambda: f"Your risk tolerance is {user_profile['risk_tolerance']}. {'Low risk means safer investments like fixed deposits, but lower returns.' if user_profile['risk_tolerance'] == 'low' else 'Moderate risk balances growth and safety with mixed investments.' if user_profile['risk_tolerance'] == 'moderate' else 'High risk allows for growth stocks but can lead to losses.'} Diversification spreads your ₹{total_value:,.2f} portfolio across assets to reduce risk."
+            "response": lambda: f"Your risk tolerance is {user_profile['risk_tolerance']}. {'Low risk means safer investments like fixed deposits, but lower returns.' if user_profile['risk_tolerance'] == 'low' else 'Moderate risk balances growth and safety with mixed investments.' if user_profile['risk_tolerance'] == 'moderate' else 'High risk allows for growth stocks but can lead to losses.'} Diversification spreads your {format_money(total_value, base_currency)} portfolio across assets to reduce risk."
         },
         {
             "patterns": [r"\b(roi|return on investment)\b"],
-            "response": lambda: f"Return on Investment (ROI) measures profit from investments. For your portfolio (₹{total_value:,.2f}), ROI = (Current Value - Cost) / Cost. {'It’s like checking if your savings grew.' if user_profile['user_type'] == 'student' else 'Calculate ROI for each holding to assess performance.'}"
+            "response": lambda: f"Return on Investment (ROI) measures profit from investments. For your portfolio ({format_money(total_value, base_currency)}), ROI = (Current Value - Cost) / Cost. {roi_text} {'It’s like checking if your savings grew.' if user_profile['user_type'] == 'student' else 'Calculate ROI for each holding to assess performance.'}"
         },
         {
             "patterns": [r"\b(tax|taxes|tax planning)\b"],
@@ -673,7 +3841,7 @@ def get_finance_response(user_message):
         },
         {
             "patterns": [r".*"],
-            "response": lambda: f"I’m not sure about that question. Try asking about budgeting, investments, savings, or taxes for personalized advice based on your ₹{total_value:,.2f} portfolio and ₹{net_balance:,.2f} net balance."
+            "response": lambda: f"I’m not sure about that question. Try asking about budgeting, investments, savings, or taxes for personalized advice based on your {format_money(total_value, base_currency)} portfolio and ₹{net_balance:,.2f} net balance."
         }
     ]
 
@@ -761,9 +3929,14 @@ def settings_page():
             ('low', 'moderate', 'high'),
             index=('low', 'moderate', 'high').index(user_profile.get('risk_tolerance', 'moderate'))
         )
+        base_currency = st.selectbox(
+            'Base currency for portfolio valuation',
+            BASE_CURRENCIES,
+            index=BASE_CURRENCIES.index(user_profile['base_currency']) if user_profile['base_currency'] in BASE_CURRENCIES else 0
+        )
         profile_submitted = st.form_submit_button("Save Profile")
         if profile_submitted:
-            save_user_profile(user_type, savings_goal, risk_tolerance)
+            save_user_profile(user_type, savings_goal, risk_tolerance, base_currency)
             st.success("Profile saved successfully!")
             safe_rerun()
 
@@ -780,6 +3953,76 @@ def settings_page():
 
     st.info('If you do not provide an Alpha Vantage key, yfinance will be used by default.')
 
+    with st.expander('Database write queue'):
+        writer_stats = get_db_writer().stats()
+        stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
+        stat_col1.metric('Queue depth', writer_stats['queue_depth'], help=f"Max seen: {writer_stats['max_queue_depth']}")
+        stat_col2.metric('Committed writes', writer_stats['committed'], help=f"Failed: {writer_stats['failed']}, rejected: {writer_stats['rejected']}")
+        stat_col3.metric('Avg. commit', f"{writer_stats['avg_commit_ms']:.1f} ms", help=f"Max: {writer_stats['max_commit_ms']:.1f} ms")
+        stat_col4.metric('Batches', writer_stats['batches'], help=f"Largest batch: {writer_stats['max_batch_size']} writes")
+        st.caption(f"Queue wait: avg {writer_stats['avg_queue_wait_ms']:.1f} ms, max {writer_stats['max_queue_wait_ms']:.1f} ms · "
+                   f"Lock waits: {writer_stats['lock_waits']} (max {writer_stats['max_lock_wait_ms']:.1f} ms)")
+
+    with st.expander('API access'):
+        st.caption('Tokens for the local JSON API (`python finance_api.py`). Send one as `Authorization: Bearer <token>`.')
+        token_label = st.text_input('Token label', key='api_token_label')
+        if st.button('Create token'):
+            st.code(create_api_token(token_label))
+            st.warning("Copy this token now; it won't be shown again.")
+        api_tokens = get_api_tokens()
+        for token in api_tokens.itertuples():
+            token_col1, token_col2 = st.columns([4, 1])
+            token_col1.write(f"{token.label} (created {token.created_at[:10]})")
+            if token_col2.button('Revoke', key=f'revoke_token_{token.id}'):
+                revoke_api_token(token.id)
+                safe_rerun()
+
+    with st.expander('Quote refresh'):
+        scheduler = get_quote_scheduler()
+        quote_stats = scheduler.stats
+        quote_col1, quote_col2, quote_col3 = st.columns(3)
+        quote_col1.metric('Hot symbols', scheduler.hot_count())
+        quote_col2.metric('Provider requests', quote_stats['requests'], help=f"Symbols refreshed: {quote_stats['symbols_fetched']}")
+        quote_col3.metric('Rate-limited cycles', quote_stats['rate_limited'], help=f"Limit: {QUOTE_REQUESTS_PER_MINUTE} requests/min, {QUOTE_BATCH_SIZE} symbols each")
+        if quote_stats['last_error']:
+            st.caption(f"Last refresh error: {quote_stats['last_error']}")
+
+    with st.expander('Chart cache'):
+        figures = get_figure_cache()
+        hit_rate = figures.hit_rate()
+        figure_col1, figure_col2, figure_col3 = st.columns(3)
+        figure_col1.metric('Hit rate', f'{hit_rate * 100:.0f}%' if hit_rate is not None else '—',
+                           help=f"{figures.stats['hits']} hits, {figures.stats['misses']} misses")
+        figure_col2.metric('Cached figures', len(figures.entries), help=f"{figures.size / 1e6:.1f} of {figures.max_bytes / 1e6:.0f} MB")
+        figure_col3.metric('Evictions', figures.stats['evictions'])
+        if st.button('Clear chart cache'):
+            figures.clear()
+            st.success('Chart cache cleared.')
+
+    with st.expander('Archive & maintenance'):
+        boundary = get_archive_boundary()
+        last_maintenance = get_config('last_maintenance')
+        st.caption(f"Transactions before {pd.to_datetime(boundary, unit='D').date() if boundary else 'n/a'} are archived · "
+                   f"last maintenance: {last_maintenance[:16].replace('T', ' ') + ' UTC' if last_maintenance else 'never'} · "
+                   f"runs every {MAINTENANCE_INTERVAL_DAYS} days")
+        maintenance_error = get_config('last_maintenance_error')
+        if maintenance_error:
+            st.caption(f'Last scheduled run failed: {maintenance_error}')
+        if st.button('Archive my closed years now'):
+            with st.spinner('Archiving your closed years...'):
+                moved = archive_own_closed_years()
+            st.success(f'Archived {moved} transactions. The database is analyzed and compacted by the next scheduled run.')
+
+    st.markdown('---')
+    st.write('Import a ticker list to extend symbol autocomplete on the Market Lookup page.')
+    ticker_file = st.file_uploader('Ticker list (CSV with a symbol column and optional name, exchange columns)', type=['csv'], key='ticker_upload')
+    if ticker_file is not None and st.button('Import tickers'):
+        try:
+            imported = import_ticker_universe(ticker_file)
+            st.success(f'Imported {imported} tickers.')
+        except Exception as e:
+            st.error(f'Could not import ticker list: {e}')
+
 def portfolio_page():
     if not st.session_state.logged_in:
         st.warning("Please log in to access your portfolio.")
@@ -788,15 +4031,21 @@ def portfolio_page():
     st.header('Portfolio Tracker')
     col1, col2 = st.columns([1, 2])
     with col1:
-        st.subheader('Add holding')
+        st.subheader('Record a trade')
+        side = st.radio('Side', ['Buy', 'Sell'], horizontal=True, key='trade_side')
         symbol = st.text_input('Symbol (e.g. AAPL, TCS.NS)', key='sym_input')
         shares = st.number_input('Shares', min_value=0.0, format='%f', step=1.0)
-        avg_price = st.number_input('Avg. price (optional)', min_value=0.0, format='%f', step=1.0)
-        if st.button('Add'):
+        trade_price = st.number_input('Price per share (0 = current market price)', min_value=0.0, format='%f', step=1.0)
+        trade_date = st.date_input('Trade date', value=datetime.today(), key='trade_date')
+        if st.button('Record'):
             if symbol and shares > 0:
-                add_holding(symbol, shares, avg_price if avg_price > 0 else None)
-                st.success(f'Added {shares} of {symbol.upper()}')
-                safe_rerun()
+                price = trade_price if trade_price > 0 else get_quote(symbol)
+                error = record_trade(symbol, side.lower(), shares, price, trade_date.isoformat())
+                if error:
+                    st.error(error)
+                else:
+                    st.success(f'{"Bought" if side == "Buy" else "Sold"} {shares} of {symbol.upper()}')
+                    safe_rerun()
             else:
                 st.error('Please provide a symbol and shares > 0')
 
@@ -814,14 +4063,38 @@ def portfolio_page():
             else:
                 price = None
                 if api_choice == 'yfinance':
-                    price = fetch_price_yfinance(quick_sym)
+                    price = get_quote(quick_sym)
                 elif api_choice == 'alpha_vantage' and av_key_session:
                     price = fetch_alpha_vantage_quote(quick_sym, av_key_session)
                 
                 if price is None:
                     st.warning('Price not found or API key is invalid.')
                 else:
-                    st.metric(label=f'{quick_sym.upper()} price', value=f"₹{price:.2f}")
+                    quote_currency = get_symbol_currencies([quick_sym.upper()])[quick_sym.upper()]
+                    st.metric(label=f'{quick_sym.upper()} price', value=format_money(price, quote_currency))
+
+        st.subheader('Price alerts')
+        with st.form('price_alert_form'):
+            alert_symbol = st.text_input('Symbol', key='alert_symbol')
+            alert_kind = st.selectbox('Alert when', list(PRICE_ALERT_KINDS), format_func=lambda kind: PRICE_ALERT_KINDS[kind][0], key='alert_kind')
+            alert_value = st.number_input('Price or % move', min_value=0.0, format='%f', step=1.0, key='alert_value')
+            if st.form_submit_button('Set alert'):
+                error = add_price_alert(alert_symbol, alert_kind, alert_value)
+                if error:
+                    st.error(error)
+                else:
+                    st.success(f'Alert set for {alert_symbol.strip().upper()}.')
+        active_alerts = get_price_alerts(status='active')
+        for alert in active_alerts.itertuples():
+            alert_col1, alert_col2 = st.columns([4, 1])
+            alert_col1.markdown(price_alert_text(alert))
+            if alert_col2.button('Remove', key=f'remove_alert_{alert.id}'):
+                remove_price_alert(alert.id)
+                safe_rerun()
+        engine_stats = get_price_alert_engine().stats
+        if engine_stats['last_check_at']:
+            st.caption(f"Alerts are checked whenever their symbols are refreshed (at least every {PRICE_ALERT_INTERVAL_SECONDS // 60} min); "
+                       f"last check {engine_stats['last_check_at'][11:16]} UTC, {engine_stats['alerts']} active alert(s) on {engine_stats['symbols']} symbol(s).")
 
     with col2:
         st.subheader('Your holdings')
@@ -829,17 +4102,31 @@ def portfolio_page():
         if holdings.empty:
             st.info('No holdings yet — add one on the left.')
         else:
-            prices = [fetch_price_yfinance(r['symbol']) for _, r in holdings.iterrows()]
-            holdings['price'] = [p if p is not None else 0.0 for p in prices]
-            holdings['market_value'] = holdings['shares'] * holdings['price']
+            base_currency = get_base_currency()
+            holdings = value_holdings(holdings, base_currency)
             total_value = holdings['market_value'].sum()
-            st.metric('Total Portfolio Value', f"₹{total_value:,.2f}")
+            realized_total = realized_pnl_total(base_currency)
+            metric_col1, metric_col2, metric_col3 = st.columns(3)
+            metric_col1.metric('Total Portfolio Value', format_money(total_value, base_currency))
+            metric_col2.metric('Unrealized P&L', format_money(holdings['unrealized_pnl'].sum(), base_currency))
+            metric_col3.metric('Realized P&L', format_money(realized_total, base_currency))
+            if holdings['price'].isna().any():
+                st.warning(f"No price yet for {', '.join(holdings.loc[holdings['price'].isna(), 'symbol'])}; those holdings are excluded from the totals.")
+            if holdings['fx_rate'].isna().any():
+                st.warning(f"No FX rate available for {', '.join(holdings.loc[holdings['fx_rate'].isna(), 'currency'].unique())}; those holdings are excluded from the totals.")
+
+            # Price and avg. price are in each symbol's own currency; value and P&L columns are in the base currency
+            display_df = holdings[['symbol', 'currency', 'shares', 'avg_price', 'price', 'cost_basis_base', 'market_value', 'unrealized_pnl', 'realized_pnl_base']].rename(
+                columns={'symbol': 'Symbol', 'currency': 'Currency', 'shares': 'Shares', 'avg_price': 'Avg. Price', 'price': 'Price',
+                         'cost_basis_base': f'Cost Basis ({base_currency})', 'market_value': f'Market Value ({base_currency})',
+                         'unrealized_pnl': f'Unrealized P&L ({base_currency})', 'realized_pnl_base': f'Realized P&L ({base_currency})'})
+            st.dataframe(display_df.set_index('Symbol'))
 
-            display_df = holdings[['id', 'symbol', 'shares', 'avg_price', 'price', 'market_value']].rename(columns={'id': 'ID', 'avg_price': 'Avg. Price', 'market_value': 'Market Value'})
-            st.dataframe(display_df.set_index('ID'))
+            with st.expander('Recent trades'):
+                st.dataframe(get_trades().set_index('id'))
 
             st.subheader('Remove a holding')
-            to_remove = st.selectbox('Select ID to remove', options=holdings['id'].tolist())
+            to_remove = st.selectbox('Select symbol to remove (deletes all of its trades)', options=holdings['symbol'].tolist())
             if st.button('Remove'):
                 remove_holding(to_remove)
                 st.success('Removed')
@@ -847,12 +4134,13 @@ def portfolio_page():
 
             st.subheader('Portfolio history')
             days = st.slider('Days', min_value=7, max_value=365, value=90)
-            hist = build_portfolio_history(holdings, days=days)
-            if hist.empty:
+            # Price-history charts change with the holdings (data version) or when the hourly price matrix is refetched
+            history_version = (get_data_version(), price_history_version())
+            plotted = plot_line(lambda: build_portfolio_history(holdings, days=days, base_currency=base_currency).rename_axis('Date').reset_index(),
+                                'Date', 'portfolio_value', 'Portfolio Value Over Time', key='portfolio_history',
+                                cache_key=figure_cache_key('portfolio_history', (days, base_currency), history_version))
+            if plotted is None:
                 st.info('No historical data available for holdings')
-            else:
-                fig = px.line(hist.reset_index(), x=hist.index, y='portfolio_value', title='Portfolio Value Over Time')
-                st.plotly_chart(fig, use_container_width=True)
 
             st.subheader('Portfolio Diversification 📊')
             if not holdings.empty:
@@ -880,47 +4168,103 @@ def portfolio_page():
                 sector_allocation = holdings.groupby('sector')['market_value'].sum().reset_index()
                 sector_allocation.columns = ['Sector', 'Market Value']
 
-                fig_pie = px.pie(
+                fig_pie = cached_figure(figure_cache_key('sector_pie', (base_currency,), (get_data_version(), held_quotes_stamp())), lambda: px.pie(
                     sector_allocation,
                     values='Market Value',
                     names='Sector',
                     title='Portfolio Breakdown by Sector'
-                )
+                ))
                 st.plotly_chart(fig_pie, use_container_width=True)
             else:
                 st.info('Add some holdings to see your portfolio diversification.')
 
             st.subheader('Performance Benchmark vs. Nifty 50 📈')
-            index_symbol = '^NSEI'
+            index_symbol = BENCHMARK_SYMBOL
             if not holdings.empty:
-                portfolio_hist = build_portfolio_history(holdings, days=90)
-                
-                if not portfolio_hist.empty:
-                    try:
-                        index_hist = yf.download(index_symbol, start=portfolio_hist.index.min().isoformat(), end=portfolio_hist.index.max().isoformat(), progress=False)
-                        if not index_hist.empty:
-                            portfolio_hist = portfolio_hist.copy()
-                            portfolio_hist['Normalized Portfolio Value'] = (portfolio_hist['portfolio_value'] / portfolio_hist['portfolio_value'].iloc[0]) * 100
-                            index_hist = index_hist.copy()
-                            index_hist['Normalized Index Value'] = (index_hist['Close'] / index_hist['Close'].iloc[0]) * 100
-
-                            combined_df = pd.DataFrame({
-                                'Date': portfolio_hist.index,
-                                'Portfolio': portfolio_hist['Normalized Portfolio Value'].values
-                            })
-                            index_series = index_hist['Normalized Index Value']
-                            index_series = index_series.reindex(pd.to_datetime(portfolio_hist.index)).fillna(method='ffill').values
-                            combined_df['Nifty 50'] = index_series
-
-                            fig_benchmark = px.line(combined_df, x='Date', y=['Portfolio', 'Nifty 50'], title=f"Portfolio Performance vs. {index_symbol}")
-                            fig_benchmark.update_layout(legend_title_text='Asset')
-                            st.plotly_chart(fig_benchmark, use_container_width=True)
-                        else:
-                            st.warning(f"Could not fetch historical data for {index_symbol}.")
-                    except Exception:
-                        st.warning("Could not perform benchmarking due to an error fetching index data.")
+                def benchmark_frame():
+                    portfolio_hist = build_portfolio_history(holdings, days=90, base_currency=base_currency)
+                    index_close = get_holdings_price_matrix(holdings, 90, base_currency).get(index_symbol) if not portfolio_hist.empty else None
+                    if index_close is None or not index_close.notna().any():
+                        return pd.DataFrame()
+                    index_close = index_close.ffill().dropna()
+                    normalized_index = (index_close / index_close.iloc[0]) * 100
+                    combined_df = pd.DataFrame({
+                        'Date': portfolio_hist.index,
+                        'Portfolio': (portfolio_hist['portfolio_value'] / portfolio_hist['portfolio_value'].iloc[0] * 100).values
+                    })
+                    combined_df['Nifty 50'] = normalized_index.reindex(portfolio_hist.index).ffill().values
+                    return combined_df
+
+                plotted = plot_line(benchmark_frame, 'Date', ['Portfolio', 'Nifty 50'], f"Portfolio Performance vs. {index_symbol}", key='benchmark',
+                                    cache_key=figure_cache_key('benchmark', (index_symbol, base_currency), history_version), legend_title_text='Asset')
+                if plotted is None:
+                    st.info(f'Not enough historical data for the portfolio or {index_symbol} to benchmark.')
+
+            st.subheader('Risk Analytics 🛡️')
+            risk_col1, risk_col2 = st.columns(2)
+            with risk_col1:
+                risk_days = st.selectbox('Lookback', [90, 180, 365], index=1, format_func=lambda d: f'{d} days', key='risk_days')
+            with risk_col2:
+                risk_window = st.selectbox('Rolling window', [21, 63], format_func=lambda w: f'{w} trading days', key='risk_window')
+            risk = get_portfolio_risk(holdings_cache_key(holdings), risk_days, risk_window, base_currency)
+            if risk is None:
+                st.info('Not enough price history to compute risk metrics.')
+            else:
+                st.dataframe(risk['summary'].round(2))
+                user_profile = get_user_profile()
+                risk_tolerance = user_profile.get('risk_tolerance', 'moderate')
+                portfolio_vol = risk['summary'].loc['Portfolio', 'Annual Volatility (%)'] / 100
+                comfort_vol = RISK_TOLERANCE_VOLATILITY.get(risk_tolerance, RISK_TOLERANCE_VOLATILITY['moderate'])
+                if np.isfinite(portfolio_vol):
+                    if portfolio_vol > comfort_vol:
+                        st.warning(f"Your portfolio's annual volatility ({portfolio_vol * 100:.1f}%) is above the ~{comfort_vol * 100:.0f}% typical for a {risk_tolerance} risk tolerance.")
+                    else:
+                        st.success(f"Your portfolio's annual volatility ({portfolio_vol * 100:.1f}%) fits a {risk_tolerance} risk tolerance (~{comfort_vol * 100:.0f}% or less).")
+                rolling_vol = risk['rolling_volatility'][['Portfolio', BENCHMARK_SYMBOL]].dropna(how='all') * 100
+                if not rolling_vol.empty:
+                    plot_line(rolling_vol.rename_axis('Date').reset_index(), 'Date', ['Portfolio', BENCHMARK_SYMBOL], f'Rolling {risk_window}-day Annualized Volatility (%)',
+                              key='rolling_vol', cache_key=figure_cache_key('rolling_vol', (risk_days, risk_window, base_currency), history_version), legend_title_text='Asset')
+                drawdown = risk['drawdown'][['Portfolio']] * 100
+                plot_line(drawdown.rename_axis('Date').reset_index(), 'Date', 'Portfolio', 'Portfolio Drawdown (%)', key='drawdown', area=True,
+                          cache_key=figure_cache_key('drawdown', (risk_days, risk_window, base_currency), history_version))
+
+            st.subheader('Rebalancing Suggestions ⚖️')
+            risk_tolerance = get_user_profile().get('risk_tolerance', 'moderate')
+            rebalance_col1, rebalance_col2 = st.columns([1, 2])
+            with rebalance_col1:
+                rebalance_profile = st.selectbox('Risk profile', list(RISK_AVERSION), index=list(RISK_AVERSION).index(risk_tolerance) if risk_tolerance in RISK_AVERSION else 1,
+                                                 format_func=str.capitalize, key='rebalance_profile')
+            with rebalance_col2:
+                candidate_text = st.text_input('Also consider (comma-separated symbols)', value=', '.join(REBALANCE_CANDIDATES), key='rebalance_candidates')
+            candidates = tuple(sorted({sym.strip().upper() for sym in candidate_text.split(',') if sym.strip()}))
+            plan = rebalance_portfolio(holdings_shares(holdings), candidates, base_currency)
+            if plan is None:
+                st.info('Not enough price history for your holdings and candidates to suggest a rebalance.')
+            else:
+                profile_summary = pd.DataFrame(
+                    [('Current', plan['current_return'], plan['current_volatility'])]
+                    + [(profile.capitalize(), result['expected_return'], result['volatility']) for profile, result in plan['profiles'].items()],
+                    columns=['Portfolio', 'Expected Return (%)', 'Volatility (%)']).set_index('Portfolio')
+                st.dataframe((profile_summary * 100).round(1))
+                trades = rebalance_trades(plan, rebalance_profile)
+                if trades.empty:
+                    st.success(f'Your holdings are already close to the {rebalance_profile}-risk target mix.')
                 else:
-                    st.info('Not enough historical data to perform benchmarking.')
+                    st.dataframe(trades[['action', 'symbol', 'shares', 'price', 'value', 'current_weight', 'target_weight']].assign(shares=trades['shares'].abs(), value=trades['value'].abs())
+                                 .rename(columns={'action': 'Action', 'symbol': 'Symbol', 'shares': 'Shares', 'price': f'Price ({base_currency})', 'value': f'Value ({base_currency})',
+                                                  'current_weight': 'Current (%)', 'target_weight': 'Target (%)'}).round(2).set_index('Action'))
+                st.caption(f"Long-only mean-variance targets from {REBALANCE_LOOKBACK_DAYS // 365} years of daily returns; covariance shrunk "
+                           f"{plan['shrinkage'] * 100:.0f}% towards a diagonal target. Estimates, not advice."
+                           + (f" Skipped for lack of history: {', '.join(plan['skipped'])}." if plan['skipped'] else ''))
+
+            st.subheader('News for your holdings 📰')
+            portfolio_news = fetch_portfolio_news(holdings['symbol'].tolist())
+            if portfolio_news:
+                for article in portfolio_news:
+                    title = f"[{article['title']}]({article['link']})" if article['link'] else article['title']
+                    st.write(f"**{title}** ({article['source']}{', ' + article['publishedAt'][:10] if article['publishedAt'] else ''})")
+            else:
+                st.info(f'No recent news found for your holdings. Drop RSS or JSON feed files into the `{NEWS_DIR}` folder to see news here.')
 
 def budget_page():
     if not st.session_state.logged_in:
@@ -934,27 +4278,101 @@ def budget_page():
         with st.form('trans_form'):
             tdate = st.date_input('Date', value=datetime.today())
             ttype = st.selectbox('Type', ['Income', 'Expense'])
-            category = st.text_input('Category (e.g. Salary, Groceries)')
+            category = st.text_input('Category (e.g. Salary, Groceries; leave blank to auto-fill from the note)')
             amount = st.number_input('Amount', min_value=0.0, format='%f')
             note = st.text_input('Note (optional)')
             submitted = st.form_submit_button('Add transaction')
             if submitted:
-                if amount > 0 and category:
-                    add_transaction(tdate.isoformat(), ttype, category, amount, note)
-                    st.success('Transaction added')
+                if amount > 0:
+                    auto_category = None if category.strip() else (suggest_category(note) or UNCATEGORIZED)
+                    add_transaction(tdate.isoformat(), ttype, auto_category or category, amount, note, learn=auto_category is None)
+                    st.success(f'Transaction added to {auto_category.title()}' if auto_category else 'Transaction added')
                     safe_rerun()
                 else:
-                    st.error('Amount must be greater than 0 and category cannot be empty.')
+                    st.error('Amount must be greater than 0.')
+
+        with st.expander('Import transactions from CSV'):
+            statement = st.file_uploader('Bank statement or export (CSV with date, amount or debit/credit, and description columns)', type=['csv'], key='tx_import')
+            if statement is not None:
+                try:
+                    parsed, skipped = parse_transactions_csv(statement)
+                except Exception as e:
+                    parsed = None
+                    st.error(f'Could not read the file: {e}')
+                if parsed is not None:
+                    st.write(f'{len(parsed)} transactions found ({(parsed["category"] == "").sum()} will be auto-categorized).')
+                    if skipped:
+                        st.warning(f'{skipped} row(s) will be skipped: the date could not be read or the amount is missing or zero.')
+                    if st.button('Import transactions') and not parsed.empty:
+                        imported = add_transactions_bulk(parsed)
+                        st.success(f'Imported {imported} transactions.')
+                        safe_rerun()
+
+        with st.expander('Auto-categorization rules'):
+            st.caption('Notes containing a keyword are filed under its category. Your rules come first, then the categories you have picked for the same note before, then built-in rules.')
+            with st.form('category_rule_form'):
+                rule_keyword = st.text_input('Keyword (e.g. swiggy)')
+                rule_category = st.text_input('Category')
+                if st.form_submit_button('Add rule'):
+                    if rule_keyword.strip() and rule_category.strip():
+                        add_category_rule(rule_keyword, rule_category)
+                        safe_rerun()
+                    else:
+                        st.error('Keyword and category are both required.')
+            rules = get_category_rules()
+            if not rules.empty:
+                st.dataframe(rules[['id', 'keyword', 'category']].rename(columns={'id': 'ID', 'keyword': 'Keyword', 'category': 'Category'}).set_index('ID'))
+                rule_to_remove = st.selectbox('Select rule to delete', options=['Select rule'] + rules['id'].tolist(), key='rule_remove')
+                if st.button('Delete rule') and rule_to_remove != 'Select rule':
+                    remove_category_rule(int(rule_to_remove))
+                    safe_rerun()
     
     with col2:
+        st.subheader('Search transactions')
+        search_text = st.text_input('Search notes and categories', placeholder='e.g. amazon refund', key='tx_search')
+        search_col1, search_col2, search_col3 = st.columns(3)
+        search_type = search_col1.selectbox('Type', ['Any', 'Income', 'Expense'], key='tx_search_type')
+        search_from = search_col2.date_input('From', value=None, key='tx_search_from')
+        search_to = search_col3.date_input('To', value=None, key='tx_search_to')
+        search_key = (search_text, search_type, search_from, search_to)
+        if st.session_state.get('tx_search_key') != search_key:
+            st.session_state.tx_search_key = search_key
+            st.session_state.tx_search_page = 0
+        if search_text.strip():
+            search_page = st.session_state.get('tx_search_page', 0)
+            results, has_more = search_transactions(search_text, search_from, search_to, None if search_type == 'Any' else search_type.lower(), search_page)
+            if results.empty:
+                st.info('No matching transactions.' if search_page == 0 else 'No more results.')
+            else:
+                results['tdate'] = results['tdate'].dt.date
+                results['ttype'] = results['ttype'].cat.rename_categories(str.capitalize)
+                results['category'] = results['category'].str.title()
+                st.dataframe(results[['id', 'tdate', 'ttype', 'category', 'amount', 'match']]
+                             .rename(columns={'id': 'ID', 'tdate': 'Date', 'ttype': 'Type', 'category': 'Category', 'amount': 'Amount', 'match': 'Note'})
+                             .set_index('ID'))
+            page_col1, page_col2, page_col3 = st.columns([1, 2, 1])
+            if page_col1.button('← Previous', disabled=search_page == 0, key='tx_search_prev'):
+                st.session_state.tx_search_page = search_page - 1
+                safe_rerun()
+            page_col2.caption(f'Page {search_page + 1}, best matches first')
+            if page_col3.button('Next →', disabled=not has_more, key='tx_search_next'):
+                st.session_state.tx_search_page = search_page + 1
+                safe_rerun()
+
         st.subheader('Recent transactions')
-        tx = get_transactions()
+        archive_boundary = get_archive_boundary()
+        include_archived = archive_boundary > 0 and st.checkbox(
+            f"Include archived years (before {pd.to_datetime(archive_boundary, unit='D').year})", key='tx_include_archived')
+        tx = get_transactions() if include_archived or not archive_boundary else query_transactions(start=pd.to_datetime(archive_boundary, unit='D'))
         if tx.empty:
             st.info('No transactions yet')
         else:
-            tx['tdate'] = pd.to_datetime(tx['tdate']).dt.date
-            tx['S.No.'] = range(1, len(tx) + 1)
-            st.dataframe(tx[['S.No.', 'tdate', 'ttype', 'category', 'amount', 'note']]
+            tx_display = tx.copy()
+            tx_display['tdate'] = tx_display['tdate'].dt.date
+            tx_display['ttype'] = tx_display['ttype'].cat.rename_categories(str.capitalize)
+            tx_display['category'] = tx_display['category'].cat.rename_categories(str.title)
+            tx_display['S.No.'] = range(1, len(tx_display) + 1)
+            st.dataframe(tx_display[['S.No.', 'tdate', 'ttype', 'category', 'amount', 'note']]
                          .rename(columns={'tdate': 'Date', 'ttype': 'Type', 'category': 'Category', 'amount': 'Amount', 'note': 'Note'})
                          .set_index('S.No.'))
 
@@ -972,26 +4390,90 @@ def budget_page():
     st.markdown('---')
     st.header('Budget Summary & Insights')
     
-    tx_all = get_transactions()
+    tx_all = tx
+    by_month = query_transactions(group_by=('month', 'type'))
     
-    if not tx_all.empty:
-        budget_summary = generate_budget_summary(tx_all)
+    if not by_month.empty:
+        budget_summary = generate_budget_summary(*get_income_expense_totals(), by_month)
         spending_insights = get_spending_insights(tx_all)
         st.markdown(budget_summary)
         st.markdown('---')
         st.markdown(spending_insights)
     else:
         st.info("Log some transactions to get a summary and insights.")
+
+    st.markdown('---')
+    st.subheader('Spending Forecast 🔮')
+    forecasts = get_category_forecasts()
+    if forecasts.empty:
+        st.info(f'Forecasts appear once a category has {FORECAST_MIN_MONTHS} complete months of expenses.')
+    else:
+        for warning in overspend_warnings(forecasts):
+            st.warning(warning)
+        st.dataframe(pd.DataFrame({
+            'Category': forecasts['category'].str.title(),
+            'Spent This Month (₹)': forecasts['month_to_date'].round(2),
+            'Forecast This Month (₹)': forecasts['forecast'].round(2),
+            'On Pace For (₹)': forecasts['projected'].round(2),
+            'Forecast Next Month (₹)': forecasts['next_month'].round(2),
+            'Months of History': forecasts['months'],
+        }).set_index('Category'))
+        st.caption(f"Next month's expected total: ₹{forecasts['next_month'].sum():,.2f}")
+
+    st.markdown('---')
+    st.subheader('Category Budgets 🎯')
+    with st.form('category_budget_form'):
+        bcol1, bcol2, bcol3 = st.columns(3)
+        budget_category = bcol1.text_input('Category')
+        budget_limit = bcol2.number_input('Monthly limit (₹)', min_value=0.0, format='%f')
+        budget_threshold = bcol3.slider('Alert at (% of limit)', 50, 100, int(DEFAULT_BUDGET_ALERT_THRESHOLD * 100), step=5)
+        if st.form_submit_button('Save budget'):
+            if budget_category.strip() and budget_limit > 0:
+                set_category_budget(budget_category, budget_limit, budget_threshold / 100)
+                safe_rerun()
+            else:
+                st.error('Enter a category and a limit greater than 0.')
+    budget_status = get_budget_status()
+    if budget_status.empty:
+        st.info('No category budgets yet. Set a monthly limit above to track it here.')
+    else:
+        for row in budget_status.itertuples():
+            icon = {'exceeded': '🔴', 'warning': '🟠', 'ok': '🟢'}[row.status]
+            st.write(f"{icon} **{row.category.title()}**: ₹{row.spent:,.2f} of ₹{row.monthly_limit:,.2f}"
+                     + (f" (₹{row.remaining:,.2f} left)" if row.remaining >= 0 else f" (₹{-row.remaining:,.2f} over)"))
+            st.progress(min(max(row.used, 0.0), 1.0))
+        budget_to_remove = st.selectbox('Remove a budget', options=['Select category'] + budget_status['category'].tolist(), key='budget_remove')
+        if st.button('Remove budget') and budget_to_remove != 'Select category':
+            remove_category_budget(int(budget_status.loc[budget_status['category'] == budget_to_remove, 'category_id'].iloc[0]))
+            safe_rerun()
+
+    st.markdown('---')
+    st.subheader('Recurring Payments & Subscriptions 🔁')
+    recurring = get_recurring_items()
+    if recurring.empty:
+        st.info('No recurring expenses detected yet. Weekly, monthly and yearly payments show up here once they repeat a few times.')
+    else:
+        active = recurring[recurring['active']]
+        st.metric('Active recurring spend', f"₹{active['monthly_cost'].sum():,.2f} / month", help=f"{len(active)} active of {len(recurring)} detected")
+        st.dataframe(pd.DataFrame({
+            'Payment': recurring['label'].str.title(),
+            'Category': recurring['category'].str.title(),
+            'Cadence': recurring['cadence'].str.capitalize(),
+            'Typical Amount (₹)': recurring['amount_mean'].round(2),
+            'Per Month (₹)': recurring['monthly_cost'].round(2),
+            'Times Seen': recurring['occurrences'],
+            'Last Paid': recurring['last_date'].dt.date,
+            'Next Expected': recurring['next_date'].dt.date.where(recurring['active'], None),
+            'Status': recurring['active'].map({True: 'Active', False: 'Lapsed'}),
+        }).set_index('Payment'))
     
     st.markdown('---')
     
     st.subheader("Spending from Salary Breakdown")
-    expenses_df = tx_all[(tx_all['ttype'].str.lower() == 'expense')]
-    total_income = tx_all[tx_all['ttype'].str.lower() == 'income']['amount'].sum()
-    total_expenses = expenses_df['amount'].sum()
-    if not expenses_df.empty:
-        expenses_df['category'] = expenses_df['category'].str.lower()
-        spending_by_category = expenses_df.groupby('category')['amount'].sum()
+    expenses_by_category = query_transactions(ttype='expense', group_by='category')
+    total_income, total_expenses = get_income_expense_totals()
+    if not expenses_by_category.empty:
+        spending_by_category = pd.Series(expenses_by_category['amount'].values, index=expenses_by_category['category'].astype(str))
         
         remaining_balance = total_income - total_expenses
         if remaining_balance > 0:
@@ -1000,16 +4482,51 @@ def budget_page():
         spending_df = spending_by_category.reset_index()
         spending_df.columns = ['Category', 'Amount']
         
-        fig = px.pie(
+        fig = cached_figure(figure_cache_key('salary_pie', version=get_data_version()), lambda: px.pie(
             spending_df,
             values='Amount',
             names='Category',
             title='Your Spending from Income'
-        )
+        ))
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No expenses found to generate a pie chart.")
 
+    st.markdown('---')
+    st.subheader('Statements & reports 🧾')
+    kind = st.radio('Report', ['Monthly statement', 'Year-end summary'], horizontal=True, key='report_kind')
+    rcol1, rcol2, rcol3 = st.columns([2, 1, 1])
+    with rcol1:
+        period = st.selectbox('Period', report_periods('month' if kind == 'Monthly statement' else 'year'), format_func=lambda p: p[0], key='report_period')
+    with rcol2:
+        fmt = st.selectbox('Format', reports.available_formats(), format_func=str.upper, key='report_fmt')
+    with rcol3:
+        st.write('')
+        generate = st.button('Generate report')
+    if generate:
+        status, _ = request_report(period, fmt)
+        if status == 'ready':
+            st.success('This report is up to date and ready to download below.')
+        else:
+            st.info('Report queued. It is built in the background; refresh to check on it.')
+
+    jobs = get_report_jobs()
+    if not jobs.empty:
+        if st.button('Refresh report status'):
+            safe_rerun()
+        for job in jobs.itertuples():
+            label = f"{job.period} · {job.fmt.upper()} · v{job.data_version}"
+            if job.status == 'ready' and job.path and os.path.exists(job.path):
+                with open(job.path, 'rb') as f:
+                    st.download_button(f'⬇️ {label}', f.read(), file_name=f'statement_{job.period}.{job.fmt}',
+                                       mime=reports.REPORT_MIME_TYPES.get(job.fmt), key=f'report_dl_{job.id}')
+            elif job.status == 'pending':
+                st.write(f'⏳ {label}: building…')
+            elif job.status == 'failed':
+                st.write(f'⚠️ {label}: failed ({job.error})')
+            else:
+                st.write(f'🗂️ {label}: superseded by newer data')
+
 def savings_page():
     if not st.session_state.logged_in:
         st.warning("Please log in to access your savings goals.")
@@ -1024,11 +4541,12 @@ def savings_page():
         goal_name = st.text_input('Goal Name (e.g. Vacation, Emergency Fund)')
         target_amount = st.number_input('Target Amount (₹)', min_value=0.0, format='%f')
         deadline = st.date_input('Deadline (optional)', value=None, min_value=datetime.today())
+        priority = st.selectbox('Priority (1 = fund first)', GOAL_PRIORITIES, index=GOAL_PRIORITIES.index(DEFAULT_GOAL_PRIORITY))
         note = st.text_input('Note (optional)')
         submitted = st.form_submit_button('Add Goal')
         if submitted:
             if goal_name and target_amount > 0:
-                add_savings_goal(goal_name, target_amount, deadline.isoformat() if deadline else None, note)
+                add_savings_goal(goal_name, target_amount, deadline.isoformat() if deadline else None, note, priority)
                 st.success(f'Added savings goal: {goal_name}')
                 safe_rerun()
             else:
@@ -1037,33 +4555,50 @@ def savings_page():
     # --- View and Manage Savings Goals ---
     st.markdown('---')
     st.subheader('Your Savings Goals')
-    goals = get_savings_goals()
+    # Saved amounts are only recomputed (and written) when the ledger, goals or strategy changed since the last view
+    goals = refresh_goal_allocations()
     if goals.empty:
         st.info('No savings goals yet. Add one above!')
     else:
-        # Calculate net savings from transactions
-        transactions = get_transactions()
-        total_income = transactions[transactions['ttype'].str.lower() == 'income']['amount'].sum() if not transactions.empty else 0
-        total_expenses = transactions[transactions['ttype'].str.lower() == 'expense']['amount'].sum() if not transactions.empty else 0
-        net_savings = total_income - total_expenses
-        
-        # Distribute net savings evenly across goals for simplicity (can be customized later)
-        num_goals = len(goals)
-        if num_goals > 0 and net_savings > 0:
-            allocated_per_goal = net_savings / num_goals
-            goals['current_amount'] = allocated_per_goal
-            for _, row in goals.iterrows():
-                update_savings_goal(row['id'], current_amount=allocated_per_goal)
-        else:
-            goals['current_amount'] = 0.0
+        strategy = get_savings_strategy()
+        strategy_keys = list(SAVINGS_STRATEGIES)
+        chosen_strategy = st.selectbox('Allocate net savings by', strategy_keys, index=strategy_keys.index(strategy),
+                                       format_func=SAVINGS_STRATEGIES.get,
+                                       help='Explicit contributions are earmarked first. Priority waterfall fills goals one at a time by priority, then '
+                                            'deadline; deadline-weighted favours large gaps with close deadlines; proportional fills every goal at the same pace.')
+        if chosen_strategy != strategy:
+            set_savings_strategy(chosen_strategy)
+            safe_rerun()
 
         goals['progress'] = goals.apply(lambda x: min((x['current_amount'] / x['target_amount']) * 100, 100) if x['target_amount'] > 0 else 0, axis=1)
         goals['deadline'] = pd.to_datetime(goals['deadline']).dt.date
-        display_df = goals[['id', 'goal_name', 'target_amount', 'current_amount', 'progress', 'deadline', 'note']].rename(
-            columns={'id': 'ID', 'goal_name': 'Goal', 'target_amount': 'Target (₹)', 'current_amount': 'Saved (₹)', 'progress': 'Progress (%)', 'deadline': 'Deadline', 'note': 'Note'}
+        display_df = goals[['id', 'goal_name', 'priority', 'target_amount', 'current_amount', 'progress', 'deadline', 'note']].rename(
+            columns={'id': 'ID', 'goal_name': 'Goal', 'priority': 'Priority', 'target_amount': 'Target (₹)', 'current_amount': 'Saved (₹)', 'progress': 'Progress (%)', 'deadline': 'Deadline', 'note': 'Note'}
         )
         st.dataframe(display_df.set_index('ID'))
 
+        # --- Attainment Outlook ---
+        st.subheader('Goal Outlook 🎲')
+        projected = get_goal_projections(st.session_state.user_id, get_data_version())
+        outlook = None
+        if projected is None:
+            st.info('Log some income and expenses to see how likely you are to reach each goal.')
+        else:
+            outlook, fit = projected
+            st.caption(f"Based on {MONTE_CARLO_PATHS:,} simulated paths of your monthly net savings "
+                       f"(₹{fit['monthly_mean']:,.0f} ± ₹{fit['monthly_std']:,.0f} a month over {fit['months_of_history']} month(s)), "
+                       f"shared between goals by the {SAVINGS_STRATEGIES[strategy].lower()} strategy.")
+            outlook = goals[['id', 'goal_name', 'target_amount', 'deadline']].merge(outlook, on='id')
+            outlook_df = pd.DataFrame({
+                'Goal': outlook['goal_name'],
+                'Deadline': outlook['deadline'],
+                'Chance by Deadline (%)': (outlook['probability'] * 100).round(1),
+                'Likely at Deadline (₹)': [f'{p10:,.0f} – {p90:,.0f}' if pd.notnull(p10) else '—' for p10, p90 in zip(outlook['p10'], outlook['p90'])],
+                'Median Time to Target': [f'{months:.0f} months' if np.isfinite(months) else f'over {MONTE_CARLO_HORIZON_MONTHS // 12} years' for months in outlook['median_months']],
+            }, index=outlook['id'].rename('ID'))
+            st.dataframe(outlook_df)
+            outlook = outlook.set_index('id')
+
         # --- Edit Savings Goal ---
         st.subheader('Edit Savings Goal')
         goal_ids = goals['id'].tolist()
@@ -1074,6 +4609,8 @@ def savings_page():
                 edit_goal_name = st.text_input('Goal Name', value=goal_data['goal_name'])
                 edit_target_amount = st.number_input('Target Amount (₹)', min_value=0.0, value=float(goal_data['target_amount']), format='%f')
                 edit_deadline = st.date_input('Deadline (optional)', value=pd.to_datetime(goal_data['deadline']) if pd.notnull(goal_data['deadline']) else None, min_value=datetime.today())
+                current_priority = int(goal_data['priority']) if pd.notnull(goal_data['priority']) else DEFAULT_GOAL_PRIORITY
+                edit_priority = st.selectbox('Priority (1 = fund first)', GOAL_PRIORITIES, index=GOAL_PRIORITIES.index(current_priority))
                 edit_note = st.text_input('Note (optional)', value=goal_data['note'] if pd.notnull(goal_data['note']) else '')
                 edit_submitted = st.form_submit_button('Update Goal')
                 if edit_submitted:
@@ -1083,13 +4620,40 @@ def savings_page():
                             goal_name=edit_goal_name,
                             target_amount=edit_target_amount,
                             deadline=edit_deadline.isoformat() if edit_deadline else None,
-                            note=edit_note
+                            note=edit_note,
+                            priority=edit_priority
                         )
                         st.success(f'Updated savings goal: {edit_goal_name}')
                         safe_rerun()
                     else:
                         st.error('Goal name and target amount are required, and target amount must be greater than 0.')
 
+        # --- Contributions ---
+        st.subheader('Contributions')
+        st.caption('Money you set aside for a specific goal. It counts towards that goal before the rest of your net savings are allocated.')
+        goal_names = dict(zip(goals['id'], goals['goal_name']))
+        with st.form('goal_contribution_form'):
+            contribution_goal = st.selectbox('Goal', list(goal_names), format_func=goal_names.get)
+            contribution_amount = st.number_input('Amount (₹, negative to withdraw)', value=0.0, format='%f')
+            contribution_date = st.date_input('Date', value=datetime.today())
+            contribution_note = st.text_input('Note (optional)', key='contribution_note')
+            if st.form_submit_button('Add Contribution'):
+                if contribution_amount != 0:
+                    add_goal_contribution(int(contribution_goal), contribution_amount, contribution_date.isoformat(), contribution_note)
+                    st.success(f'Recorded ₹{contribution_amount:,.2f} for {goal_names[contribution_goal]}')
+                    safe_rerun()
+                else:
+                    st.error('Enter a non-zero amount.')
+        contributions = get_goal_contributions()
+        if not contributions.empty:
+            st.dataframe(contributions.rename(columns={'id': 'ID', 'goal_name': 'Goal', 'amount': 'Amount (₹)', 'cdate': 'Date', 'note': 'Note'})
+                         .drop(columns=['goal_id']).set_index('ID'))
+            contribution_to_remove = st.selectbox('Select Contribution ID to Delete', options=['Select ID'] + contributions['id'].tolist())
+            if st.button('Delete Contribution') and contribution_to_remove != 'Select ID':
+                remove_goal_contribution(int(contribution_to_remove))
+                st.success('Contribution deleted.')
+                safe_rerun()
+
         # --- Delete Savings Goal ---
         st.subheader('Delete Savings Goal')
         to_remove = st.selectbox('Select Goal ID to Delete', options=['Select ID'] + goal_ids)
@@ -1108,23 +4672,204 @@ def savings_page():
             if pd.notnull(row['deadline']):
                 days_left = (pd.to_datetime(row['deadline']) - datetime.today()).days
                 st.write(f"Deadline: {row['deadline']} ({days_left} days left)" if days_left >= 0 else f"Deadline: {row['deadline']} (Overdue by {abs(days_left)} days)")
+                if outlook is not None and row['id'] in outlook.index and pd.notnull(outlook.at[row['id'], 'probability']):
+                    chance = outlook.at[row['id'], 'probability'] * 100
+                    st.write(f"Chance of reaching it by the deadline: **{chance:.0f}%**" + (" ⚠️" if chance < 50 else ""))
             st.markdown('---')
 
-# --- NEWS INTEGRATION (mock) ---
-
-def fetch_news(symbol):
-    mock_news = {
-        "AAPL": [
-            {"title": "Apple unveils new iPhone model with advanced camera features.", "source": "TechCrunch", "publishedAt": "2023-10-27T10:00:00Z"},
-        ],
-        "MSFT": [
-            {"title": "Microsoft announces major AI integration into Windows.", "source": "The Verge", "publishedAt": "2023-10-27T09:00:00Z"},
-        ],
-        "TCS.NS": [
-            {"title": "TCS reports robust revenue growth, exceeding expectations.", "source": "Economic Times", "publishedAt": "2023-10-27T08:00:00Z"},
-        ]
+# --- NEWS INGESTION & INDEX ---
+
+def news_tokens(text):
+    return set(re.findall(r'[a-z0-9&]+', (text or '').lower()))
+
+def parse_news_date(value):
+    if not value:
+        return None
+    try:
+        published = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        try:
+            published = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if published.tzinfo is not None:
+        published = published.astimezone(timezone.utc).replace(tzinfo=None)
+    return published
+
+def make_news_article(title, summary='', link='', source='', published=None, symbols=None, guid=None):
+    published_at = parse_news_date(published)
+    article_key = guid or link or f'{title}|{published}'
+    return {
+        'id': hashlib.sha1(article_key.encode()).hexdigest()[:16],
+        'title': (title or '').strip(),
+        'summary': (summary or '').strip(),
+        'link': link or '',
+        'source': source or '',
+        'publishedAt': published_at.isoformat() + 'Z' if published_at else '',
+        'published_ts': published_at.replace(tzinfo=timezone.utc).timestamp() if published_at else 0.0,
+        'symbols': [str(symbol).upper() for symbol in (symbols or [])],
     }
-    return mock_news.get(symbol.upper(), [])
+
+def iter_xml_feed(path):
+    # iterparse keeps memory flat: each <item>/<entry> is turned into an article and then cleared
+    default_source = os.path.splitext(os.path.basename(path))[0]
+    source = None
+    depth_in_item = 0
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if event == 'start':
+            if tag in ('item', 'entry'):
+                depth_in_item += 1
+            continue
+        if tag == 'title' and not depth_in_item and source is None:
+            source = (elem.text or '').strip()
+        elif tag in ('item', 'entry'):
+            depth_in_item -= 1
+            fields = {}
+            categories = []
+            for child in elem:
+                child_tag = child.tag.rsplit('}', 1)[-1]
+                if child_tag == 'link' and child.get('href'):
+                    fields.setdefault('link', child.get('href'))
+                elif child_tag == 'category':
+                    categories.append(child.get('term') or child.text or '')
+                else:
+                    fields.setdefault(child_tag, (child.text or '').strip())
+            yield make_news_article(
+                fields.get('title'),
+                fields.get('description') or fields.get('summary') or fields.get('content'),
+                fields.get('link'),
+                source or default_source,
+                fields.get('pubDate') or fields.get('published') or fields.get('updated'),
+                [category for category in categories if category],
+                fields.get('guid') or fields.get('id'),
+            )
+            elem.clear()
+
+def json_news_article(item, default_source):
+    source = item.get('source') or default_source
+    if isinstance(source, dict):
+        source = source.get('name') or default_source
+    return make_news_article(
+        item.get('title'),
+        item.get('description') or item.get('summary'),
+        item.get('url') or item.get('link'),
+        source,
+        item.get('publishedAt') or item.get('published'),
+        item.get('symbols') or item.get('tickers'),
+        item.get('id'),
+    )
+
+def iter_feed_articles(path):
+    default_source = os.path.splitext(os.path.basename(path))[0]
+    if path.endswith(('.xml', '.rss', '.atom')):
+        yield from iter_xml_feed(path)
+    elif path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json_news_article(json.loads(line), default_source)
+    else:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        items = data.get('articles', []) if isinstance(data, dict) else data
+        for item in items:
+            yield json_news_article(item, default_source)
+
+class NewsIndex:
+    # Bounded cache of recent articles plus an inverted index token -> article ids.
+    # Tokens come from titles/summaries and from explicit feed symbols (stored as '$symbol').
+    def __init__(self, news_dir=NEWS_DIR, max_articles=NEWS_CACHE_SIZE):
+        self.news_dir = news_dir
+        self.max_articles = max_articles
+        self.articles = {}
+        self.article_tokens = {}
+        self.postings = {}
+        self.by_age = []  # heap of (published_ts, id) so the oldest article is evicted first
+        self.file_state = {}  # path -> (mtime, size) already ingested
+        self.last_scan = 0.0
+        self.lock = threading.Lock()
+
+    def refresh(self, force=False):
+        if not force and time.time() - self.last_scan < NEWS_REFRESH_SECONDS:
+            return 0
+        with self.lock:
+            self.last_scan = time.time()
+            if not os.path.isdir(self.news_dir):
+                return 0
+            added = 0
+            for entry in os.scandir(self.news_dir):
+                if not entry.is_file() or not entry.name.endswith(NEWS_FEED_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                state = (stat.st_mtime, stat.st_size)
+                if self.file_state.get(entry.path) == state:
+                    continue
+                try:
+                    for article in iter_feed_articles(entry.path):
+                        added += self._add(article)
+                except (ET.ParseError, ValueError, OSError, AttributeError):
+                    # Half-written dumps are picked up again on the next scan
+                    continue
+                self.file_state[entry.path] = state
+            return added
+
+    def _add(self, article):
+        if not article['title'] or article['id'] in self.articles:
+            return 0
+        if len(self.articles) >= self.max_articles and self.by_age and article['published_ts'] <= self.by_age[0][0]:
+            return 0
+        tokens = news_tokens(article['title']) | news_tokens(article['summary']) | {f'${symbol.lower()}' for symbol in article['symbols']}
+        self.articles[article['id']] = article
+        self.article_tokens[article['id']] = tokens
+        for token in tokens:
+            self.postings.setdefault(token, set()).add(article['id'])
+        heapq.heappush(self.by_age, (article['published_ts'], article['id']))
+        while len(self.articles) > self.max_articles:
+            _, oldest_id = heapq.heappop(self.by_age)
+            self._evict(oldest_id)
+        return 1
+
+    def _evict(self, article_id):
+        self.articles.pop(article_id, None)
+        for token in self.article_tokens.pop(article_id, ()):
+            ids = self.postings.get(token)
+            if ids is not None:
+                ids.discard(article_id)
+                if not ids:
+                    del self.postings[token]
+
+    def query(self, symbols, names=None, limit=10):
+        # An article matches a symbol if it is tagged with it, mentions its ticker, or mentions every distinctive company-name word
+        names = names or {}
+        with self.lock:
+            matched = set()
+            for symbol in symbols:
+                matched |= self.postings.get(f'${symbol.lower()}', set())
+                base = symbol.lower().lstrip('^').split('.')[0]
+                if len(base) >= 3:
+                    matched |= self.postings.get(base, set())
+                name_tokens = news_tokens(names.get(symbol)) - NEWS_STOPWORDS
+                if name_tokens:
+                    token_postings = sorted((self.postings.get(token, set()) for token in name_tokens), key=len)
+                    matched |= set.intersection(*token_postings)
+            articles = [self.articles[article_id] for article_id in matched]
+        return heapq.nlargest(limit, articles, key=lambda article: article['published_ts'])
+
+@st.cache_resource(show_spinner=False)
+def get_news_index():
+    return NewsIndex()
+
+def get_ticker_names():
+    return build_ticker_index(get_ticker_universe_version())['names']
+
+def fetch_news(symbol, limit=10):
+    return fetch_portfolio_news([symbol], limit)
+
+def fetch_portfolio_news(symbols, limit=10):
+    index = get_news_index()
+    index.refresh()
+    return index.query([symbol.upper() for symbol in symbols], get_ticker_names(), limit)
 
 def market_lookup_page():
     if not st.session_state.logged_in:
@@ -1140,37 +4885,38 @@ def market_lookup_page():
     else:
         st.info("Quickly look up stock prices and historical data.")
 
-    symbol = st.text_input('Ticker symbol (e.g. AAPL, MSFT, TCS.NS)')
+    query = st.text_input('Ticker symbol or company (e.g. AAPL, Infosys, TCS.NS)')
+    symbol = query.strip().upper()
+    if symbol:
+        matches = search_tickers(query)
+        if matches:
+            names = dict(matches)
+            options = list(names)
+            if symbol not in names:
+                options.append(symbol)
+            symbol = st.selectbox('Matching symbols', options,
+                                  format_func=lambda sym: f"{sym} (as typed)" if sym not in names else f"{sym} — {names[sym]}" if names[sym] else sym)
+        else:
+            st.caption('No matches in the local ticker list; the symbol will be looked up as typed.')
     
     if st.button('Lookup'):
         if not symbol:
             st.error('Enter a ticker symbol')
         else:
-            price = fetch_price_yfinance(symbol)
-            if price:
-                st.metric(f'{symbol.upper()} price', f"₹{price:.2f}")
-                hist = yf.download(symbol, period='60d', progress=False)
-                if not hist.empty:
-                    # Simplify column names if MultiIndex exists
-                    if isinstance(hist.columns, pd.MultiIndex):
-                        hist.columns = [col[0] if isinstance(col, tuple) else col for col in hist.columns]
-                    # Reset index to make Date a column
-                    hist = hist.reset_index()
-                    # Ensure 'Date' and 'Close' columns exist
-                    if 'Date' in hist.columns and 'Close' in hist.columns:
-                        fig = px.line(hist, x='Date', y='Close', title=f'{symbol.upper()} - Last 60 days')
-                        st.plotly_chart(fig, use_container_width=True)
-                    else:
-                        st.warning('Expected columns (Date, Close) not found in data.')
-                else:
-                    st.warning('Price not found for that symbol')
-                st.subheader(f"News for {symbol.upper()}")
+            hist = get_symbol_history(symbol)
+            if not hist.empty:
+                price = float(hist['Close'].iloc[-1])
+                quote_currency = get_symbol_currencies([symbol])[symbol]
+                st.metric(f'{symbol} price', format_money(price, quote_currency))
+                plot_line(hist, 'Date', 'Close', f'{symbol} - Last 60 days', key='lookup_history',
+                          cache_key=figure_cache_key('lookup_history', (symbol,), int(time.time() // SYMBOL_HISTORY_TTL), shared=True))
+                st.subheader(f"News for {symbol}")
                 news_articles = fetch_news(symbol)
                 if news_articles:
                     for article in news_articles:
                         st.write(f"**[{article['title']}]** ({article['source']})")
                 else:
-                    st.info(f"No recent news found for {symbol.upper()}.")
+                    st.info(f"No recent news found for {symbol}.")
             else:
                 st.warning('Price not found for that symbol. Cannot fetch news without a valid symbol.')
 
@@ -1190,9 +4936,11 @@ def get_personalized_guidance(user_profile, holdings_df, transactions_df):
 
     guidance += "---\n\n"
 
-    transactions_df = transactions_df if transactions_df is not None else get_transactions()
-    total_income = transactions_df[transactions_df['ttype'].str.lower() == 'income']['amount'].sum() if not transactions_df.empty else 0
-    total_expenses = transactions_df[transactions_df['ttype'].str.lower() == 'expense']['amount'].sum() if not transactions_df.empty else 0
+    if transactions_df is None:
+        total_income, total_expenses = get_income_expense_totals()
+    else:
+        total_income = transactions_df[transactions_df['ttype'] == 'income']['amount'].sum() if not transactions_df.empty else 0
+        total_expenses = transactions_df[transactions_df['ttype'] == 'expense']['amount'].sum() if not transactions_df.empty else 0
     net_balance = total_income - total_expenses
 
     if net_balance > 0 and total_income > 0:
@@ -1201,11 +4949,16 @@ def get_personalized_guidance(user_profile, holdings_df, transactions_df):
     else:
         guidance += "It looks like your expenses are close to or exceeding your income. Focus on identifying and reducing unnecessary expenses before focusing on large-scale investments.\n\n"
 
+    forecasts = get_category_forecasts()
+    warnings = overspend_warnings(forecasts)
+    if warnings:
+        guidance += "⚠️ **Heads up on this month's spending:**\n\n" + "".join(f"- {warning}\n" for warning in warnings) + "\n"
+    elif not forecasts.empty:
+        guidance += f"Your spending is tracking its forecast this month. Next month, expect about **₹{forecasts['next_month'].sum():,.0f}** in expenses.\n\n"
+
     holdings_df = holdings_df.copy() if holdings_df is not None else pd.DataFrame()
     if not holdings_df.empty and 'market_value' not in holdings_df.columns:
-        prices = [fetch_price_yfinance(r['symbol']) for _, r in holdings_df.iterrows()]
-        holdings_df['price'] = [p if p is not None else 0.0 for p in prices]
-        holdings_df['market_value'] = holdings_df['shares'] * holdings_df['price']
+        holdings_df = value_holdings(holdings_df)
 
     holdings_value = holdings_df['market_value'].sum() if not holdings_df.empty else 0
     if holdings_value > 0:
@@ -1216,8 +4969,15 @@ def get_personalized_guidance(user_profile, holdings_df, transactions_df):
             guidance += "With a **moderate risk tolerance**, a mix of stable and growth-oriented stocks could be a good fit. Diversification across different sectors is key.\n\n"
         elif risk_tolerance == 'high':
             guidance += "With a **high risk tolerance**, you're in a position to explore high-growth stocks, small-cap companies, or even some alternative investments. Just remember to only invest what you can afford to lose.\n\n"
+        plan = rebalance_portfolio(holdings_shares(holdings_df), base_currency=get_base_currency()) if risk_tolerance in RISK_AVERSION else None
+        if plan is not None:
+            target = plan['profiles'][risk_tolerance]
+            trades = rebalance_trades(plan, risk_tolerance)
+            guidance += (f"For your profile, the optimized mix targets about **{target['expected_return'] * 100:.1f}%** expected return at "
+                         f"**{target['volatility'] * 100:.1f}%** volatility (currently {plan['current_return'] * 100:.1f}% at {plan['current_volatility'] * 100:.1f}%)"
+                         + (f"; see the {len(trades)} suggested trade(s) on the Portfolio page.\n\n" if not trades.empty else ", and your holdings are already close to it.\n\n"))
 
-    savings_goals = get_savings_goals()
+    savings_goals = refresh_goal_allocations()
     if not savings_goals.empty:
         total_target = savings_goals['target_amount'].sum()
         total_saved = savings_goals['current_amount'].sum()
@@ -1232,7 +4992,9 @@ def get_personalized_guidance(user_profile, holdings_df, transactions_df):
 
 def main():
     st.set_page_config(page_title="Personal Finance App", layout="wide")
-    init_db()
+    ensure_db()
+    start_maintenance_scheduler()
+    get_price_alert_engine()
 
     if not st.session_state.logged_in:
         st.title("📊 Personal Finance App")
@@ -1247,6 +5009,7 @@ def main():
 
     st.title("📊 Personal Finance App")
     user_profile = get_user_profile()
+    touch_held_symbols(st.session_state.user_id)
 
     st.sidebar.markdown(format_text_for_user(
         "Hello! 👋 This is your personal financial assistant. Navigate through the sections to track your portfolio, manage your budget, savings goals, and get personalized insights.",
@@ -1269,18 +5032,14 @@ def main():
         st.header("Your Financial Dashboard")
         st.info("Ask about budgeting, investments, savings, taxes, or financial statements for personalized advice!")
         
-        tx_all = get_transactions()
         holdings_df = get_holdings()
 
         if not holdings_df.empty and 'market_value' not in holdings_df.columns:
-            prices = [fetch_price_yfinance(r['symbol']) for _, r in holdings_df.iterrows()]
-            holdings_df['price'] = [p if p is not None else 0.0 for p in prices]
-            holdings_df['market_value'] = holdings_df['shares'] * holdings_df['price']
+            holdings_df = value_holdings(holdings_df)
 
         savings_goal = user_profile.get('savings_goal', 0.0)
         if savings_goal > 0:
-            total_income = tx_all[tx_all['ttype'].str.lower() == 'income']['amount'].sum() if not tx_all.empty else 0
-            total_expenses = tx_all[tx_all['ttype'].str.lower() == 'expense']['amount'].sum() if not tx_all.empty else 0
+            total_income, total_expenses = get_income_expense_totals()
             net_balance = total_income - total_expenses
             progress = net_balance / savings_goal if savings_goal > 0 else 0
             progress = max(0, min(1, progress))
@@ -1297,8 +5056,28 @@ def main():
                 st.balloons()
                 st.success("🎉 Congratulations! You have reached your overall savings goal!")
 
+        price_alerts = get_price_alerts(status='triggered', unseen_only=True)
+        if not price_alerts.empty:
+            st.markdown('---')
+            st.subheader('Price Alerts 📈')
+            for alert in price_alerts.itertuples():
+                st.info(price_alert_text(alert))
+            if st.button('Dismiss price alerts'):
+                dismiss_price_alerts()
+                safe_rerun()
+
+        budget_alerts = get_budget_alerts()
+        if not budget_alerts.empty:
+            st.markdown('---')
+            st.subheader('Budget Alerts 🔔')
+            for alert in budget_alerts.itertuples():
+                (st.error if alert.level == 'exceeded' else st.warning)(budget_alert_text(alert))
+            if st.button('Dismiss alerts'):
+                dismiss_budget_alerts()
+                safe_rerun()
+
         st.markdown('---')
-        st.markdown(get_personalized_guidance(user_profile, holdings_df, tx_all))
+        st.markdown(get_personalized_guidance(user_profile, holdings_df, None))
 
         st.markdown('---')
         st.subheader("Ask your Financial Assistant")
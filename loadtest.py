@@ -0,0 +1,283 @@
+# Concurrent-session load test for financeapp.py.
+#
+# Drives N headless sessions (Streamlit's AppTest) through login, Dashboard, Portfolio and Budget against a freshly
+# seeded database, with yfinance and Alpha Vantage replaced by local stubs whose latency is configurable.
+# All sessions share one process, so they share st.cache_* entries and the single DB writer just like one server does.
+#
+#   python loadtest.py --sessions 16 --iterations 5 --quote-latency 0.2 --history-latency 0.5
+import os
+import sys
+import json
+import time
+import types
+import zlib
+import hashlib
+import sqlite3
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED_SYMBOLS = ['RELIANCE.NS', 'TCS.NS', 'INFY.NS', 'HDFCBANK.NS', 'AAPL', 'MSFT', 'GOOGL', 'AMZN']
+SEED_CATEGORIES = {'income': ['salary', 'freelance'], 'expense': ['groceries', 'rent', 'transport', 'dining', 'utilities', 'shopping']}
+PASSWORD = 'loadtest'
+FLOW = ['login', 'dashboard', 'portfolio', 'quote', 'budget', 'add_transaction']
+
+# --- Data provider stubs ---
+
+def stub_price(symbol, day=0):
+    # Deterministic random walk per symbol so repeated runs see the same prices
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    start = rng.uniform(50, 3000)
+    steps = rng.normal(0.0003, 0.015, size=day + 1)
+    return float(start * np.exp(steps.sum()))
+
+def stub_currency(symbol):
+    return 'INR' if symbol.endswith(('.NS', '.BO')) or symbol.startswith('^NSE') else 'USD'
+
+def make_yfinance_stub(quote_latency, history_latency):
+    yf = types.ModuleType('yfinance')
+
+    class Ticker:
+        def __init__(self, symbol):
+            self.symbol = symbol.upper()
+
+        @property
+        def fast_info(self):
+            time.sleep(quote_latency)
+            return {'last_price': stub_price(self.symbol), 'currency': stub_currency(self.symbol)}
+
+        def history(self, period='1d'):
+            time.sleep(history_latency)
+            return pd.DataFrame({'Close': [stub_price(self.symbol)]}, index=pd.DatetimeIndex([pd.Timestamp.today().normalize()], name='Date'))
+
+        def get_info(self):
+            time.sleep(quote_latency)
+            return {'sector': ['Technology', 'Financials', 'Energy', 'Consumer'][zlib.crc32(self.symbol.encode()) % 4],
+                    'regularMarketPrice': stub_price(self.symbol), 'currency': stub_currency(self.symbol)}
+
+    def download(tickers, start=None, end=None, period=None, progress=False, **kwargs):
+        time.sleep(history_latency)
+        symbols = [tickers] if isinstance(tickers, str) else list(tickers)
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp.today().normalize()
+        if start is not None:
+            start = pd.Timestamp(start)
+        else:
+            start = end - pd.Timedelta(days=int(str(period or '60d').rstrip('d')))
+        dates = pd.bdate_range(start, end, inclusive='left', name='Date')
+        close = pd.DataFrame({symbol: [stub_price(symbol, i) for i in range(len(dates))] for symbol in symbols}, index=dates)
+        close.columns = pd.MultiIndex.from_product([['Close'], symbols])
+        return close
+
+    yf.Ticker = Ticker
+    yf.download = download
+    return yf
+
+def start_alpha_vantage_stub(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            query = dict(part.split('=', 1) for part in self.path.partition('?')[2].split('&') if '=' in part)
+            body = json.dumps({'Global Quote': {'01. symbol': query.get('symbol', ''), '05. price': f"{stub_price(query.get('symbol', '')):.4f}"}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, name='alpha-vantage-stub', daemon=True).start()
+    return server
+
+# --- Seeding ---
+
+def seed_database(db_path, users, transactions_per_user, holdings_per_user):
+    # Runs after one warm-up app run has created the schema; writes the same columns the app's helpers write
+    rng = np.random.default_rng(42)
+    epoch = datetime(1970, 1, 1)
+    today = datetime.today()
+    now = datetime.utcnow().isoformat()
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    usernames = []
+    for n in range(users):
+        username = f'loadtest{n}'
+        c.execute('INSERT INTO users (username, password_hash, email, created_at) VALUES (?, ?, ?, ?)',
+                  (username, hashlib.sha256(PASSWORD.encode()).hexdigest(), f'{username}@example.com', now))
+        user_id = c.lastrowid
+        usernames.append(username)
+        c.execute('INSERT INTO user_profile (user_id, user_type, savings_goal, risk_tolerance, base_currency) VALUES (?, ?, ?, ?, ?)',
+                  (user_id, 'professional', 500000.0, 'moderate', 'INR'))
+
+        category_ids = {}
+        for ttype, names in SEED_CATEGORIES.items():
+            for name in names:
+                c.execute('INSERT INTO categories (user_id, name) VALUES (?, ?)', (user_id, name))
+                category_ids[name] = (0 if ttype == 'income' else 1, c.lastrowid)
+        names = list(category_ids)
+        rows = []
+        for _ in range(transactions_per_user):
+            day = today - timedelta(days=int(rng.integers(0, 730)))
+            ttype, category_id = category_ids[names[int(rng.integers(0, len(names)))]]
+            amount = float(rng.uniform(20000, 120000) if ttype == 0 else rng.lognormal(7, 1))
+            rows.append((user_id, day.date().isoformat(), (day - epoch).days, ttype, category_id, round(amount, 2), ''))
+        c.executemany('INSERT INTO transactions (user_id, tdate, tday, ttype, category_id, amount, note) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+        for symbol in rng.choice(SEED_SYMBOLS, size=min(holdings_per_user, len(SEED_SYMBOLS)), replace=False):
+            symbol = str(symbol)
+            shares = float(rng.integers(1, 100))
+            price = round(stub_price(symbol) * rng.uniform(0.8, 1.1), 2)
+            c.execute('INSERT INTO trades (user_id, symbol, side, shares, price, tdate, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      (user_id, symbol, 'buy', shares, price, now, now))
+            c.execute('INSERT INTO lots (user_id, symbol, trade_id, shares_open, price, opened_at) VALUES (?, ?, ?, ?, ?, ?)',
+                      (user_id, symbol, c.lastrowid, shares, price, now))
+            c.execute('INSERT INTO positions (user_id, symbol, shares, cost_basis, realized_pnl, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                      (user_id, symbol, shares, shares * price, 0.0, now))
+
+        c.execute('INSERT INTO savings_goals (user_id, goal_name, target_amount, current_amount, deadline, note, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                  (user_id, 'Emergency fund', 300000.0, 0.0, (today + timedelta(days=365)).date().isoformat(), '', now))
+        c.execute('INSERT INTO data_versions (user_id, version) VALUES (?, 1)', (user_id,))
+    c.execute('REPLACE INTO config (key, value) VALUES (?, ?)', ('alpha_vantage_key', 'loadtest'))
+    conn.commit()
+    conn.close()
+    return usernames
+
+# --- Sessions ---
+
+def find_widget(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f'No widget labelled {label!r}')
+
+class SessionRunner:
+    def __init__(self, script, timeout):
+        self.script = script
+        self.timeout = timeout
+        self.samples = []  # (step, seconds)
+        self.errors = []
+
+    def timed(self, step, at):
+        started = time.perf_counter()
+        at.run(timeout=self.timeout)
+        self.samples.append((step, time.perf_counter() - started))
+        if at.exception:
+            self.errors.append((step, at.exception[0].message))
+
+    def run(self, username, iterations):
+        from streamlit.testing.v1 import AppTest
+        at = AppTest.from_file(self.script, default_timeout=self.timeout)
+        at.run()
+        find_widget(at.text_input, 'Username').input(username)
+        find_widget(at.text_input, 'Password').input(PASSWORD)
+        find_widget(at.button, 'Login').click()
+        self.timed('login', at)
+        if not at.session_state['logged_in']:
+            self.errors.append(('login', f'{username} could not log in'))
+            return self
+        for i in range(iterations):
+            at.sidebar.radio[0].set_value('Dashboard')
+            self.timed('dashboard', at)
+            at.sidebar.radio[0].set_value('Portfolio')
+            self.timed('portfolio', at)
+            at.selectbox(key='api_choice_quick').set_value('alpha_vantage')
+            at.text_input(key='quick').input(SEED_SYMBOLS[i % len(SEED_SYMBOLS)])
+            at.button(key='get_price').click()
+            self.timed('quote', at)
+            at.sidebar.radio[0].set_value('Budget & Transactions')
+            self.timed('budget', at)
+            find_widget(at.text_input, 'Category (e.g. Salary, Groceries; leave blank to auto-fill from the note)').input('groceries')
+            find_widget(at.number_input, 'Amount').set_value(float(100 + i))
+            find_widget(at.button, 'Add transaction').click()
+            self.timed('add_transaction', at)
+        return self
+
+def writer_stats():
+    for thread in threading.enumerate():
+        if thread.name == 'db-writer' and hasattr(thread, 'writer'):
+            return thread.writer.stats()
+    return None
+
+def percentile_table(samples):
+    df = pd.DataFrame(samples, columns=['step', 'seconds'])
+    rows = []
+    for step in FLOW + ['all']:
+        values = df['seconds'] if step == 'all' else df.loc[df['step'] == step, 'seconds']
+        if values.empty:
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        rows.append({'step': step, 'reruns': len(values), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': values.max() * 1000})
+    return pd.DataFrame(rows).set_index('step').round(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent-session load test for financeapp.py')
+    parser.add_argument('--sessions', type=int, default=8, help='concurrent headless sessions')
+    parser.add_argument('--iterations', type=int, default=3, help='Dashboard/Portfolio/Budget rounds per session')
+    parser.add_argument('--users', type=int, default=None, help='seeded users (defaults to one per session)')
+    parser.add_argument('--transactions', type=int, default=2000, help='seeded transactions per user')
+    parser.add_argument('--holdings', type=int, default=5, help='seeded holdings per user')
+    parser.add_argument('--quote-latency', type=float, default=0.1, help='seconds per stubbed quote call')
+    parser.add_argument('--history-latency', type=float, default=0.3, help='seconds per stubbed history download')
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds allowed per rerun')
+    parser.add_argument('--db', default=None, help='database file to seed (defaults to a temporary file)')
+    parser.add_argument('--script', default=os.path.join(APP_DIR, 'financeapp.py'))
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db or os.path.join(tempfile.mkdtemp(prefix='finance-loadtest-'), 'finance_app.db'))
+    if os.path.exists(db_path):
+        sys.exit(f'{db_path} already exists; pass a new path so the seed is reproducible.')
+    alpha_vantage = start_alpha_vantage_stub(args.quote_latency)
+    os.environ['FINANCE_DB_PATH'] = db_path
+    os.environ['FINANCE_ALPHA_VANTAGE_URL'] = f'http://127.0.0.1:{alpha_vantage.server_port}/query'
+    sys.modules['yfinance'] = make_yfinance_stub(args.quote_latency, args.history_latency)
+    os.chdir(os.path.dirname(os.path.abspath(args.script)))
+    sys.path.insert(0, os.getcwd())
+
+    from streamlit.testing.v1 import AppTest
+    print(f'Seeding {db_path} ...')
+    warmup = AppTest.from_file(args.script, default_timeout=args.timeout)
+    warmup.run()  # creates the schema and starts the shared DB writer
+    usernames = seed_database(db_path, args.users or args.sessions, args.transactions, args.holdings)
+
+    print(f'Running {args.sessions} sessions x {args.iterations} iterations '
+          f'(quote latency {args.quote_latency}s, history latency {args.history_latency}s) ...')
+    started = time.perf_counter()
+    runners = []
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [pool.submit(SessionRunner(args.script, args.timeout).run, usernames[i % len(usernames)], args.iterations)
+                   for i in range(args.sessions)]
+        for future in as_completed(futures):
+            runners.append(future.result())
+    elapsed = time.perf_counter() - started
+
+    samples = [sample for runner in runners for sample in runner.samples]
+    errors = [error for runner in runners for error in runner.errors]
+    print(f'\nRerun latency ({len(samples)} reruns in {elapsed:.1f}s, {len(samples) / elapsed:.1f} reruns/s)')
+    print(percentile_table(samples).to_string())
+
+    stats = writer_stats()
+    if stats:
+        print('\nDB writer')
+        print(f"  writes: {stats['committed']} committed, {stats['failed']} failed, {stats['rejected']} rejected in {stats['batches']} batches "
+              f"(largest {stats['max_batch_size']}, max queue depth {stats['max_queue_depth']})")
+        print(f"  lock waits: {stats['lock_waits']} (total {stats['total_lock_wait_ms']:.1f} ms, max {stats['max_lock_wait_ms']:.1f} ms)")
+        print(f"  queue wait: avg {stats['avg_queue_wait_ms']:.1f} ms, max {stats['max_queue_wait_ms']:.1f} ms; "
+              f"commit avg {stats['avg_commit_ms']:.1f} ms, max {stats['max_commit_ms']:.1f} ms")
+    if errors:
+        print(f'\n{len(errors)} errors')
+        for step, message in errors[:20]:
+            print(f'  [{step}] {message}')
+    alpha_vantage.shutdown()
+    sys.exit(1 if errors else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# Statement/report builders for financeapp.py.
+# These run inside worker processes, so this module must not import Streamlit or touch session state:
+# everything it needs comes in as arguments and straight from the SQLite database.
+import os
+import csv
+import sqlite3
+import pandas as pd
+
+# Same integer encoding as financeapp.TTYPE_LABELS
+TTYPE_LABELS = ['income', 'expense']
+
+REPORT_MIME_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf',
+}
+
+def available_formats():
+    formats = ['csv']
+    try:
+        import openpyxl  # noqa: F401
+        formats.append('xlsx')
+    except ImportError:
+        try:
+            import xlsxwriter  # noqa: F401
+            formats.append('xlsx')
+        except ImportError:
+            pass
+    try:
+        import reportlab  # noqa: F401
+        formats.append('pdf')
+    except ImportError:
+        pass
+    return formats
+
+def load_report_sections(db_path, user_id, start_tday, end_tday, portfolio_records):
+    conn = sqlite3.connect(db_path)
+    transactions = pd.read_sql_query('''
+        SELECT t.tday, t.ttype, c.name AS category, t.amount, t.note
+        FROM (
+            SELECT id, user_id, tday, ttype, category_id, amount, note FROM transactions
+            UNION ALL
+            SELECT id, user_id, tday, ttype, category_id, amount, note FROM transactions_archive
+        ) t LEFT JOIN categories c ON c.id = t.category_id
+        WHERE t.user_id = ? AND t.tday BETWEEN ? AND ?
+        ORDER BY t.tday, t.id
+    ''', conn, params=(user_id, start_tday, end_tday))
+    goals = pd.read_sql_query('SELECT goal_name, target_amount, current_amount, deadline FROM savings_goals WHERE user_id = ? ORDER BY created_at',
+                              conn, params=(user_id,))
+    conn.close()
+
+    transactions['Date'] = pd.to_datetime(transactions['tday'], unit='D').dt.date
+    transactions['Type'] = pd.Categorical.from_codes(transactions['ttype'].fillna(-1).astype(int), categories=TTYPE_LABELS)
+    totals = transactions.groupby('Type', observed=False)['amount'].sum()
+    total_income = float(totals.get('income', 0.0))
+    total_expenses = float(totals.get('expense', 0.0))
+    savings_rate = (total_income - total_expenses) / total_income * 100 if total_income > 0 else 0.0
+    summary = pd.DataFrame({
+        'Metric': ['Total Income', 'Total Expenses', 'Net Balance', 'Savings Rate (%)', 'Transactions'],
+        'Value': [round(total_income, 2), round(total_expenses, 2), round(total_income - total_expenses, 2), round(savings_rate, 1), len(transactions)],
+    })
+
+    expenses = transactions[transactions['Type'] == 'expense']
+    category_spend = expenses.groupby('category')['amount'].sum().sort_values(ascending=False).reset_index()
+    category_spend.columns = ['Category', 'Amount']
+    category_spend['Share (%)'] = (category_spend['Amount'] / total_expenses * 100).round(1) if total_expenses > 0 else 0.0
+
+    goals['Progress (%)'] = (goals['current_amount'] / goals['target_amount'] * 100).clip(upper=100).round(1)
+    goals = goals.rename(columns={'goal_name': 'Goal', 'target_amount': 'Target', 'current_amount': 'Saved', 'deadline': 'Deadline'})
+
+    ledger = transactions[['Date', 'Type', 'category', 'amount', 'note']].rename(columns={'category': 'Category', 'amount': 'Amount', 'note': 'Note'})
+    portfolio = pd.DataFrame(portfolio_records or [])
+    return {
+        'Summary': summary,
+        'Category Spend': category_spend,
+        'Savings Goals': goals,
+        'Portfolio': portfolio,
+        'Transactions': ledger,
+    }
+
+def write_csv(sections, title, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([title])
+        for name, df in sections.items():
+            writer.writerow([])
+            writer.writerow([name])
+            if df.empty:
+                writer.writerow(['(none)'])
+                continue
+            writer.writerow(df.columns)
+            writer.writerows(df.itertuples(index=False))
+
+def write_xlsx(sections, title, path):
+    with pd.ExcelWriter(path) as writer:
+        for name, df in sections.items():
+            (df if not df.empty else pd.DataFrame({name: ['(none)']})).to_excel(writer, sheet_name=name[:31], index=False)
+
+def write_pdf(sections, title, path):
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    styles = getSampleStyleSheet()
+    story = [Paragraph(title, styles['Title'])]
+    for name, df in sections.items():
+        story.append(Spacer(1, 12))
+        story.append(Paragraph(name, styles['Heading2']))
+        if df.empty:
+            story.append(Paragraph('(none)', styles['Normal']))
+            continue
+        rows = [list(df.columns)] + [['' if pd.isna(value) else str(value) for value in row] for row in df.itertuples(index=False)]
+        table = Table(rows, repeatRows=1)
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ]))
+        story.append(table)
+    SimpleDocTemplate(path, pagesize=A4).build(story)
+
+REPORT_WRITERS = {'csv': write_csv, 'xlsx': write_xlsx, 'pdf': write_pdf}
+
+def build_report(db_path, user_id, title, start_tday, end_tday, fmt, out_path, portfolio_records=None):
+    # Entry point for the process pool; writes to a temp file first so a half-built report is never served
+    if fmt not in REPORT_WRITERS:
+        raise ValueError(f"Unsupported report format: {fmt}")
+    sections = load_report_sections(db_path, user_id, start_tday, end_tday, portfolio_records)
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    root, ext = os.path.splitext(out_path)
+    tmp_path = f'{root}.{os.getpid()}.tmp{ext}'  # keep the extension; ExcelWriter picks its engine from it
+    REPORT_WRITERS[fmt](sections, title, tmp_path)
+    os.replace(tmp_path, out_path)
+    return out_path